@@ -70,6 +70,14 @@ setuptools.setup(
     entry_points={
         'console_scripts': [
             'tsufvml_decision_tree = tsufvml.cli:decision_tree_main',
+            'tsufvml_model = tsufvml.cli:model_main',
+            'tsufvml_batch = tsufvml.batch:main',
+            'tsufvml_decision_tree_sweep = '
+            'tsufvml.cli:decision_tree_sweep_main',
+            'tsufvml_bench = tsufvml.bench.run:main',
+            'tsufvml_serve = tsufvml.serve:serve_cli_main',
+            'tsufvml_submit = tsufvml.serve:submit_cli_main',
+            'tsufvml_score = tsufvml.score:main',
             #'tsufvml_interpret = tsufvml.cli:interpret_main',
         ],
     },
@@ -0,0 +1,42 @@
+"""
+Tests of running batches of jobs with `tsufvml.batch`
+"""
+
+# Copyright (c) 2019 Aubrey Barnard.
+#
+# This is free software released under the MIT License.  See
+# `LICENSE.txt` for details.
+
+
+import os
+
+from tsufvml import batch
+
+
+def test_error_records_have_the_fields_of_other_records(tmp_path):
+    data_filename = str(tmp_path / 'data.svmlight')
+    with open(data_filename, 'wt') as file:
+        file.write('1 1:1\n0 2:1\n' * 20)
+    jobs = [
+        dict(name='ok', data_matrix_filename=data_filename,
+             output=str(tmp_path / 'ok.yaml'), random_seed=0),
+        # Fails in the worker before the job is run
+        dict(name='no output', data_matrix_filename=data_filename),
+        # Fails before the job is submitted
+        dict(name='no data',
+             data_matrix_filename=str(tmp_path / 'nope.svmlight'),
+             output=str(tmp_path / 'nope.yaml')),
+    ]
+    records = batch.run_batch(jobs, n_procs=2)
+    assert [record['status'] for record in records] == [
+        'ok', 'error', 'error']
+    assert os.path.exists(str(tmp_path / 'ok.yaml'))
+    fields = {'name', 'data', 'output', 'status', 'seconds'}
+    for (job, record) in zip(jobs, records):
+        assert fields <= set(record)
+        assert record['name'] == job['name']
+        assert record['data'] == job['data_matrix_filename']
+        assert record['output'] == job.get('output')
+        assert record['seconds'] >= 0
+    assert records[1]['message'].startswith('KeyError')
+    assert records[2]['message'].startswith('FileNotFoundError')
@@ -0,0 +1,85 @@
+"""
+Tests of running models through `tsufvml.cli`
+"""
+
+# Copyright (c) 2019 Aubrey Barnard.
+#
+# This is free software released under the MIT License.  See
+# `LICENSE.txt` for details.
+
+
+import io
+import os
+import tracemalloc
+
+import numpy
+import pytest
+
+from tsufvml import cli
+
+
+def _write_data(dirname):
+    rng = numpy.random.RandomState(0)
+    filename = os.path.join(str(dirname), 'data.svmlight')
+    with open(filename, 'wt') as file:
+        for _ in range(200):
+            label = rng.randint(2)
+            feat_ids = numpy.flatnonzero(
+                rng.uniform(size=10) < (0.2 + 0.4 * label)) + 1
+            file.write(' '.join(
+                [str(label)] + ['{}:1'.format(feat_id)
+                                for feat_id in feat_ids]) + '\n')
+    return filename
+
+
+def _cached_results(cache_dir):
+    if not os.path.exists(cache_dir):
+        return []
+    return [name for name in os.listdir(cache_dir)
+            if name.endswith('.pickle')]
+
+
+def _run(data_filename, cache_dir, random_seed):
+    output = io.StringIO()
+    cli.run_models_api(
+        data_filename, model_args=dict(max_depth=2, random_state=0),
+        output=output, random_seed=random_seed,
+        result_cache_dir=cache_dir)
+    return output.getvalue()
+
+
+def test_unseeded_runs_are_not_cached(tmp_path):
+    data_filename = _write_data(tmp_path)
+    cache_dir = str(tmp_path / 'results')
+    _run(data_filename, cache_dir, None)
+    assert _cached_results(cache_dir) == []
+    # Seeded runs cache their fits and report, and reuse the report
+    report = _run(data_filename, cache_dir, 1)
+    assert len(_cached_results(cache_dir)) == 2
+    assert _run(data_filename, cache_dir, 1) == report
+    assert len(_cached_results(cache_dir)) == 2
+
+
+def test_failed_profiled_run_stops_tracing_memory(tmp_path):
+    data_filename = _write_data(tmp_path)
+    with pytest.raises(ValueError):
+        cli.run_models_api(
+            data_filename, weight_feature='nope', output=io.StringIO(),
+            profile=True)
+    assert not tracemalloc.is_tracing()
+
+
+@pytest.mark.parametrize('module_name, function_name', [
+    ('batch', 'batch_main'),
+    ('score', 'score_main'),
+    ('serve', 'serve_main'),
+    ('serve', 'submit_main'),
+])
+def test_entry_points_parse_given_arguments(
+        module_name, function_name, capsys):
+    import importlib
+    module = importlib.import_module('tsufvml.' + module_name)
+    with pytest.raises(SystemExit) as exc_info:
+        getattr(module, function_name)('prog_name', '--help')
+    assert exc_info.value.code == 0
+    assert capsys.readouterr().out.startswith('usage: prog_name ')
@@ -0,0 +1,125 @@
+"""
+Tests of `tsufvml.common`: parsing svmlight data and writing reports
+"""
+
+# Copyright (c) 2019 Aubrey Barnard.
+#
+# This is free software released under the MIT License.  See
+# `LICENSE.txt` for details.
+
+
+import io
+import json
+import math
+
+import numpy
+import pytest
+from sklearn import datasets
+
+from tsufvml import common
+
+
+_svmlight_text = b"""# Comment
+1 1:1 3:2.5 7:1 # Trailing comment
+0 qid:4 2:-1 3:1e-3
+
+1 7:4
+0 1:0.5 2:2 3:3 4:4
+"""
+
+
+def _load_filtered(text, **args):
+    return common.load_svmlight_filtered(io.BytesIO(text), **args)
+
+
+@pytest.mark.parametrize('chunk_n_lines', [1, 2, 100])
+def test_load_svmlight_filtered_matches_sklearn(chunk_n_lines):
+    expected_data, expected_labels = datasets.load_svmlight_file(
+        io.BytesIO(_svmlight_text))
+    data, labels, weights, rm2orig_idxs = _load_filtered(
+        _svmlight_text, chunk_n_lines=chunk_n_lines)
+    numpy.testing.assert_array_equal(
+        data.toarray(), expected_data.toarray())
+    numpy.testing.assert_array_equal(labels, expected_labels)
+    assert weights is None
+    numpy.testing.assert_array_equal(rm2orig_idxs, numpy.arange(7))
+
+
+def test_load_svmlight_filtered_features_and_weights():
+    expected_data, _ = datasets.load_svmlight_file(
+        io.BytesIO(_svmlight_text))
+    data, _, weights, rm2orig_idxs = _load_filtered(
+        _svmlight_text, feature_ids=[2, 7, 9], weight_feature_id=3)
+    numpy.testing.assert_array_equal(rm2orig_idxs, [1, 6])
+    numpy.testing.assert_array_equal(
+        data.toarray(), expected_data[:, [1, 6]].toarray())
+    # Rows without the weight feature have a weight of zero
+    numpy.testing.assert_array_equal(weights, [2.5, 1e-3, 0, 3])
+
+
+def test_missing_weight_feature_is_an_error():
+    with pytest.raises(ValueError, match='Weight feature not found'):
+        _load_filtered(_svmlight_text, weight_feature_id=5)
+
+
+@pytest.mark.parametrize('line', [b'1 2:x', b'1 2:', b'1 2:3:4', b'1 2'])
+def test_malformed_data_is_an_error(line):
+    with pytest.raises(ValueError, match='Malformed'):
+        list(common.iter_svmlight_chunks(io.BytesIO(line + b'\n')))
+
+
+def test_mean_defined_area():
+    assert common.mean_defined_area([0.5, 0.75]) == (0.625, 0)
+    assert common.mean_defined_area([0.5, float('nan'), 0.75]) == (
+        0.625, 1)
+    mean, n_undefined = common.mean_defined_area([float('nan')] * 2)
+    assert math.isnan(mean) and n_undefined == 2
+
+
+def _fold_without_positives_evaluation():
+    from tsufvml import evaluation
+    labels = numpy.array([0, 1, 0, 1, 0, 1, 0, 0, 0])
+    scores = numpy.array([.1, .9, .2, .7, .4, .3, .5, .6, .8])
+    folds = numpy.array([0, 0, 1, 1, 2, 2, 3, 3, 3])
+    return evaluation.evaluate_predictions(labels, scores, folds=folds)
+
+
+@pytest.mark.parametrize('report_format', ['yaml', 'jsonl'])
+def test_report_of_fold_without_positives(report_format):
+    cv_evaluation = _fold_without_positives_evaluation()
+    cv_roc_areas = cv_evaluation['fold_roc_areas']
+    assert math.isnan(cv_roc_areas[3])
+    output = io.StringIO()
+    common.print_report(
+        cv_roc_areas=cv_roc_areas, cv_evaluation=cv_evaluation,
+        output=output, report_format=report_format)
+    expected_mean = (1.0 + 1.0 + 0.0) / 3
+    if report_format == 'yaml':
+        text = output.getvalue()
+        assert 'mean ROC area: {!s}\n'.format(expected_mean) in text
+        assert 'folds with undefined ROC area: 1\n' in text
+        assert 'folds with undefined PR area: 1\n' in text
+        # Undefined areas are sorted last
+        assert text.index('  - 0.0\n') < text.index('  - nan\n')
+    else:
+        records = {record['record']: record for record in map(
+            json.loads, output.getvalue().splitlines())}
+        assert records['mean_cv_roc_area'] == dict(
+            record='mean_cv_roc_area', roc_area=expected_mean,
+            n_undefined_folds=1)
+        assert records['mean_cv_pr_area']['n_undefined_folds'] == 1
+
+
+def test_sweep_report_ranks_undefined_means_last():
+    nan = float('nan')
+    output = io.StringIO()
+    common.print_sweep_report(
+        ['undefined', 'worse', 'better with undefined fold'],
+        [[nan, nan], [0.6, 0.7], [0.8, nan, 0.9]],
+        output=output)
+    text = output.getvalue()
+    ranked = [line.split(': ', 1)[1] for line in text.splitlines()
+              if line.startswith('    arguments: ')]
+    assert ranked == ['better with undefined fold', 'worse', 'undefined']
+    assert 'mean ROC area: {!s}\n'.format((0.8 + 0.9) / 2) in text
+    assert 'folds with undefined ROC area: 1\n' in text
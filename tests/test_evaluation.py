@@ -0,0 +1,123 @@
+"""
+Tests of `tsufvml.evaluation` against the areas of Scikit-Learn
+"""
+
+# Copyright (c) 2019 Aubrey Barnard.
+#
+# This is free software released under the MIT License.  See
+# `LICENSE.txt` for details.
+
+
+import math
+
+import numpy
+import pytest
+from sklearn import metrics
+
+from tsufvml import evaluation
+
+
+def _sklearn_areas(labels, scores, weights=None):
+    return (metrics.roc_auc_score(labels, scores, sample_weight=weights),
+            metrics.average_precision_score(
+                labels, scores, sample_weight=weights))
+
+
+def _random_predictions(n_examples, n_distinct_scores, seed):
+    rng = numpy.random.RandomState(seed)
+    labels = rng.randint(2, size=n_examples)
+    # Few distinct scores make many ties
+    scores = (rng.randint(n_distinct_scores, size=n_examples)
+              + 0.5 * labels) / n_distinct_scores
+    weights = rng.uniform(0.1, 3.0, size=n_examples)
+    return labels, scores, weights
+
+
+@pytest.mark.parametrize('n_distinct_scores', [3, 10, 1000])
+@pytest.mark.parametrize('seed', range(3))
+def test_areas_match_sklearn(n_distinct_scores, seed):
+    labels, scores, _ = _random_predictions(500, n_distinct_scores, seed)
+    result = evaluation.evaluate_predictions(labels, scores)
+    roc_area, pr_area = _sklearn_areas(labels, scores)
+    assert result['roc_area'] == pytest.approx(roc_area)
+    assert result['pr_area'] == pytest.approx(pr_area)
+
+
+@pytest.mark.parametrize('n_distinct_scores', [3, 1000])
+def test_weighted_areas_match_sklearn(n_distinct_scores):
+    labels, scores, weights = _random_predictions(
+        500, n_distinct_scores, 7)
+    result = evaluation.evaluate_predictions(
+        labels, scores, weights=weights)
+    roc_area, pr_area = _sklearn_areas(labels, scores, weights)
+    assert result['roc_area'] == pytest.approx(roc_area)
+    assert result['pr_area'] == pytest.approx(pr_area)
+
+
+def test_all_scores_tied():
+    labels = numpy.array([0, 1, 1, 0, 1])
+    scores = numpy.full(len(labels), 0.5)
+    result = evaluation.evaluate_predictions(labels, scores)
+    roc_area, pr_area = _sklearn_areas(labels, scores)
+    assert result['roc_area'] == pytest.approx(roc_area) == 0.5
+    assert result['pr_area'] == pytest.approx(pr_area)
+
+
+def test_non_binary_label_values():
+    # The greater label is the positive class
+    labels, scores, _ = _random_predictions(200, 10, 3)
+    result = evaluation.evaluate_predictions(labels * 2 - 1, scores)
+    roc_area, pr_area = _sklearn_areas(labels, scores)
+    assert result['roc_area'] == pytest.approx(roc_area)
+    assert result['pr_area'] == pytest.approx(pr_area)
+
+
+def test_fold_areas_match_sklearn():
+    labels, scores, weights = _random_predictions(600, 20, 11)
+    folds = numpy.arange(len(labels)) % 4
+    result = evaluation.evaluate_predictions(
+        labels, scores, weights=weights, folds=folds)
+    for fold_idx in range(4):
+        in_fold = folds == fold_idx
+        roc_area, pr_area = _sklearn_areas(
+            labels[in_fold], scores[in_fold], weights[in_fold])
+        assert result['fold_roc_areas'][fold_idx] == pytest.approx(
+            roc_area)
+        assert result['fold_pr_areas'][fold_idx] == pytest.approx(
+            pr_area)
+
+
+def test_single_class_fold_is_nan():
+    labels, scores, _ = _random_predictions(300, 20, 5)
+    folds = numpy.arange(len(labels)) % 3
+    # Make fold 1 all negative and fold 2 all positive
+    labels[folds == 1] = 0
+    labels[folds == 2] = 1
+    result = evaluation.evaluate_predictions(
+        labels, scores, folds=folds, n_folds=4)
+    assert len(result['fold_roc_areas']) == 4
+    in_fold = folds == 0
+    roc_area, pr_area = _sklearn_areas(labels[in_fold], scores[in_fold])
+    assert result['fold_roc_areas'][0] == pytest.approx(roc_area)
+    assert result['fold_pr_areas'][0] == pytest.approx(pr_area)
+    # Fold 1 lacks positives, fold 2 lacks negatives, and fold 3 is
+    # empty
+    for fold_idx in (1, 3):
+        assert math.isnan(result['fold_roc_areas'][fold_idx])
+        assert math.isnan(result['fold_pr_areas'][fold_idx])
+    assert math.isnan(result['fold_roc_areas'][2])
+
+
+def test_bootstrap_intervals():
+    labels, scores, weights = _random_predictions(400, 50, 13)
+    result = evaluation.evaluate_predictions(
+        labels, scores, weights=weights, n_bootstraps=200,
+        random_seed=0)
+    for name in ('roc_area', 'pr_area'):
+        low, high = result[name + '_interval']
+        assert 0 <= low < result[name] < high <= 1
+    # The bootstrap samples are determined by the seed
+    again = evaluation.evaluate_predictions(
+        labels, scores, weights=weights, n_bootstraps=200,
+        random_seed=0)
+    assert again == result
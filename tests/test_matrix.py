@@ -0,0 +1,184 @@
+"""
+Tests of `tsufvml.matrix`: the data cache, appending to stored arrays,
+and views of CSR matrices
+"""
+
+# Copyright (c) 2019 Aubrey Barnard.
+#
+# This is free software released under the MIT License.  See
+# `LICENSE.txt` for details.
+
+
+import os
+
+import numpy
+import pytest
+from scipy import sparse
+
+from tsufvml import common
+from tsufvml import matrix
+
+
+def _write_svmlight(filename, data, labels, mode='wt'):
+    with open(filename, mode) as file:
+        for row_idx in range(data.shape[0]):
+            row = data.getrow(row_idx)
+            file.write(' '.join(
+                ['{:g}'.format(labels[row_idx])]
+                + ['{}:{:g}'.format(col + 1, value)
+                   for (col, value) in sorted(zip(row.indices, row.data))])
+                + '\n')
+
+
+def _random_data(n_rows, n_cols, seed, max_value=5):
+    rng = numpy.random.RandomState(seed)
+    data = sparse.random(
+        n_rows, n_cols, density=0.2, format='csr', random_state=rng,
+        data_rvs=lambda size: rng.randint(1, max_value + 1, size=size))
+    labels = rng.randint(2, size=n_rows)
+    return data, labels
+
+
+def _assert_same_matrix(actual, expected):
+    assert actual.shape == expected.shape
+    numpy.testing.assert_array_equal(actual.toarray(), expected.toarray())
+
+
+def test_cache_round_trip(tmp_path):
+    filename = str(tmp_path / 'data.svmlight')
+    cache_dir = str(tmp_path / 'cache')
+    data, labels = _random_data(50, 20, 0)
+    _write_svmlight(filename, data, labels)
+    parsed_data, parsed_labels = common.load_svmlight_as_matrix(filename)
+    # The first load parses and stores, the second memory maps
+    for _ in range(2):
+        cached_data, cached_labels = matrix.load_svmlight_cached(
+            filename, cache_dir)
+        assert isinstance(cached_data, matrix.CsrView)
+        _assert_same_matrix(cached_data, parsed_data)
+        numpy.testing.assert_array_equal(cached_labels, parsed_labels)
+    assert len(os.listdir(cache_dir)) == 1
+
+
+def test_cache_replaced_file_is_reparsed(tmp_path):
+    filename = str(tmp_path / 'data.svmlight')
+    cache_dir = str(tmp_path / 'cache')
+    data, labels = _random_data(50, 20, 0)
+    _write_svmlight(filename, data, labels)
+    matrix.load_svmlight_cached(filename, cache_dir, incremental=True)
+    # A rewritten file is parsed again even if it is longer
+    new_data, new_labels = _random_data(60, 20, 1)
+    _write_svmlight(filename, new_data, new_labels)
+    cached_data, cached_labels = matrix.load_svmlight_cached(
+        filename, cache_dir, incremental=True)
+    parsed_data, parsed_labels = common.load_svmlight_as_matrix(filename)
+    _assert_same_matrix(cached_data, parsed_data)
+    numpy.testing.assert_array_equal(cached_labels, parsed_labels)
+
+
+@pytest.mark.parametrize('n_new_cols, max_new_value', [
+    (20, 5),
+    # New columns and values that do not fit the stored dtype
+    (30, 1000),
+])
+def test_incremental_append_equals_full_parse(
+        tmp_path, n_new_cols, max_new_value):
+    filename = str(tmp_path / 'data.svmlight')
+    cache_dir = str(tmp_path / 'cache')
+    data, labels = _random_data(50, 20, 0)
+    _write_svmlight(filename, data, labels)
+    matrix.load_svmlight_cached(filename, cache_dir, incremental=True)
+    entry_dir = matrix.cache_dir_for(
+        matrix.file_path(filename), cache_dir)
+    entry_inode = os.stat(entry_dir).st_ino
+    for seed in (1, 2):
+        new_data, new_labels = _random_data(
+            30, n_new_cols, seed, max_new_value)
+        _write_svmlight(filename, new_data, new_labels, mode='at')
+        cached_data, cached_labels = matrix.load_svmlight_cached(
+            filename, cache_dir, incremental=True)
+        parsed_data, parsed_labels = common.load_svmlight_as_matrix(
+            filename)
+        _assert_same_matrix(cached_data, parsed_data)
+        numpy.testing.assert_array_equal(cached_labels, parsed_labels)
+        # Appended to rather than replaced
+        assert os.stat(entry_dir).st_ino == entry_inode
+    # The appended entry is loaded as is
+    again_data, _ = matrix.load_svmlight_cached(filename, cache_dir)
+    _assert_same_matrix(again_data, parsed_data)
+
+
+@pytest.mark.parametrize('values', [
+    numpy.array([4, 5, 6], dtype=numpy.int8),
+    # Does not fit the stored dtype
+    numpy.array([300, -300]),
+    numpy.array([], dtype=numpy.int8),
+])
+def test_append_npy(tmp_path, values):
+    filename = str(tmp_path / 'array.npy')
+    old_values = numpy.array([1, 2, 3], dtype=numpy.int8)
+    numpy.save(filename, old_values)
+    matrix.append_npy(filename, values)
+    loaded = numpy.load(filename)
+    numpy.testing.assert_array_equal(
+        loaded, numpy.concatenate((old_values, values)))
+    if len(values) == 0 or values.dtype == numpy.int8:
+        assert loaded.dtype == numpy.int8
+
+
+def test_append_npy_in_place_keeps_memory_maps_valid(tmp_path):
+    filename = str(tmp_path / 'array.npy')
+    numpy.save(filename, numpy.arange(10, dtype=numpy.int64))
+    mapped = numpy.load(filename, mmap_mode='r')
+    matrix.append_npy(filename, numpy.arange(10, 15))
+    numpy.testing.assert_array_equal(mapped, numpy.arange(10))
+    numpy.testing.assert_array_equal(
+        numpy.load(filename), numpy.arange(15))
+
+
+def test_append_npy_rejects_2d_arrays(tmp_path):
+    filename = str(tmp_path / 'array.npy')
+    numpy.save(filename, numpy.zeros((2, 2)))
+    with pytest.raises(ValueError):
+        matrix.append_npy(filename, numpy.zeros(2))
+
+
+def _csr_view(data):
+    return matrix.CsrView(data.data, data.indices, data.indptr, data.shape)
+
+
+@pytest.mark.parametrize('rows', [
+    slice(None), slice(3, 17), slice(None, None, -2), 4, -1,
+    [5, 0, 5, 9], numpy.arange(20) % 3 == 0, [],
+])
+@pytest.mark.parametrize('cols', [
+    slice(None), slice(2, 9), [7, 0, 3], 5, numpy.arange(12) % 2 == 1,
+])
+def test_csr_view_matches_scipy(rows, cols):
+    data, _ = _random_data(20, 12, 3)
+    expected = data[numpy.atleast_1d(numpy.arange(20)[rows]), :][
+        :, numpy.atleast_1d(numpy.arange(12)[cols])]
+    view = _csr_view(data)[rows, cols]
+    assert view.shape == expected.shape
+    _assert_same_matrix(view.tocsr(), expected)
+
+
+def test_csr_view_of_view():
+    data, _ = _random_data(20, 12, 4)
+    rows = [2, 7, 11, 19, 0]
+    cols = [10, 1, 4, 6]
+    view = _csr_view(data)[rows, :][1:, cols][[0, 2], [3, 1]]
+    expected = data[rows, :][1:, cols][[0, 2], :][:, [3, 1]]
+    _assert_same_matrix(view.tocsr(), expected)
+
+
+def test_csr_view_rejects_bad_indices():
+    view = _csr_view(_random_data(5, 4, 5)[0])
+    with pytest.raises(IndexError):
+        view[5, :]
+    with pytest.raises(IndexError):
+        view[:, [0.5]]
+    with pytest.raises(IndexError):
+        view[numpy.ones(3, dtype=bool), :]
+    with pytest.raises(IndexError):
+        view[0, 0, 0]
@@ -0,0 +1,112 @@
+"""
+Tests of `tsufvml.ml`
+"""
+
+# Copyright (c) 2019 Aubrey Barnard.
+#
+# This is free software released under the MIT License.  See
+# `LICENSE.txt` for details.
+
+
+import re
+import types
+
+import numpy
+import pytest
+from sklearn import tree
+
+from tsufvml import ml
+
+
+def _random_data(weighted, seed=0):
+    rng = numpy.random.RandomState(seed)
+    data = rng.randint(3, size=(500, 6)).astype(float)
+    labels = (data[:, 0] + rng.normal(size=500) > 1).astype(int)
+    weights = (rng.uniform(0.5, 2, size=500) if weighted
+               else numpy.ones(500))
+    return data, labels, weights
+
+
+def _fit_tree(data, labels, weights):
+    return tree.DecisionTreeClassifier(max_depth=3, random_state=0).fit(
+        data, labels, sample_weight=weights)
+
+
+def _node_values(dot_text):
+    """Return a dictionary of the value text of each node by ID."""
+    return {int(node_id): value for (node_id, value) in re.findall(
+        r'^(\d+) \[label=".*value = \[([^\]]*)\]', dot_text, re.M)}
+
+
+@pytest.mark.parametrize('weighted', [False, True])
+def test_node_values_are_class_counts(weighted):
+    data, labels, weights = _random_data(weighted)
+    dt_model = _fit_tree(data, labels, weights)
+    # Count the classes of the examples at each node
+    counts = numpy.zeros((dt_model.tree_.node_count, 2))
+    path = dt_model.decision_path(data).tocoo()
+    numpy.add.at(counts, (path.col, labels[path.row]), weights[path.row])
+    dot_text, _ = ml.render_decision_tree_as_dot(dt_model)
+    values = _node_values(dot_text)
+    assert sorted(values) == list(range(len(counts)))
+    for (node_id, value) in values.items():
+        numpy.testing.assert_allclose(
+            [float(v) for v in value.split(', ')], counts[node_id],
+            atol=1e-3)
+        # Counts are either all integers or all rounded
+        assert ('.' in value) == weighted
+
+
+@pytest.mark.parametrize('weighted', [False, True])
+def test_node_values_as_fractions_or_counts(weighted):
+    # Scikit-Learn 1.4 and later store class fractions in `tree_.value`
+    # and earlier versions store class counts
+    dt_model = _fit_tree(*_random_data(weighted))
+    tree_ = dt_model.tree_
+    fractions = tree_.value / tree_.value.sum(axis=2, keepdims=True)
+    counts = fractions * tree_.weighted_n_node_samples[:, None, None]
+    dot_text = ml.render_decision_tree_as_dot(dt_model)
+    for value in (fractions, counts):
+        fake_tree = types.SimpleNamespace(
+            value=value, **{name: getattr(tree_, name) for name in (
+                'children_left', 'children_right', 'feature',
+                'threshold', 'impurity', 'n_node_samples',
+                'weighted_n_node_samples')})
+        fake_model = types.SimpleNamespace(
+            tree_=fake_tree, criterion=dt_model.criterion)
+        assert ml.render_decision_tree_as_dot(fake_model) == dot_text
+
+
+def test_dense_row_nbytes():
+    from scipy import sparse
+    data = sparse.random(200, 40, density=0.1, format='csr',
+                         random_state=0)
+    labels = numpy.arange(200) % 2
+    assert ml._dense_row_nbytes(
+        ml.mk_model('dt').fit(data, labels)) == 0
+    hgb_model = ml.mk_model('hgb', dict(max_iter=3))
+    assert ml._dense_row_nbytes(hgb_model.fit(data, labels)) == 40 * 4
+    # Wrapped models densify only the kept columns
+    wrapped_model = ml.DownsampledClassifier(ml.ScreenedClassifier(
+        hgb_model, n_keep=10), controls_per_case=1, random_state=0)
+    assert ml._dense_row_nbytes(wrapped_model.fit(data, labels)) == 10 * 4
+
+
+@pytest.mark.parametrize('model_family, model_args', [
+    ('dt', {}),
+    ('hgb', dict(max_iter=3)),
+])
+def test_permutation_importances_in_batches(model_family, model_args):
+    from scipy import sparse
+    data = sparse.random(200, 40, density=0.1, format='csr',
+                         random_state=0)
+    labels = numpy.arange(200) % 2
+    model = ml.mk_model(model_family, model_args).fit(data, labels)
+    col_idxs = numpy.arange(0, 40, 2)
+    # One column per batch and all columns in one batch
+    for max_nbytes in (1, 2**30):
+        importances = ml.permutation_importances(
+            [model], [data], [labels], [None], [0.5], col_idxs, 40,
+            n_repeats=2, random_seed=0, max_batch_nbytes=max_nbytes)
+        assert numpy.isfinite(importances[col_idxs]).all()
+        assert numpy.isnan(importances[1::2]).all()
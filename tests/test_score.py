@@ -0,0 +1,103 @@
+"""
+Tests of `tsufvml.score` against the predictions of Scikit-Learn
+"""
+
+# Copyright (c) 2019 Aubrey Barnard.
+#
+# This is free software released under the MIT License.  See
+# `LICENSE.txt` for details.
+
+
+import io
+
+import numpy
+import pytest
+from scipy import sparse
+from sklearn import tree
+
+from tsufvml import score
+
+
+def _random_data(n_rows, n_cols, seed):
+    rng = numpy.random.RandomState(seed)
+    # Values of both signs, some of them repeated, so that missing
+    # (zero) values go both ways
+    data = sparse.random(
+        n_rows, n_cols, density=0.3, format='csr', random_state=rng,
+        data_rvs=lambda size: numpy.round(rng.normal(size=size), 1))
+    labels = (data[:, 0].toarray().ravel() + data[:, 1].toarray().ravel()
+              + rng.normal(scale=0.5, size=n_rows) > 0).astype(int)
+    return data, labels
+
+
+def _fit_tree(data, labels, seed, **args):
+    weights = numpy.random.RandomState(seed).uniform(0.5, 2, len(labels))
+    return tree.DecisionTreeClassifier(random_state=seed, **args).fit(
+        data, labels, sample_weight=weights)
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('max_depth', [1, 4, None])
+def test_predictions_match_sklearn(seed, max_depth):
+    data, labels = _random_data(400, 15, seed)
+    dt_model = _fit_tree(data, labels, seed, max_depth=max_depth)
+    model = score.TreeModel.from_decision_tree(dt_model)
+    test_data, _ = _random_data(300, 15, seed + 100)
+    coo = test_data.tocoo()
+    leaves = model.apply_sparse(
+        test_data.shape[0], coo.row.astype(numpy.int64),
+        coo.col.astype(numpy.int64), coo.data)
+    numpy.testing.assert_array_equal(leaves, dt_model.apply(test_data))
+    numpy.testing.assert_allclose(
+        model.predict_proba(test_data), dt_model.predict_proba(test_data))
+
+
+def test_limited_features_are_mapped_to_original_columns():
+    data, labels = _random_data(400, 15, 0)
+    rm2orig_idxs = numpy.array([1, 0, 4, 7, 12])
+    dt_model = _fit_tree(data[:, rm2orig_idxs], labels, 0)
+    model = score.TreeModel.from_decision_tree(dt_model, rm2orig_idxs)
+    assert set(model.used_col_idxs()) <= set(rm2orig_idxs)
+    test_data, _ = _random_data(300, 15, 1)
+    numpy.testing.assert_allclose(
+        model.predict_proba(test_data),
+        dt_model.predict_proba(test_data[:, rm2orig_idxs]))
+
+
+def test_save_and_load(tmp_path):
+    data, labels = _random_data(200, 10, 2)
+    dt_model = _fit_tree(data, labels, 2, max_depth=5)
+    filename = str(tmp_path / 'model.npz')
+    score.save_model(filename, dt_model)
+    model = score.load_model(filename)
+    numpy.testing.assert_allclose(
+        model.predict_proba(data), dt_model.predict_proba(data))
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_score_svmlight(tmp_path, n_jobs):
+    data, labels = _random_data(500, 10, 3)
+    dt_model = _fit_tree(data, labels, 3, max_depth=6)
+    model_filename = str(tmp_path / 'model.npz')
+    score.save_model(model_filename, dt_model)
+    data_filename = str(tmp_path / 'data.svmlight')
+    with open(data_filename, 'wt') as file:
+        for row_idx in range(data.shape[0]):
+            row = data.getrow(row_idx)
+            file.write(' '.join(
+                [str(labels[row_idx])]
+                + ['{}:{!r}'.format(col + 1, float(value))
+                   for (col, value) in zip(row.indices, row.data)])
+                + '\n')
+    output = io.BytesIO()
+    n_rows = score.score_svmlight(
+        model_filename, data_filename, output, n_jobs=n_jobs,
+        chunk_n_lines=37)
+    assert n_rows == data.shape[0]
+    lines = output.getvalue().decode().splitlines()
+    assert lines[0] == 'label\tprobability'
+    table = numpy.array([line.split('\t') for line in lines[1:]],
+                        dtype=float)
+    numpy.testing.assert_array_equal(table[:, 0], labels)
+    numpy.testing.assert_allclose(
+        table[:, 1], dt_model.predict_proba(data)[:, -1], rtol=1e-5)
@@ -0,0 +1,52 @@
+"""
+Tests that starting the command line interface stays cheap
+"""
+
+# Copyright (c) 2019 Aubrey Barnard.
+#
+# This is free software released under the MIT License.  See
+# `LICENSE.txt` for details.
+
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+# Directory containing the `tsufvml` package
+_top_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must not be imported just to parse command line arguments
+_heavy_modules = ('numpy', 'scipy', 'sklearn', 'joblib', 'tsufvml.ml')
+
+_script = """
+import json, sys
+import tsufvml.cli
+{}
+print(json.dumps([name for name in {!r} if name in sys.modules]))
+"""
+
+
+def _imported_heavy_modules(statement=''):
+    output = subprocess.check_output(
+        [sys.executable, '-c', _script.format(statement, _heavy_modules)],
+        cwd=_top_dir, universal_newlines=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def test_importing_cli_is_light():
+    assert _imported_heavy_modules() == []
+
+
+@pytest.mark.parametrize('args', [('--version',), ('--help',)])
+def test_parsing_arguments_is_light(args):
+    statement = '''
+try:
+    tsufvml.cli.decision_tree('tsufvml_decision_tree', *{!r})
+except SystemExit:
+    pass
+'''.format(args)
+    assert _imported_heavy_modules(statement) == []
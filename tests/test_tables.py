@@ -0,0 +1,78 @@
+"""
+Tests of loading and caching feature and concept tables
+"""
+
+# Copyright (c) 2019 Aubrey Barnard.
+#
+# This is free software released under the MIT License.  See
+# `LICENSE.txt` for details.
+
+
+import os
+
+from tsufvml import common
+
+
+_feature_table_text = """id|name|type|x|value
+3|wgt|int||
+4|drug|bin||c4
+# Comment
+7|dx|bin||
+"""
+
+_concept_table_text = """id\tdesc
+c4\tDrug number 4
+c5\t
+"""
+
+
+def _write_tables(dirname):
+    filenames = []
+    for (name, text) in (('features.psv', _feature_table_text),
+                         ('concepts.tsv', _concept_table_text)):
+        filename = os.path.join(str(dirname), name)
+        with open(filename, 'wt') as file:
+            file.write(text)
+        filenames.append(filename)
+    return filenames
+
+
+def _as_dicts(features, concepts):
+    return dict(features.items()), dict(concepts.items())
+
+
+def test_tables_are_cached_only_in_cache_dir(tmp_path):
+    table_dir = tmp_path / 'tables'
+    table_dir.mkdir()
+    cache_dir = str(tmp_path / 'cache')
+    features_filename, concepts_filename = _write_tables(table_dir)
+    expected = (
+        # Empty strings are `None`
+        {3: ('wgt', None), 4: ('drug', 'c4'), 7: ('dx', None)},
+        {'c4': 'Drug number 4', 'c5': None},
+    )
+    uncached = _as_dicts(
+        common.load_feature_table(features_filename),
+        common.load_concept_table(concepts_filename))
+    assert not os.path.exists(cache_dir)
+    # The first load writes the cache and the second reads it
+    cached = [
+        _as_dicts(
+            common.load_feature_table(features_filename, cache_dir),
+            common.load_concept_table(concepts_filename, cache_dir))
+        for _ in range(2)]
+    assert len(os.listdir(os.path.join(cache_dir, 'tables'))) == 2
+    assert sorted(os.listdir(str(table_dir))) == [
+        'concepts.tsv', 'features.psv']
+    for tables in [uncached] + cached:
+        assert tables == expected
+
+
+def test_changed_table_is_reloaded(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    features_filename, _ = _write_tables(tmp_path)
+    common.load_feature_table(features_filename, cache_dir)
+    with open(features_filename, 'at') as file:
+        file.write('9|new|bin||\n')
+    features = common.load_feature_table(features_filename, cache_dir)
+    assert features[9] == ('new', None)
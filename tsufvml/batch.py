@@ -0,0 +1,450 @@
+"""
+Batch modeling of many data files with a concurrent job scheduler
+
+A batch is described by a manifest in JSON Lines format: one job per
+line.  A job is a JSON object whose keys are the names of the
+arguments of `cli.run_models_api` (as for `tsufvml_submit`) plus
+`output`, the filename for the report of the job, and optionally
+`name`, which identifies the job in the summary.  For example:
+
+    {"name": "c1", "data_matrix_filename": "c1.svmlight", "output": "c1.yaml", "decision_tree_args": {"max_depth": 5}}
+
+Relative filenames are interpreted with respect to the directory of
+the manifest.  Feature and concept tables used by more than one job
+are loaded once, before the jobs start.
+
+Jobs run in a pool of worker processes, each of which runs one job at
+a time.  A job is only started if the estimated memory of the running
+jobs plus its own is within a limit, so large jobs do not run out of
+memory together.  (A job that alone exceeds the limit runs by itself.)
+Each job writes its own report, and a summary of all the jobs is
+written as JSON Lines in the order of the manifest.
+"""
+
+# Copyright (c) 2019 Aubrey Barnard.
+#
+# This is free software released under the MIT License.  See
+# `LICENSE.txt` for details.
+
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+import time
+
+import tsufvml
+from tsufvml import cli
+from tsufvml import common
+from tsufvml import serve
+
+
+# Keys of jobs in addition to the arguments of `cli.run_models_api`.
+# Jobs run in a single process each, so they cannot specify `n_jobs`.
+job_arg_names = tuple(
+    name for name in serve.job_arg_names if name != 'n_jobs'
+) + ('name', 'output')
+
+# Job arguments that are filenames
+job_filename_arg_names = serve.job_filename_arg_names + ('output',)
+
+# Kinds of tables that can be shared by jobs and the functions that
+# load them
+_table_loaders = dict(
+    features=('feature_table_filename', common.load_feature_table),
+    concepts=('concept_table_filename', common.load_concept_table),
+)
+
+# Tables shared by the jobs, by (kind, absolute path).  Set in each
+# worker process by `_init_worker`.
+_shared_tables = {}
+
+
+def load_manifest(filename, defaults={}):
+    """
+    Load the list of jobs in the given manifest (JSON Lines).
+
+    Each job is combined with the given default arguments, its
+    relative filenames are made absolute with respect to the directory
+    of the manifest, and it is given a name (by default, its line
+    number) if it has none.
+    """
+    base_dir = os.path.dirname(os.path.abspath(str(filename)))
+    jobs = []
+    with open(str(filename), 'rt') as file:
+        for (line_num, line) in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            job = json.loads(line)
+            if not isinstance(job, dict):
+                raise ValueError('Job not a JSON object: {}: line {}'
+                                 .format(filename, line_num))
+            unknown_args = set(job) - set(job_arg_names)
+            if unknown_args:
+                raise ValueError('Unknown job arguments: {}: line {}: {}'
+                                 .format(filename, line_num, ', '.join(
+                                     sorted(unknown_args))))
+            for name in ('data_matrix_filename', 'output'):
+                if job.get(name) is None:
+                    raise ValueError('Job has no `{}`: {}: line {}'
+                                     .format(name, filename, line_num))
+            # Treat `decision_tree_args` as in `tsufvml_submit` jobs
+            if 'decision_tree_args' in job:
+                if 'model_args' in job:
+                    raise ValueError(
+                        'Both `decision_tree_args` and `model_args` '
+                        'given: {}: line {}'.format(filename, line_num))
+                job['model_args'] = job.pop('decision_tree_args')
+            job = dict(defaults, **job)
+            for name in job_filename_arg_names:
+                if job.get(name) is not None:
+                    job[name] = os.path.join(base_dir, str(job[name]))
+            job.setdefault('name', str(line_num))
+            jobs.append(job)
+    return jobs
+
+
+def estimate_job_nbytes(job, nbytes_per_data_byte=4):
+    """
+    Estimate the peak memory of the given job from the size of its
+    data file.
+    """
+    return int(nbytes_per_data_byte * os.path.getsize(
+        job['data_matrix_filename']))
+
+
+def load_shared_tables(jobs):
+    """
+    Load the feature and concept tables that are used by more than one
+    of the given jobs (using the cache directory of the first of them
+    that has one).  Return a dictionary of the tables by (kind,
+    absolute path).
+    """
+    from barnapy import logging
+    from tsufvml import matrix
+    logger = logging.getLogger(__name__)
+    n_uses = {}
+    cache_dirs = {}
+    for job in jobs:
+        for (kind, (arg_name, _)) in _table_loaders.items():
+            path = matrix.file_path(job.get(arg_name))
+            if path is not None:
+                n_uses[kind, path] = n_uses.get((kind, path), 0) + 1
+                if cache_dirs.get((kind, path)) is None:
+                    cache_dirs[kind, path] = job.get('cache_dir')
+    tables = {}
+    for ((kind, path), n) in sorted(n_uses.items()):
+        if n > 1:
+            logger.info('Loading table shared by {} jobs: {}', n, path)
+            tables[kind, path] = _table_loaders[kind][1](
+                path, cache_dirs[kind, path])
+    return tables
+
+
+def _init_worker(tables):
+    _shared_tables.update(tables)
+
+
+def _memo_shared_tables(kind, filename, load):
+    from tsufvml import matrix
+    key = (kind, matrix.file_path(filename))
+    if key in _shared_tables:
+        return _shared_tables[key]
+    return load()
+
+
+def run_job(job):
+    """
+    Run the given batch job, writing its report to its output file.
+    Return a summary record (dictionary) of the job and its results.
+    """
+    from barnapy import logging
+    logger = logging.getLogger(__name__)
+    job = dict(job)
+    name = job.pop('name', None)
+    output_filename = job.pop('output')
+    record = dict(
+        name=name,
+        data=job.get('data_matrix_filename'),
+        output=output_filename,
+    )
+    start = time.perf_counter()
+    try:
+        logger.info('Running job: {}', name)
+        # Write the report to a temporary file so that the output is
+        # only ever a complete report
+        out_dir = os.path.dirname(output_filename)
+        os.makedirs(out_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=out_dir)
+        try:
+            with os.fdopen(fd, 'wt') as output:
+                results = cli.run_models_api(
+                    output=output,
+                    memo=_memo_shared_tables,
+                    memo_kinds=tuple(_table_loaders),
+                    **job
+                )
+            os.replace(tmp_path, output_filename)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        if results is None:
+            record['status'] = 'reused'
+        else:
+            cv_evaluation = results['cv_evaluation']
+            record.update(
+                status='ok',
+                mean_cv_roc_area=common.mean_defined_area(
+                    results['cv_roc_areas'])[0],
+                pooled_cv_roc_area=cv_evaluation['roc_area'],
+                pooled_cv_pr_area=cv_evaluation['pr_area'],
+                final_model_roc_area=results['final_model_roc_area'],
+            )
+    except Exception as e:
+        logger.exception('Job failed: {}', name)
+        record.update(status='error', message='{}: {}'.format(
+            type(e).__name__, e))
+    record['seconds'] = time.perf_counter() - start
+    return record
+
+
+def _error_record(job, error, seconds):
+    """
+    Return a summary record (see `run_job`) of the given job that failed
+    with the given error outside of `run_job`.
+    """
+    return dict(
+        name=job.get('name'),
+        data=job.get('data_matrix_filename'),
+        output=job.get('output'),
+        status='error',
+        message='{}: {}'.format(type(error).__name__, error),
+        seconds=seconds,
+    )
+
+
+def run_batch(
+        jobs, n_procs=1, max_nbytes=None, nbytes_per_data_byte=4):
+    """
+    Run the given jobs in a pool of `n_procs` worker processes and
+    return their summary records (see `run_job`) in the same order.
+
+    Jobs are started in order except that a job that does not fit
+    within `max_nbytes` of memory (see `estimate_job_nbytes`) along
+    with the running jobs is passed over for the next one that does.
+    Each worker process runs only one job so that the memory of a job
+    is returned to the OS when it finishes.
+    """
+    from barnapy import logging
+    logger = logging.getLogger(__name__)
+    # Do expensive imports now so that forked workers don't repeat them
+    from tsufvml import ml # noqa: F401 (sklearn)
+    tables = load_shared_tables(jobs)
+    records = [None] * len(jobs)
+    # Jobs whose memory cannot be estimated (e.g. because their data
+    # file is missing) fail without stopping the other jobs
+    job_nbytes = [None] * len(jobs)
+    pending = []
+    for (job_idx, job) in enumerate(jobs):
+        try:
+            job_nbytes[job_idx] = estimate_job_nbytes(
+                job, nbytes_per_data_byte)
+            pending.append(job_idx)
+        except Exception as e:
+            logger.error('Job failed: {}: {}: {}',
+                         job.get('name'), type(e).__name__, e)
+            records[job_idx] = _error_record(job, e, 0.0)
+    running = {}
+    finished = queue.Queue()
+
+    submit_times = {}
+
+    def on_error(job_idx):
+        def put_error(error):
+            finished.put((job_idx, _error_record(
+                jobs[job_idx], error,
+                time.perf_counter() - submit_times[job_idx])))
+        return put_error
+
+    pool = multiprocessing.Pool(
+        n_procs, _init_worker, (tables,), maxtasksperchild=1)
+    try:
+        while pending or running:
+            # Admit the jobs that fit
+            for job_idx in list(pending):
+                if len(running) >= n_procs:
+                    break
+                if (running and max_nbytes is not None
+                        and sum(running.values()) + job_nbytes[job_idx]
+                        > max_nbytes):
+                    continue
+                pending.remove(job_idx)
+                running[job_idx] = job_nbytes[job_idx]
+                submit_times[job_idx] = time.perf_counter()
+                pool.apply_async(
+                    run_job, (jobs[job_idx],),
+                    callback=(lambda record, job_idx=job_idx:
+                              finished.put((job_idx, record))),
+                    error_callback=on_error(job_idx))
+            # Wait for a job to finish
+            job_idx, record = finished.get()
+            del running[job_idx]
+            records[job_idx] = record
+            logger.info('Finished job {} of {}: {}: {}',
+                        sum(record is not None for record in records),
+                        len(jobs), record.get('name'), record['status'])
+    finally:
+        pool.terminate()
+        pool.join()
+    return records
+
+
+def physical_memory_nbytes():
+    """Return the size of the physical memory, if known."""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def batch_main(prog_name, *args):
+    arg_prsr = argparse.ArgumentParser(
+        prog=prog_name,
+        description=(
+            'Run the modeling jobs in the given manifest concurrently, '
+            'writing the report of each job to its `output` file and '
+            'a summary of the ROC areas of all the jobs as JSON Lines.  '
+            'The manifest has one job per line as a JSON object whose '
+            'keys are the names of the arguments of '
+            '`tsufvml.cli.run_models_api` plus `output` and optionally '
+            '`name`, e.g. {"data_matrix_filename": "c1.svmlight", '
+            '"output": "c1.yaml"}.  Relative filenames are interpreted '
+            'with respect to the directory of the manifest.'),
+        allow_abbrev=False,
+    )
+    arg_prsr.add_argument(
+        '--version',
+        action='version',
+        version='tsufvml {}'.format(tsufvml.__version__),
+    )
+    arg_prsr.add_argument(
+        'manifest',
+        metavar='MANIFEST',
+        help='File listing the jobs as JSON Lines.',
+    )
+    arg_prsr.add_argument(
+        '--features',
+        metavar='FILE',
+        help='Default feature table for jobs that do not specify one.',
+    )
+    arg_prsr.add_argument(
+        '--concepts',
+        metavar='FILE',
+        help='Default concept table for jobs that do not specify one.',
+    )
+    arg_prsr.add_argument(
+        '--weights',
+        metavar='FEATURE',
+        help=(
+            'Default weight feature (ID or name) for jobs that do not '
+            'specify one.'),
+    )
+    arg_prsr.add_argument(
+        '--seed',
+        type=int,
+        metavar='INT',
+        help='Default seed for assigning examples to CV folds.',
+    )
+    arg_prsr.add_argument(
+        '--cache-dir',
+        metavar='DIR',
+        help='Default directory for caching parsed data.',
+    )
+    arg_prsr.add_argument(
+        '--result-cache',
+        metavar='DIR',
+        help=(
+            'Default directory for caching fitted models and reports '
+            'by the contents of their inputs, so that rerunning a batch '
+            'only runs the jobs that changed.'),
+    )
+    arg_prsr.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        metavar='N',
+        help=(
+            'Maximum number of jobs to run at once, each in its own '
+            'process.  Use -1 for one per CPU.  [default: %(default)s]'),
+    )
+    arg_prsr.add_argument(
+        '--max-memory-mb',
+        type=float,
+        metavar='MB',
+        help=(
+            'Limit on the estimated memory of the jobs running at '
+            'once, in megabytes.  [default: half the physical memory]'),
+    )
+    arg_prsr.add_argument(
+        '--memory-factor',
+        type=float,
+        default=4,
+        metavar='X',
+        help=(
+            'Estimate of the peak memory of a job as a multiple of the '
+            'size of its data file.  [default: %(default)s]'),
+    )
+    arg_prsr.add_argument(
+        '--summary',
+        type=argparse.FileType('wt'),
+        default=sys.stdout,
+        metavar='FILE',
+        help='File for the summary of the jobs.  [default: stdout]',
+    )
+    env = vars(arg_prsr.parse_args(args))
+    cli.parse_weights_arg(env)
+    # Default job arguments.  Default filenames are relative to the
+    # current directory.
+    defaults = {}
+    for (name, value) in (('feature_table_filename', env['features']),
+                          ('concept_table_filename', env['concepts']),
+                          ('cache_dir', env['cache_dir']),
+                          ('result_cache_dir', env['result_cache'])):
+        if value is not None:
+            defaults[name] = os.path.abspath(value)
+    for (name, value) in (('weight_feature', env['weights']),
+                          ('random_seed', env['seed'])):
+        if value is not None:
+            defaults[name] = value
+    if env['max_memory_mb'] is not None:
+        max_nbytes = int(env['max_memory_mb'] * 2**20)
+    else:
+        phys_nbytes = physical_memory_nbytes()
+        max_nbytes = phys_nbytes // 2 if phys_nbytes else None
+    from barnapy import logging
+    logging.default_config()
+    try:
+        jobs = load_manifest(env['manifest'], defaults)
+    except (OSError, ValueError) as e:
+        arg_prsr.error(str(e))
+    n_procs = (multiprocessing.cpu_count() if env['jobs'] < 0
+               else max(env['jobs'], 1))
+    records = run_batch(
+        jobs, n_procs, max_nbytes,
+        nbytes_per_data_byte=env['memory_factor'])
+    summary = env['summary']
+    try:
+        for record in records:
+            summary.write(json.dumps(record, default=str))
+            summary.write('\n')
+    finally:
+        cli.close_output(summary)
+    if any(record['status'] == 'error' for record in records):
+        sys.exit(1)
+
+
+def main():
+    batch_main(os.path.basename(sys.argv[0]), *sys.argv[1:])
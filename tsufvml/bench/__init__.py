@@ -0,0 +1,11 @@
+"""
+Benchmarks of the modeling pipeline on synthetic data
+
+Run `tsufvml_bench --help` (or `python3 -m tsufvml.bench --help`) for
+usage.
+"""
+
+# Copyright (c) 2019 Aubrey Barnard.
+#
+# This is free software released under the MIT License.  See
+# `LICENSE.txt` for details.
@@ -0,0 +1,12 @@
+"""Run the benchmarks as `python3 -m tsufvml.bench`"""
+
+# Copyright (c) 2019 Aubrey Barnard.
+#
+# This is free software released under the MIT License.  See
+# `LICENSE.txt` for details.
+
+
+from tsufvml.bench import run
+
+
+run.main()
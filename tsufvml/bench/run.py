@@ -0,0 +1,276 @@
+"""Timing of each stage of the modeling pipeline on synthetic data"""
+
+# Copyright (c) 2019 Aubrey Barnard.
+#
+# This is free software released under the MIT License.  See
+# `LICENSE.txt` for details.
+
+
+import argparse
+import concurrent.futures
+import contextlib
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import tsufvml
+from tsufvml import cli
+from tsufvml import instrument
+
+
+# Modules that must not be imported just to parse command line arguments
+heavy_modules = ('numpy', 'scipy', 'sklearn', 'joblib')
+
+# Stages of earlier releases that are timed for comparison but are no
+# longer part of the pipeline
+replaced_stages = (
+    'render_decision_tree_as_graphviz',
+    'replace_variable_references_with_features',
+)
+
+# Script that times importing the CLI and handling `--version`
+_startup_script = """
+import json, sys, time
+start = time.perf_counter()
+import tsufvml.cli
+try:
+    tsufvml.cli.decision_tree('tsufvml_decision_tree', '--version')
+except SystemExit:
+    pass
+seconds = time.perf_counter() - start
+print(json.dumps(dict(
+    seconds=seconds,
+    heavy_modules=[name for name in {!r} if name in sys.modules],
+)))
+""".format(heavy_modules)
+
+
+def measure_startup(n_repeats=5, budget_seconds=None):
+    """
+    Time starting the CLI (importing it and handling `--version`) in
+    fresh interpreters and check which heavy modules it imports.
+
+    Return a result record with the best of `n_repeats` times.  If a
+    budget is given, the record says whether the startup is within it,
+    which requires that no heavy modules are imported.
+    """
+    seconds = []
+    process_seconds = []
+    loaded_modules = set()
+    for _ in range(n_repeats):
+        start = time.perf_counter()
+        output = subprocess.check_output(
+            [sys.executable, '-c', _startup_script],
+            universal_newlines=True)
+        process_seconds.append(time.perf_counter() - start)
+        result = json.loads(output.strip().splitlines()[-1])
+        seconds.append(result['seconds'])
+        loaded_modules.update(result['heavy_modules'])
+    record = dict(
+        seconds=min(seconds),
+        process_seconds=min(process_seconds),
+        heavy_modules=sorted(loaded_modules),
+        budget_seconds=budget_seconds,
+    )
+    if budget_seconds is not None:
+        record['within_budget'] = (
+            record['seconds'] <= budget_seconds and not loaded_modules)
+    return record
+
+
+def run_pipeline(filenames, decision_tree_args, random_seed=None,
+                 trace_memory=True):
+    """
+    Run the modeling pipeline on the given files, timing each stage.
+
+    The stages are run serially so that each one can be timed.  Return
+    a list of stage records.
+    """
+    # Do expensive imports
+    from tsufvml import common
+    from tsufvml import ml # sklearn
+    import numpy
+    # Keep the time of importing the loader out of the loading stage
+    from sklearn import datasets # noqa: F401
+
+    timer = instrument.StageTimer(trace_memory=trace_memory)
+    timer.start()
+    with timer.stage('load_svmlight_as_matrix'):
+        full_data, labels = common.load_svmlight_as_matrix(
+            filenames['data'])
+    with timer.stage('load_feature_table'):
+        features = common.load_feature_table(filenames['features'])
+    with timer.stage('load_concept_table'):
+        concepts = common.load_concept_table(filenames['concepts'])
+    with timer.stage('limit_matrix_to_features'):
+        data, rm2orig_idxs = common.limit_matrix_to_features(
+            full_data, features)
+    # Time each fold separately
+    model = ml.tree.DecisionTreeClassifier(**decision_tree_args)
+    importances = []
+    folds = ml.mk_cv_folds(labels, random_seed)
+    for fold_idx, (train_idxs, test_idxs) in enumerate(folds):
+        with timer.stage('cv_fold_{}'.format(fold_idx + 1)):
+            _, fold_imps = ml.fit_and_predict_fold(
+                ml.base.clone(model), data, labels, train_idxs,
+                test_idxs)
+        importances.append(fold_imps)
+    with timer.stage('final_model'):
+        final_model, final_roc = ml.fit_and_score_final(
+            ml.base.clone(model), data, labels)
+    # Time the stages that `render_decision_tree_as_dot` replaced so
+    # that the results stay comparable with those of earlier releases
+    with timer.stage('render_decision_tree_as_graphviz'):
+        graphviz_text = ml.render_decision_tree_as_graphviz(final_model)
+    with timer.stage('replace_variable_references_with_features'):
+        common.replace_variable_references_with_features(
+            graphviz_text, rm2orig_idxs, features, concepts)
+    with timer.stage('render_decision_tree_as_dot'):
+        dot_text, feature_legend = ml.render_decision_tree_as_dot(
+            final_model, rm2orig_idxs, features, concepts)
+    with timer.stage('print_report'):
+        header, table = common.mk_feature_importance_table(
+            numpy.array(importances).mean(axis=0),
+            rm2orig_idxs, features, concepts)
+        with open(os.devnull, 'wt') as devnull:
+            common.print_report(
+                final_model_roc_area=final_roc,
+                feature_table=table,
+                feature_table_header=header,
+                model_text=dot_text,
+                feature_legend=feature_legend,
+                output=devnull,
+            )
+    timer.stop()
+    return timer.records
+
+
+def run_benchmark(
+        n_rows, n_cols, density, data_dir=None, max_depth=None,
+        random_seed=0, trace_memory=True):
+    """
+    Generate synthetic data of the given scale and time the pipeline
+    on it.  Return a result record.
+    """
+    from tsufvml.bench import synthetic
+    with contextlib.ExitStack() as exit_stack:
+        if data_dir is None:
+            data_dir = exit_stack.enter_context(
+                tempfile.TemporaryDirectory(prefix='tsufvml-bench-'))
+        scale_dir = os.path.join(
+            str(data_dir), 'r{}-c{}-d{:g}'.format(n_rows, n_cols, density))
+        os.makedirs(scale_dir, exist_ok=True)
+        start = time.perf_counter()
+        filenames = synthetic.write_dataset(
+            scale_dir, n_rows, n_cols, density, random_seed=random_seed)
+        generate_seconds = time.perf_counter() - start
+        stages = run_pipeline(
+            filenames,
+            dict(max_depth=max_depth, random_state=random_seed),
+            random_seed=random_seed,
+            trace_memory=trace_memory,
+        )
+        data_bytes = os.path.getsize(filenames['data'])
+    return dict(
+        n_rows=n_rows,
+        n_cols=n_cols,
+        density=density,
+        data_bytes=data_bytes,
+        generate_seconds=generate_seconds,
+        total_seconds=sum(stage['seconds'] for stage in stages
+                          if stage['stage'] not in replaced_stages),
+        max_rss_bytes=instrument.max_rss_bytes(),
+        stages=stages,
+    )
+
+
+def main(args=None):
+    arg_prsr = argparse.ArgumentParser(
+        prog=os.path.basename(sys.argv[0]),
+        description=(
+            'Benchmark the modeling pipeline (loading, limiting to '
+            'features, cross validation, and reporting) on synthetic '
+            'data.  Each combination of scales is run in a separate '
+            'process so that peak memory is measured per scale.  Also '
+            'check that starting the CLI is within budget.  Results '
+            'are written as JSON.'),
+        allow_abbrev=False,
+    )
+    arg_prsr.add_argument(
+        '--version',
+        action='version',
+        version='tsufvml {}'.format(tsufvml.__version__),
+    )
+    arg_prsr.add_argument(
+        '--rows', type=int, nargs='+', default=[10000], metavar='N',
+        help='Numbers of rows (examples).  [default: %(default)s]')
+    arg_prsr.add_argument(
+        '--cols', type=int, nargs='+', default=[1000], metavar='N',
+        help='Numbers of columns (features).  [default: %(default)s]')
+    arg_prsr.add_argument(
+        '--density', type=float, nargs='+', default=[0.01],
+        metavar='FRAC',
+        help='Fractions of nonzero entries.  [default: %(default)s]')
+    arg_prsr.add_argument(
+        '--max-depth', type=int, metavar='N',
+        help='Maximum depth of the decision trees.')
+    arg_prsr.add_argument(
+        '--seed', type=int, default=0, metavar='INT',
+        help='Seed for generating and modeling data.  '
+        '[default: %(default)s]')
+    arg_prsr.add_argument(
+        '--data-dir', metavar='DIR',
+        help='Directory in which to keep the generated data.  By '
+        'default, the data is generated in a temporary directory and '
+        'deleted afterward.')
+    arg_prsr.add_argument(
+        '--no-trace-memory', dest='trace_memory', action='store_false',
+        help='Do not trace the peak memory of each stage with '
+        '`tracemalloc` (which slows down allocation-heavy stages).')
+    arg_prsr.add_argument(
+        '--startup-budget', type=float, default=0.2, metavar='SECONDS',
+        help='Maximum time for starting the CLI (importing it and '
+        'handling `--version`).  If startup takes longer or imports '
+        'any of {}, the exit status is 1.  [default: %(default)s]'
+        .format(', '.join(heavy_modules)))
+    arg_prsr.add_argument(
+        '--startup-only', action='store_true',
+        help='Only measure startup; skip benchmarking the pipeline.')
+    arg_prsr.add_argument(
+        '--output', type=argparse.FileType('wt'), default=sys.stdout,
+        metavar='FILE',
+        help='File for the JSON results.  [default: stdout]')
+    env = arg_prsr.parse_args(args)
+
+    startup = measure_startup(budget_seconds=env.startup_budget)
+    results = []
+    for n_rows, n_cols, density in (
+            () if env.startup_only
+            else itertools.product(env.rows, env.cols, env.density)):
+        with concurrent.futures.ProcessPoolExecutor(1) as executor:
+            results.append(executor.submit(
+                run_benchmark, n_rows, n_cols, density,
+                data_dir=env.data_dir,
+                max_depth=env.max_depth,
+                random_seed=env.seed,
+                trace_memory=env.trace_memory,
+            ).result())
+    report = dict(
+        tsufvml_version=tsufvml.__version__,
+        python_version=platform.python_version(),
+        platform=platform.platform(),
+        startup=startup,
+        results=results,
+    )
+    try:
+        json.dump(report, env.output, indent=2)
+        env.output.write('\n')
+    finally:
+        cli.close_output(env.output)
+    if not startup['within_budget']:
+        sys.exit(1)
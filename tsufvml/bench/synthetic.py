@@ -0,0 +1,113 @@
+"""Generation of synthetic data, feature tables, and concept tables"""
+
+# Copyright (c) 2019 Aubrey Barnard.
+#
+# This is free software released under the MIT License.  See
+# `LICENSE.txt` for details.
+
+
+import os.path
+
+
+def mk_matrix(
+        n_rows, n_cols, density, case_fraction=0.1,
+        n_informative=10, random_seed=None):
+    """
+    Return (data, labels) as a random binary CSR matrix and 0/1 labels.
+
+    The labels depend on the first `n_informative` columns so that
+    there is something to learn.  The overall fraction of cases is
+    approximately `case_fraction`.
+    """
+    import numpy
+    from scipy import sparse
+    rng = numpy.random.RandomState(random_seed)
+    # Sample distinct (row, column) positions
+    n_nonzeros = int(round(n_rows * n_cols * density))
+    keys = numpy.unique(rng.randint(
+        0, n_rows * n_cols, size=n_nonzeros, dtype=numpy.int64))
+    rows = keys // n_cols
+    cols = keys % n_cols
+    data = sparse.csr_matrix(
+        (numpy.ones(len(keys)), (rows, cols)), shape=(n_rows, n_cols))
+    # Make the odds of being a case increase with the number of
+    # informative features present
+    n_informative = min(n_informative, n_cols)
+    n_present = numpy.bincount(
+        rows[cols < n_informative], minlength=n_rows)
+    log_odds = (numpy.log(case_fraction / (1 - case_fraction))
+                + n_present - n_present.mean())
+    probs = 1 / (1 + numpy.exp(-log_odds))
+    labels = (rng.random_sample(n_rows) < probs).astype(numpy.float64)
+    return data, labels
+
+
+def write_svmlight(filename, data, labels):
+    """Write the given CSR matrix and labels in svmlight format."""
+    indptr = data.indptr
+    # Feature IDs are 1-based
+    feat_ids = (data.indices + 1).tolist()
+    values = data.data.tolist()
+    with open(filename, 'wt') as file:
+        for row_idx, label in enumerate(labels.tolist()):
+            sta, end = indptr[row_idx], indptr[row_idx + 1]
+            file.write('{:g}'.format(label))
+            for feat_id, value in zip(
+                    feat_ids[sta:end], values[sta:end]):
+                file.write(' {}:{:g}'.format(feat_id, value))
+            file.write('\n')
+
+
+def concept_id(feat_id, n_concepts):
+    return 'C{}'.format(feat_id % n_concepts)
+
+
+def write_feature_table(filename, n_cols, n_concepts, exclude_every=0):
+    """
+    Write a feature table (in the format of Fitamord) describing
+    features 1 through `n_cols`.  If `exclude_every` is positive, every
+    that many features are commented out.
+    """
+    with open(filename, 'wt') as file:
+        file.write('id|name|type|table|value\n')
+        for feat_id in range(1, n_cols + 1):
+            comment = ('#' if exclude_every > 0
+                       and feat_id % exclude_every == 0
+                       else '')
+            file.write('{}{}|feature{}|binary|events|{}\n'.format(
+                comment, feat_id, feat_id,
+                concept_id(feat_id, n_concepts)))
+
+
+def write_concept_table(filename, n_concepts):
+    """Write a concept table of `n_concepts` concepts."""
+    with open(filename, 'wt') as file:
+        file.write('id\tdescription\n')
+        for idx in range(n_concepts):
+            file.write('{}\tSynthetic concept number {} of {}\n'.format(
+                concept_id(idx, n_concepts), idx, n_concepts))
+
+
+def write_dataset(
+        dirname, n_rows, n_cols, density, case_fraction=0.1,
+        n_concepts=1000, exclude_every=10, random_seed=None):
+    """
+    Write synthetic svmlight data, a feature table, and a concept table
+    to the given directory.
+
+    Return a dictionary of the filenames with keys: data, features,
+    concepts.
+    """
+    data, labels = mk_matrix(
+        n_rows, n_cols, density, case_fraction,
+        random_seed=random_seed)
+    filenames = dict(
+        data=os.path.join(dirname, 'data.svmlight'),
+        features=os.path.join(dirname, 'features.psv'),
+        concepts=os.path.join(dirname, 'concepts.tsv'),
+    )
+    write_svmlight(filenames['data'], data, labels)
+    write_feature_table(
+        filenames['features'], n_cols, n_concepts, exclude_every)
+    write_concept_table(filenames['concepts'], n_concepts)
+    return filenames
@@ -0,0 +1,203 @@
+"""
+Content-addressed cache of modeling results on local disk
+
+Results (e.g. the fitted models of the CV folds or a whole report) are
+stored under keys that are hashes of the contents of their inputs
+(see `content_hash`), so an identical run finds the results of an
+earlier one regardless of filenames, and a changed input never finds
+stale results.  The cache is bounded in size by evicting the least
+recently used results.
+"""
+
+# Copyright (c) 2019 Aubrey Barnard.
+#
+# This is free software released under the MIT License.  See
+# `LICENSE.txt` for details.
+
+
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+from barnapy import logging
+
+import tsufvml
+
+
+# Suffix of the files of cached results
+_result_suffix = '.pickle'
+# Subdirectory for the content hashes of input files
+_file_hashes_dirname = 'files'
+# Size of the blocks in which files are read for hashing
+_hash_block_nbytes = 2**20
+
+
+def _update_hash(hasher, part):
+    import numpy
+    if isinstance(part, numpy.ndarray):
+        part = numpy.ascontiguousarray(part)
+        hasher.update('array {} {}\n'.format(
+            part.dtype.str, part.shape).encode())
+        hasher.update(memoryview(part.reshape(-1).view(numpy.uint8)))
+    elif hasattr(part, 'indptr'): # CSR matrix or view
+        hasher.update('matrix {}\n'.format(
+            list(getattr(part, 'base_shape', part.shape))).encode())
+        for name in ('data', 'indices', 'indptr', 'row_idxs', 'col_idxs'):
+            _update_hash(hasher, getattr(part, name, None))
+    elif isinstance(part, (list, tuple)):
+        hasher.update('list {}\n'.format(len(part)).encode())
+        for item in part:
+            _update_hash(hasher, item)
+    else:
+        hasher.update('json {}\n'.format(json.dumps(
+            part, sort_keys=True, default=repr)).encode())
+
+
+def content_hash(*parts):
+    """
+    Return a hex digest that identifies the given parts by their
+    contents.  Parts are NumPy arrays, sparse matrices (CSR matrices or
+    `matrix.CsrView`s), lists or tuples of parts, or objects that can
+    be serialized as JSON (using `repr` for other objects).  The
+    version of Tsufvml is part of every hash.
+    """
+    hasher = hashlib.sha1()
+    _update_hash(hasher, tsufvml.__version__)
+    for part in parts:
+        _update_hash(hasher, part)
+    return hasher.hexdigest()
+
+
+class ResultCache:
+    """
+    Cache of results in the given directory that evicts the least
+    recently used results to keep their total size within
+    `max_nbytes`.
+
+    Each result is a pickle file named by its key.  Files are written
+    to a temporary file and then renamed, so concurrent runs sharing a
+    cache never see partial results.
+    """
+
+    def __init__(self, dirname, max_nbytes=2**30):
+        self.dirname = str(dirname)
+        self.max_nbytes = max_nbytes
+
+    def _path(self, key):
+        return os.path.join(self.dirname, key + _result_suffix)
+
+    def _write(self, path, write):
+        dirname = os.path.dirname(path)
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=dirname)
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                write(file)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def load(self, key):
+        """
+        Return the result with the given key, or raise `KeyError` if
+        there is none.  Loading a result marks it as recently used.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                value = pickle.load(file)
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # Not found, just evicted, or unreadable
+            raise KeyError(key)
+        logging.getLogger(__name__).info('Loaded cached result: {}', path)
+        return value
+
+    def store(self, key, value):
+        """
+        Store the given result with the given key and evict the least
+        recently used results as necessary.  Results bigger than the
+        cache are not stored.
+        """
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_nbytes:
+            return
+        self._write(self._path(key), lambda file: file.write(data))
+        self.evict()
+
+    def memo(self, key, compute):
+        """
+        Return the result with the given key, calling `compute()` to
+        compute (and store) it if it is not in the cache.
+        """
+        try:
+            return self.load(key)
+        except KeyError:
+            pass
+        value = compute()
+        self.store(key, value)
+        return value
+
+    def evict(self):
+        """
+        Delete the least recently used results until the total size of
+        the results is within `max_nbytes`.
+        """
+        entries = []
+        for name in os.listdir(self.dirname):
+            if name.endswith(_result_suffix) and not name.startswith('.'):
+                path = os.path.join(self.dirname, name)
+                try:
+                    stat = os.stat(path)
+                except OSError: # Evicted concurrently
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        nbytes = sum(size for (_, size, _) in entries)
+        for (_, size, path) in sorted(entries):
+            if nbytes <= self.max_nbytes:
+                break
+            try:
+                os.unlink(path)
+                logging.getLogger(__name__).info(
+                    'Evicted cached result: {}', path)
+            except OSError:
+                pass
+            nbytes -= size
+
+    def file_hash(self, filename):
+        """
+        Return the content hash of the given file, or `None` if it is
+        not a regular file.
+
+        The hash of each file is kept with its size and modification
+        time (outside the results, so it is not evicted), so an
+        unchanged file is only read once.
+        """
+        from tsufvml import matrix
+        path = matrix.file_path(filename)
+        if path is None:
+            return None
+        signature = list(matrix.file_signature(path))
+        record_path = os.path.join(
+            self.dirname, _file_hashes_dirname,
+            hashlib.sha1(path.encode()).hexdigest() + '.json')
+        try:
+            with open(record_path, 'rt') as file:
+                record = json.load(file)
+            if record['signature'] == signature:
+                return record['sha1']
+        except (OSError, ValueError, KeyError):
+            pass
+        hasher = hashlib.sha1()
+        with open(path, 'rb') as file:
+            for block in iter(
+                    lambda: file.read(_hash_block_nbytes), b''):
+                hasher.update(block)
+        record = dict(path=path, signature=signature,
+                      sha1=hasher.hexdigest())
+        self._write(record_path, lambda file: file.write(
+            json.dumps(record).encode()))
+        return record['sha1']
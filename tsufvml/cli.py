@@ -7,16 +7,16 @@
 
 
 import argparse
-import operator
 import os.path
 import pathlib
 import sys
 
-from barnapy import logging
 from barnapy import parse
 
 # Use absolute imports so that this file can be used from anywhere.
-# Postpone expensive imports (i.e. sklearn) until needed.
+# Postpone expensive imports (i.e. sklearn, but also anything not
+# needed for parsing and validating arguments) until needed so that
+# `--help`, `--version`, and argument errors are fast.
 import tsufvml
 from tsufvml import common
 
@@ -51,116 +51,688 @@ def parse_args_as_dict(*args, key_prefix='--', value_parser=None):
     return env
 
 
-def run_decision_trees_api(
+def load_data_api(
         data_matrix_filename,
         feature_table_filename=None,
         concept_table_filename=None,
-        tree_pdf_filename=None,
         weight_feature=None,
-        decision_tree_args={},
-        output=sys.stdout,
+        cache_dir=None,
+        timer=None,
+        memo=None,
+        incremental=False,
+        memo_kinds=('matrix', 'features', 'concepts'),
 ):
-    # Do expensive imports
-    from tsufvml import ml # sklearn
-    import numpy
+    """
+    Load the data, feature table, and concept table, and limit the
+    data to the features in the feature table.
 
-    # Load the data
-    full_data, labels = common.load_svmlight_as_matrix(data_matrix_filename)
+    If `cache_dir` is given, the data and the tables are cached there
+    in binary form.  If `incremental`, rows appended to the data file
+    since it was cached are appended to the cached data.
+
+    If a `timer` (`instrument.StageTimer`) is given, each loading stage
+    is timed and recorded in it.
+
+    If given, `memo` is called as `memo(kind, filename, load)` to load
+    each of the data ('matrix'), feature table ('features'), and
+    concept table ('concepts'), where `load()` does the actual loading.
+    This allows reusing previously loaded objects, which are not
+    modified.  Only the kinds of objects in `memo_kinds` are loaded via
+    `memo`.  If the data ('matrix') is among them, the full data is
+    loaded before limiting it to the features.
+
+    Return a dictionary with keys: data, labels, weights,
+    rm2orig_idxs, features, concepts.
+    """
+    from tsufvml import instrument
+    if timer is None:
+        timer = instrument.StageTimer(enabled=False)
+    def load_via_memo(kind, filename, load):
+        if memo is not None and kind in memo_kinds:
+            return memo(kind, filename, load)
+        return load()
+    memo_data = memo is not None and 'matrix' in memo_kinds
     # Load the feature table
-    rm2orig_idxs = {}
     features = None
     if feature_table_filename is not None:
-        features = common.load_feature_table(feature_table_filename)
-    else:
-        # Feature IDs are 1-based
-        features = {i + 1: (None, None) for i in range(full_data.shape[1])}
+        with timer.stage('load feature table'):
+            features = load_via_memo(
+                'features', feature_table_filename,
+                lambda: common.load_feature_table(
+                    feature_table_filename, cache_dir))
     # Load the concept table
     concepts = {}
     if concept_table_filename is not None:
-        concepts = common.load_concept_table(concept_table_filename)
+        with timer.stage('load concept table'):
+            concepts = load_via_memo(
+                'concepts', concept_table_filename,
+                lambda: common.load_concept_table(
+                    concept_table_filename, cache_dir))
 
     # Look up the column of the weight feature if needed
     wgt_feat_id = None
     if isinstance(weight_feature, str):
-        for (feat_id, (feat_nm, feat_val)) in features.items():
-            if weight_feature == feat_nm:
-                wgt_feat_id = feat_id
-                break
-        if wgt_feat_id is None:
+        wgt_feat_ids = (features.ids_with_name(weight_feature)
+                        if features is not None else ())
+        if len(wgt_feat_ids) == 0:
             raise ValueError('Feature name not found: {!r}'
                              .format(weight_feature))
+        # Use the first feature with the name
+        wgt_feat_id = int(wgt_feat_ids[0])
     elif (isinstance(weight_feature, int)
             and not isinstance(weight_feature, bool)):
         wgt_feat_id = weight_feature
     elif weight_feature is not None:
         raise TypeError('`weight_feature` not an int or str: {!r}'
                         .format(weight_feature))
-    # Exclude the weight feature from the features
-    if wgt_feat_id is not None and wgt_feat_id in features:
-        del features[wgt_feat_id]
-
-    # Limit the data to the features
-    data, rm2orig_idxs = common.limit_matrix_to_features(
-        full_data, features)
-    # Get the data weights
-    weights = (full_data[:, wgt_feat_id - 1].toarray().squeeze()
-               if wgt_feat_id is not None
-               else None)
-
-    # Construct the decision tree classifier
-    dt_model = ml.tree.DecisionTreeClassifier(**decision_tree_args)
-    # Run the decision tree classifier
-    final_model, cv_roc_areas, feature_importances, final_roc = (
-        ml.run_cv_and_final_model(dt_model, data, labels, weights))
-    # Average the feature importances over all folds
-    avg_feature_importances = list(
-        numpy.array(feature_importances).mean(axis=0))
-
-    # Gather report data
-    feature_table_header, feature_table = (
-        common.mk_feature_importance_table(
-            avg_feature_importances,
-            rm2orig_idxs, features, concepts))
-    feature_table.sort(key=operator.itemgetter(0), reverse=True)
-    # Only report features with positive importances
-    feature_table = [row for row in feature_table if row[0] > 0]
-    dot_text = ml.render_decision_tree_as_graphviz(final_model)
-    dot_text, feature_legend = (
-        common.replace_variable_references_with_features(
-            dot_text, rm2orig_idxs, features, concepts))
-    # Generate report
-    common.print_report(
-        cv_roc_areas=cv_roc_areas,
-        final_model_roc_area=final_roc,
-        feature_table=feature_table,
-        feature_table_header=feature_table_header,
-        limit_n_features=100,
-        model_text=dot_text,
-        feature_legend=feature_legend,
+    # Exclude the weight feature from the features (without modifying
+    # the loaded table)
+    if (features is not None and wgt_feat_id is not None
+            and wgt_feat_id in features):
+        features = features.without([wgt_feat_id])
+
+    # Load the data
+    if features is not None and cache_dir is None and not memo_data:
+        # Parse only the features in the table (and the weights)
+        with timer.stage('load data limited to features'):
+            data, labels, weights, rm2orig_idxs = (
+                common.load_svmlight_filtered(
+                    data_matrix_filename, features.ids, wgt_feat_id))
+    else:
+        with timer.stage('load data'):
+            full_data, labels = load_via_memo(
+                'matrix', data_matrix_filename,
+                lambda: common.load_svmlight_as_matrix(
+                    data_matrix_filename, cache_dir=cache_dir,
+                    incremental=incremental))
+        if features is None:
+            # Feature IDs are 1-based
+            from tsufvml import tables
+            features = tables.FeatureTable.from_ids(
+                range(1, full_data.shape[1] + 1))
+            if wgt_feat_id is not None:
+                features = features.without([wgt_feat_id])
+        with timer.stage('limit data to features'):
+            # Limit the data to the features
+            data, rm2orig_idxs = common.limit_matrix_to_features(
+                full_data, features)
+            # Get the data weights (as floats because the data may be
+            # compact)
+            weights = None
+            if wgt_feat_id is not None:
+                wgt_col = (full_data[:, wgt_feat_id - 1].tocsr()
+                           if wgt_feat_id <= full_data.shape[1]
+                           else None)
+                if wgt_col is None or wgt_col.nnz == 0:
+                    raise ValueError(
+                        'Weight feature not found in data: {}: {}'
+                        .format(wgt_feat_id, getattr(
+                            data_matrix_filename, 'name',
+                            data_matrix_filename)))
+                weights = wgt_col.toarray().squeeze().astype(float)
+
+    return dict(
+        data=data,
+        labels=labels,
+        weights=weights,
+        rm2orig_idxs=rm2orig_idxs,
+        features=features,
+        concepts=concepts,
     )
 
-    # Render tree as PDF if requested
+
+def _incremental_report_key(
+        data_matrix_filename, cache_dir, **job):
+    """
+    Return (directory, key) for storing the report of the given job on
+    the data cached in `cache_dir`, or `None` if the report cannot be
+    reused (i.e. the cached data is out of date or an input is not a
+    regular file).
+
+    The directory is discarded when the cached data changes, so the key
+    only needs to identify the rest of the job.
+    """
+    import hashlib
+    import json
+    from tsufvml import matrix
+    path = matrix.file_path(data_matrix_filename)
+    if path is None:
+        return None
+    entry_dir = matrix.cache_dir_for(path, cache_dir)
+    try:
+        meta = matrix.load_csr_meta(entry_dir)
+    except OSError:
+        return None
+    size, mtime_ns = matrix.file_signature(path)
+    if meta.get('size') != size or meta.get('mtime_ns') != mtime_ns:
+        return None
+    # Identify table files by their contents' signatures
+    for name in ('feature_table_filename', 'concept_table_filename'):
+        if job[name] is not None:
+            table_path = matrix.file_path(job[name])
+            if table_path is None:
+                return None
+            job[name] = [table_path] + list(
+                matrix.file_signature(table_path))
+    job['tsufvml_version'] = tsufvml.__version__
+    key = hashlib.sha1(json.dumps(
+        job, sort_keys=True, default=str).encode()).hexdigest()
+    return matrix.derived_dir(entry_dir), key
+
+
+def _incremental_folds(data_matrix_filename, cache_dir, labels,
+                       random_seed, n_folds=10):
+    """
+    Return the CV folds of the data cached in `cache_dir`, assigning
+    folds to any new rows and storing the assignments.
+    """
+    from tsufvml import matrix
+    from tsufvml import ml # sklearn
+    entry_dir = matrix.cache_dir_for(
+        matrix.file_path(data_matrix_filename), cache_dir)
+    folds = matrix.load_folds(entry_dir, random_seed, n_folds)
+    if folds is None or len(folds) > len(labels):
+        folds = ml.fold_assignments(labels, random_seed, n_folds)
+    else:
+        folds = ml.extend_fold_assignments(
+            folds, labels, random_seed, n_folds)
+    matrix.save_folds(entry_dir, folds, random_seed, n_folds)
+    return ml.folds_from_assignments(folds, n_folds)
+
+
+def _print_stored_report(
+        dirname, key, tree_pdf_filename=None, output=None):
+    """
+    Write the stored report with the given key to `output` (by default
+    `sys.stdout`) and render its decision tree as a PDF if requested.
+    Return whether the report was found.
+    """
+    import shutil
+    from barnapy import logging
+    report_filename = os.path.join(dirname, key + '.report')
+    if not os.path.exists(report_filename):
+        return False
+    logging.getLogger(__name__).info(
+        'Reusing report of unchanged job: {}', report_filename)
+    with open(report_filename, 'rt') as file:
+        shutil.copyfileobj(file, sys.stdout if output is None else output)
     if tree_pdf_filename is not None:
-        render_ok = common.render_dot_as_pdf(dot_text, tree_pdf_filename)
-        if not render_ok:
-            print(
-                """
+        with open(os.path.join(dirname, key + '.dot'), 'rt') as file:
+            common.render_dot_as_pdf(file.read(), tree_pdf_filename)
+    return True
+
+
+def _result_report_key(result_cache, data_matrix_filename, **job):
+    """
+    Return the key of the report of the given job in the given
+    `cache.ResultCache`, or `None` if an input is not a regular file.
+    The data, feature table, and concept table are identified by the
+    content hashes of their files.
+    """
+    from tsufvml import cache
+    file_hashes = []
+    for filename in (data_matrix_filename,
+                     job.pop('feature_table_filename'),
+                     job.pop('concept_table_filename')):
+        file_hash = None
+        if filename is not None:
+            file_hash = result_cache.file_hash(filename)
+            if file_hash is None:
+                return None
+        file_hashes.append(file_hash)
+    return cache.content_hash('report', file_hashes, job)
+
+
+def _store_report(dirname, key, report, dot_text):
+    import tempfile
+    os.makedirs(dirname, exist_ok=True)
+    # Write the report last so that it is never found without the tree
+    for (suffix, text) in (('.dot', dot_text), ('.report', report)):
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=dirname)
+        with os.fdopen(fd, 'wt') as file:
+            file.write(text)
+        os.replace(tmp_path, os.path.join(dirname, key + suffix))
+
+
+def run_decision_trees_api(
+        data_matrix_filename,
+        feature_table_filename=None,
+        concept_table_filename=None,
+        tree_pdf_filename=None,
+        weight_feature=None,
+        decision_tree_args={},
+        **kwargs
+):
+    """
+    Model the given data with decision trees with the given arguments.
+    See `run_models_api` for the other arguments and the return
+    value.
+    """
+    return run_models_api(
+        data_matrix_filename,
+        feature_table_filename=feature_table_filename,
+        concept_table_filename=concept_table_filename,
+        tree_pdf_filename=tree_pdf_filename,
+        weight_feature=weight_feature,
+        model_family='dt',
+        model_args=decision_tree_args,
+        **kwargs
+    )
+
+
+def run_models_api(
+        data_matrix_filename,
+        feature_table_filename=None,
+        concept_table_filename=None,
+        tree_pdf_filename=None,
+        weight_feature=None,
+        model_family='dt',
+        model_args={},
+        output=None,
+        n_jobs=1,
+        random_seed=None,
+        cache_dir=None,
+        profile=False,
+        profile_filename=None,
+        memo=None,
+        memo_kinds=('matrix', 'features', 'concepts'),
+        incremental=False,
+        model_filename=None,
+        report_format='yaml',
+        fold_strategy='copy',
+        n_bootstraps=0,
+        permutation_importance=False,
+        top_k=None,
+        n_permutation_repeats=5,
+        screening_args=None,
+        controls_per_case=None,
+        result_cache_dir=None,
+        result_cache_nbytes=2**30,
+):
+    """
+    Model the given data with models of the given family (see
+    `ml.model_families`) with the given arguments and write a report
+    to `output` (a text stream, by default `sys.stdout`) in the given
+    format (see `common.print_report`).
+
+    Return a dictionary of the main results (`cv_roc_areas`,
+    `cv_evaluation`, `final_model_roc_area`), or `None` if the report
+    of a previous run was reused (see `incremental`).  The data is
+    loaded by `load_data_api`, which see for `memo` and `memo_kinds`.
+
+    The feature importances in the report are averaged over the CV
+    folds (see `ml.feature_importances`).  Only decision trees can be
+    rendered (as Graphviz Dot text in the report and as a PDF if a
+    `tree_pdf_filename` is given) and saved.
+
+    The report includes the ROC and PR areas of the out-of-fold
+    predicted probabilities, by fold and pooled, with 95% bootstrap
+    confidence intervals of the pooled areas if `n_bootstraps` is
+    positive.
+
+    If `permutation_importance`, the report also includes the
+    permutation importances of (at most `top_k` of) the features with
+    nonzero importance, as computed by `ml.run_cv_and_final_model` on
+    the testing rows of the CV folds with `n_permutation_repeats`
+    permutations of each feature.  The features are then ranked by
+    their permutation importances.
+
+    If `screening_args` is given, the features are screened within
+    each CV fold (and for the final model) before fitting, as by
+    `ml.ScreenedClassifier` with those arguments (`score`, `n_keep`,
+    `min_score`, `min_count`).  Features dropped by screening have zero
+    importance.
+
+    If `controls_per_case` is given, the training rows of each CV fold
+    (and all the rows for the final model) are down-sampled to at most
+    that many controls (negative examples) per case before fitting, as
+    by `ml.DownsampledClassifier`, which weights the sampled controls
+    so that estimates are unbiased.  The testing rows are not sampled.
+
+    If a `model_filename` is given, the final decision tree is saved
+    there (see
+    `score.TreeModel`) for scoring new data with
+    `score.score_svmlight`.
+
+    If a `result_cache_dir` is given, results are cached there (see
+    `cache.ResultCache`), keeping at most `result_cache_nbytes` of the
+    most recently used.  The fits of the CV folds and the final model
+    are keyed by the contents of the data (limited to the features),
+    labels, weights, and folds and by the model, and the report is
+    keyed by the contents of the input files and all the options.  A
+    repeated run with a `random_seed` reuses the report without loading
+    the data or fitting any models, and a run that only changes the
+    evaluation or the reporting (e.g. `n_bootstraps`, `report_format`,
+    or the concept table) reuses the fits.  Runs without a
+    `random_seed` are neither cached nor reused.
+
+    If `incremental`, the data is cached in `cache_dir` (which is
+    required) and runs on a data file that has only grown since the
+    last run parse only the new rows.  The assignments of rows to CV
+    folds are stored with the cached data, and new rows are assigned
+    to folds without changing the assignments of existing rows.  If
+    nothing has changed since a previous run of the same job, its
+    report is reused without loading the data or fitting any models.
+    """
+    is_tree = model_family == 'dt'
+    if not is_tree and (tree_pdf_filename is not None
+                        or model_filename is not None):
+        raise ValueError('Only decision trees can be rendered as PDF or '
+                         'saved, not: {!r}'.format(model_family))
+    # Reuse the report of a previous run if possible.  Describe the job
+    # as far as its report is concerned.
+    report_job = dict(
+        feature_table_filename=feature_table_filename,
+        concept_table_filename=concept_table_filename,
+        weight_feature=weight_feature,
+        model_family=model_family,
+        model_args=model_args,
+        random_seed=random_seed,
+        report_format=report_format,
+        fold_strategy=fold_strategy,
+        n_bootstraps=n_bootstraps,
+        permutation_importance=permutation_importance,
+        top_k=top_k,
+        n_permutation_repeats=n_permutation_repeats,
+        screening_args=screening_args,
+        controls_per_case=controls_per_case,
+    )
+    if incremental:
+        if cache_dir is None:
+            raise ValueError('Incremental mode requires `cache_dir`')
+        report_key = _incremental_report_key(
+            data_matrix_filename, cache_dir, **report_job)
+        if (report_key is not None and not profile
+                and profile_filename is None and model_filename is None
+                and _print_stored_report(
+                    *report_key, tree_pdf_filename=tree_pdf_filename,
+                    output=output)):
+            return None
+    result_cache = None
+    result_report_key = None
+    if result_cache_dir is not None:
+        from tsufvml import cache
+        result_cache = cache.ResultCache(
+            result_cache_dir, result_cache_nbytes)
+        # Only reuse reports of runs with repeatable folds.  Incremental
+        # runs use the stored folds, which differ from fresh ones.
+        if random_seed is not None:
+            result_report_key = _result_report_key(
+                result_cache, data_matrix_filename,
+                incremental=incremental, **report_job)
+        if (result_report_key is not None and not profile
+                and profile_filename is None and model_filename is None):
+            try:
+                stored = result_cache.load(result_report_key)
+            except KeyError:
+                stored = None
+            if stored is not None:
+                (sys.stdout if output is None else output).write(
+                    stored['report'])
+                if tree_pdf_filename is not None:
+                    common.render_dot_as_pdf(
+                        stored['dot_text'], tree_pdf_filename)
+                return None
+
+    # Do expensive imports
+    import operator
+    from tsufvml import instrument
+    from tsufvml import ml # sklearn
+    import numpy
+
+    # Time each stage if requested
+    timer = instrument.StageTimer(
+        enabled=profile or profile_filename is not None)
+    timer.start()
+
+    try:
+        # Load the data
+        inputs = load_data_api(
+            data_matrix_filename,
+            feature_table_filename=feature_table_filename,
+            concept_table_filename=concept_table_filename,
+            weight_feature=weight_feature,
+            cache_dir=cache_dir,
+            timer=timer,
+            memo=memo,
+            incremental=incremental,
+            memo_kinds=memo_kinds,
+        )
+        data = inputs['data']
+        labels = inputs['labels']
+        weights = inputs['weights']
+        rm2orig_idxs = inputs['rm2orig_idxs']
+        features = inputs['features']
+        concepts = inputs['concepts']
+
+        # Construct the classifier
+        model = ml.mk_model(model_family, model_args)
+        if screening_args is not None:
+            model = ml.ScreenedClassifier(model, **screening_args)
+        if controls_per_case is not None:
+            model = ml.DownsampledClassifier(
+                model, controls_per_case, random_state=random_seed)
+        # Use the stored CV folds if incremental
+        folds = None
+        if incremental:
+            folds = _incremental_folds(
+                data_matrix_filename, cache_dir, labels, random_seed)
+        # Run the classifier
+        (final_model, cv_roc_areas, feature_importances, final_roc,
+         cv_evaluation) = ml.run_cv_and_final_model(
+             model, data, labels, weights,
+             n_jobs=n_jobs, random_seed=random_seed, timer=timer,
+             folds=folds, fold_strategy=fold_strategy,
+             n_bootstraps=n_bootstraps,
+             permutation_importance=permutation_importance, top_k=top_k,
+             n_permutation_repeats=n_permutation_repeats,
+             # Unseeded runs have fresh random folds, so their fits would
+             # never be reused
+             fit_memo=(result_cache.memo
+                       if result_cache is not None and random_seed is not None
+                       else None))
+        # Average the feature importances over all folds
+        avg_feature_importances = list(
+            numpy.array(feature_importances).mean(axis=0))
+
+        # Gather report data
+        feature_table_header, feature_table = (
+            common.mk_feature_importance_table(
+                avg_feature_importances,
+                rm2orig_idxs, features, concepts,
+                cv_evaluation.get('permutation_importances')))
+        if permutation_importance:
+            # Rank by permutation importance and then by importance.  Only
+            # report features with a positive importance of either kind.
+            feature_table.sort(
+                key=lambda row: (row[1] if row[1] is not None
+                                 else float('-inf'), row[0]),
+                reverse=True)
+            feature_table = [row for row in feature_table
+                             if row[0] > 0 or (row[1] or 0) > 0]
+        else:
+            feature_table.sort(key=operator.itemgetter(0), reverse=True)
+            # Only report features with positive importances
+            feature_table = [row for row in feature_table if row[0] > 0]
+        dot_text, feature_legend = '', None
+        # Render and save the tree in terms of the columns it was fit to
+        tree_model, tree_rm2orig_idxs = ml.unwrap_model(
+            final_model, rm2orig_idxs)
+        if is_tree:
+            with timer.stage('render Graphviz'):
+                dot_text, feature_legend = ml.render_decision_tree_as_dot(
+                    tree_model, tree_rm2orig_idxs, features, concepts)
+        # Generate report
+        with timer.stage('print report'):
+            report_args = dict(
+                cv_roc_areas=cv_roc_areas,
+                cv_evaluation=cv_evaluation,
+                final_model_roc_area=final_roc,
+                feature_table=feature_table,
+                feature_table_header=feature_table_header,
+                limit_n_features=100,
+                model_text=dot_text,
+                feature_legend=feature_legend,
+                timings=list(timer.records) if profile else None,
+                report_format=report_format,
+            )
+            if incremental or result_report_key is not None:
+                # Capture the report so that it can be stored
+                import io
+                report = io.StringIO()
+                common.print_report(output=report, **report_args)
+                (sys.stdout if output is None else output).write(
+                    report.getvalue())
+            else:
+                common.print_report(output=output, **report_args)
+        # Store the report for reuse.  Recompute the key because loading
+        # the data may have updated the cache.
+        if incremental and not profile:
+            report_key = _incremental_report_key(
+                data_matrix_filename, cache_dir, **report_job)
+            if report_key is not None:
+                dirname, key = report_key
+                _store_report(dirname, key, report.getvalue(), dot_text)
+        if result_report_key is not None and not profile:
+            result_cache.store(result_report_key, dict(
+                report=report.getvalue(), dot_text=dot_text))
+
+        # Render tree as PDF if requested
+        if tree_pdf_filename is not None:
+            with timer.stage('render PDF'):
+                render_ok = common.render_dot_as_pdf(
+                    dot_text, tree_pdf_filename)
+            if not render_ok:
+                print(
+                    """
 
 Warning: Unable to render the decision tree as a PDF using either the
     `pydot` or `graphviz` packages.  If you want PDF rendering, make
     sure one of those packages is installed and try again.
 
-                """.strip(),
-                file=sys.stderr,
-            )
+                    """.strip(),
+                    file=sys.stderr,
+                )
 
+        # Save the final model if requested
+        if model_filename is not None:
+            from tsufvml import score
+            with timer.stage('save model'):
+                score.save_model(
+                    model_filename, tree_model, tree_rm2orig_idxs)
+    finally:
+        timer.stop()
 
-def decision_tree(prog_name, *args):
-    arg_prsr = argparse.ArgumentParser(
-        prog=prog_name,
-        description='Model feature vector data with decision trees.', # TODO explain --dt. options
-        allow_abbrev=False,
+    # Write the timings if requested
+    if profile_filename is not None:
+        timer.write_json(profile_filename)
+    return dict(
+        cv_roc_areas=cv_roc_areas,
+        cv_evaluation=cv_evaluation,
+        final_model_roc_area=final_roc,
+    )
+
+
+def run_decision_tree_sweep_api(
+        data_matrix_filename,
+        feature_table_filename=None,
+        weight_feature=None,
+        decision_tree_args_list=(),
+        output=None,
+        n_jobs=1,
+        random_seed=None,
+        cache_dir=None,
+        fold_strategy='copy',
+):
+    """
+    Cross validate decision trees with each of the given sets of
+    arguments and report the configurations ranked by mean CV ROC
+    area.  Write the report to `output` (a text stream, by default
+    `sys.stdout`).
+
+    The data is loaded and limited to the features only once, and all
+    the configurations are evaluated on the same folds.
+    """
+    # Do expensive imports
+    from tsufvml import ml # sklearn
+
+    # Load the data
+    inputs = load_data_api(
+        data_matrix_filename,
+        feature_table_filename=feature_table_filename,
+        weight_feature=weight_feature,
+        cache_dir=cache_dir,
+    )
+    # Construct a decision tree classifier for each configuration
+    dt_models = [ml.tree.DecisionTreeClassifier(**dt_args)
+                 for dt_args in decision_tree_args_list]
+    # Run all the configurations
+    results = ml.run_cv_sweep(
+        dt_models, inputs['data'], inputs['labels'], inputs['weights'],
+        n_jobs=n_jobs, random_seed=random_seed,
+        fold_strategy=fold_strategy)
+    # Generate report
+    common.print_sweep_report(
+        configurations=decision_tree_args_list,
+        cv_roc_areas=[scores for (scores, _) in results],
+        output=output,
     )
+
+
+def load_sweep_configurations(filename):
+    """
+    Load a list of decision tree argument dictionaries from the given
+    JSON or YAML file.
+
+    The file contains either a list of dictionaries or a dictionary
+    whose values are lists, which is expanded into the grid of all
+    combinations.  Reading YAML requires PyYAML.
+    """
+    import json
+    name = str(getattr(filename, 'name', filename))
+    with common.open_file(filename, 'rt') as file:
+        if name.endswith(('.yaml', '.yml')):
+            import yaml
+            spec = yaml.safe_load(file)
+        else:
+            spec = json.load(file)
+    if isinstance(spec, dict):
+        return expand_grid(spec)
+    elif isinstance(spec, list) and all(
+            isinstance(config, dict) for config in spec):
+        return spec
+    raise ValueError('Not a list of dictionaries or a dictionary of '
+                     'lists: {}'.format(name))
+
+
+def expand_grid(grid):
+    """
+    Return the list of all the dictionaries that combine one value
+    from each of the given lists of values.  Non-list values are
+    treated as single-element lists.
+    """
+    import itertools
+    names = sorted(grid.keys())
+    value_lists = [grid[name] if isinstance(grid[name], list)
+                   else [grid[name]]
+                   for name in names]
+    return [dict(zip(names, values))
+            for values in itertools.product(*value_lists)]
+
+
+def parse_list_err(text):
+    """Parse comma-separated atoms into a list."""
+    values = []
+    for item in text.split(','):
+        value, err = parse.atom_err(item)
+        if err:
+            return None, err
+        values.append(value)
+    return values, None
+
+
+def add_data_arguments(arg_prsr):
+    """Add the arguments for loading data to the given parser."""
     arg_prsr.add_argument(
         '--version',
         action='version',
@@ -188,6 +760,261 @@ def decision_tree(prog_name, *args):
             'Feature to use as weights for the examples, as a feature '
             'name, feature ID, or 1-based column index.'),
     )
+    arg_prsr.add_argument(
+        '--cache-dir',
+        type=pathlib.Path,
+        metavar='DIR',
+        help=(
+            'Directory for caching the data and tables in binary form.  '
+            'The first run parses the SVMLight file and the tables and '
+            'stores them here.  Later runs on the same, unchanged files '
+            'load (memory map) the binary copies instead of parsing '
+            'again.'),
+    )
+
+
+def close_output(output):
+    """
+    Close the given output file (e.g. of `--output`) unless it is
+    `None` or standard output.
+    """
+    if output is not None and output not in (
+            sys.stdout, getattr(sys.stdout, 'buffer', None)):
+        output.close()
+
+
+def add_output_arguments(arg_prsr, report_formats=()):
+    """
+    Add the arguments for writing the report to the given parser,
+    including a choice of the given report formats if more than one.
+    """
+    arg_prsr.add_argument(
+        '--output',
+        type=argparse.FileType('wt'),
+        metavar='FILE',
+        help='File for the report.  [default: stdout]',
+    )
+    if len(report_formats) > 1:
+        arg_prsr.add_argument(
+            '--format',
+            choices=report_formats,
+            default=report_formats[0],
+            help=(
+                'Format of the report: YAML for people or JSON Lines '
+                '(one JSON record per line) for programs.  '
+                '[default: %(default)s]'),
+        )
+
+
+def add_cv_arguments(arg_prsr):
+    """Add the arguments for running cross validation to the given parser."""
+    arg_prsr.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        metavar='N',
+        help=(
+            'Number of worker processes for fitting models '
+            'concurrently.  Use -1 for one process per CPU.  '
+            '[default: %(default)s]'),
+    )
+    arg_prsr.add_argument(
+        '--seed',
+        type=int,
+        metavar='INT',
+        help=(
+            'Seed for the random assignment of examples to CV folds.  '
+            'Together with `--dt.random_state`, this makes runs '
+            'repeatable.'),
+    )
+    arg_prsr.add_argument(
+        '--fold-strategy',
+        choices=('copy', 'contiguous'),
+        default='copy',
+        help=(
+            'How to select the data of each CV fold: copy the training '
+            'and testing rows of each fold, or sort the rows by fold '
+            'once so that the testing rows of each fold are '
+            'contiguous and the training rows are gathered into '
+            'reused buffers.  The latter is faster and uses less '
+            'memory for large data, but the training rows are in a '
+            'different order, which can change the models slightly.  '
+            '[default: %(default)s]'),
+    )
+
+
+def add_evaluation_arguments(arg_prsr):
+    """Add the arguments for evaluating CV predictions to the parser."""
+    arg_prsr.add_argument(
+        '--bootstraps',
+        type=int,
+        default=0,
+        metavar='N',
+        help=(
+            'Number of bootstrap samples of the out-of-fold '
+            'predictions for 95%% confidence intervals of the pooled '
+            'CV ROC and PR areas.  0 means no intervals.  '
+            '[default: %(default)s]'),
+    )
+    arg_prsr.add_argument(
+        '--permutation-importance',
+        action='store_true',
+        help=(
+            'Also evaluate features by the decrease in the ROC area of '
+            'the model of each CV fold on its testing rows when the '
+            'values of the feature are permuted, and rank the features '
+            'by that.  Only features with nonzero importance are '
+            'evaluated (all features if the model has no '
+            'importances).'),
+    )
+    arg_prsr.add_argument(
+        '--top-k',
+        type=int,
+        metavar='K',
+        help=(
+            'Only evaluate the permutation importances of the K '
+            'features with the greatest importances.'),
+    )
+    arg_prsr.add_argument(
+        '--permutation-repeats',
+        type=int,
+        default=5,
+        metavar='N',
+        help=(
+            'Number of permutations of each feature for permutation '
+            'importance.  [default: %(default)s]'),
+    )
+
+
+# Names of the screening scores (see `ml.screening_score_names`), listed
+# here so that parsing arguments does not import Scikit-Learn
+screening_score_names = ('chi2', 'mi')
+
+
+def add_screening_arguments(arg_prsr):
+    """Add the arguments for screening features to the given parser."""
+    arg_prsr.add_argument(
+        '--screen',
+        choices=screening_score_names,
+        help=(
+            'Screen the features of the training rows of each CV fold '
+            '(and of all the rows for the final model) by the '
+            'chi-square statistic or mutual information of their '
+            'presence and the label, and fit models to only the '
+            'features that pass.  Use with `--screen-top`, '
+            '`--screen-min-score`, or `--screen-min-count`.'),
+    )
+    arg_prsr.add_argument(
+        '--screen-top',
+        type=int,
+        metavar='N',
+        help='Keep at most the N features with the greatest scores.',
+    )
+    arg_prsr.add_argument(
+        '--screen-min-score',
+        type=float,
+        metavar='SCORE',
+        help='Keep only features with at least this score.',
+    )
+    arg_prsr.add_argument(
+        '--screen-min-count',
+        type=float,
+        default=0,
+        metavar='N',
+        help=(
+            'Keep only features present in at least N (weighted) '
+            'training rows.  [default: %(default)s]'),
+    )
+
+
+def screening_args_from_env(arg_prsr, env):
+    """
+    Return the screening arguments (for `run_models_api`) given by the
+    parsed command line arguments or `None` if there are none.
+    """
+    if env.get('screen') is None:
+        if (env.get('screen_top') is not None
+                or env.get('screen_min_score') is not None
+                or env.get('screen_min_count')):
+            arg_prsr.error('Screening options require `--screen`')
+        return None
+    return dict(
+        score=env['screen'],
+        n_keep=env.get('screen_top'),
+        min_score=env.get('screen_min_score'),
+        min_count=env.get('screen_min_count'),
+    )
+
+
+def add_sampling_arguments(arg_prsr):
+    """Add the arguments for sampling training rows to the parser."""
+    arg_prsr.add_argument(
+        '--controls-per-case',
+        type=float,
+        metavar='RATIO',
+        help=(
+            'Fit models to all the cases (positive examples) but only a '
+            'random sample of at most RATIO controls per case from the '
+            'training rows of each CV fold (and of all the rows for '
+            'the final model).  The sampled controls are weighted '
+            '(along with any `--weights`) by the inverse of the '
+            'fraction sampled.  The testing rows are not sampled.'),
+    )
+
+
+def parse_weights_arg(env):
+    """Parse the weights argument into a feature ID if possible."""
+    weights_arg = env.get('weights')
+    if weights_arg is not None:
+        atom, err = parse.atom_err(weights_arg)
+        if err is None:
+            env['weights'] = atom
+
+
+# Names of the model families (see `ml.model_families`), listed here
+# so that parsing arguments does not import Scikit-Learn
+model_family_names = ('dt', 'rf', 'et', 'hgb', 'l1')
+
+
+def decision_tree(prog_name, *args):
+    arg_prsr = argparse.ArgumentParser(
+        prog=prog_name,
+        description='Model feature vector data with decision trees.', # TODO explain --dt. options
+        allow_abbrev=False,
+    )
+    _run_models(arg_prsr, args, model_family='dt')
+
+
+def model(prog_name, *args):
+    arg_prsr = argparse.ArgumentParser(
+        prog=prog_name,
+        description=(
+            'Model feature vector data with models of the chosen '
+            'family: decision trees (dt), random forests (rf), '
+            'extremely randomized trees (et), histogram gradient '
+            'boosting (hgb), or L1-regularized logistic regression '
+            '(l1).  Pass arguments to the models as options prefixed '
+            'with the family, e.g. `--rf.n_estimators=500` or '
+            '`--rf.n_jobs=-1` to fit the trees of each forest in '
+            'parallel.'),
+        allow_abbrev=False,
+    )
+    arg_prsr.add_argument(
+        '--model',
+        choices=model_family_names,
+        default='dt',
+        help='Family of models.  [default: %(default)s]',
+    )
+    _run_models(arg_prsr, args)
+
+
+def _run_models(arg_prsr, args, model_family=None):
+    """
+    Add the arguments for modeling to the given parser, parse the given
+    arguments, and run the models.  The model family is either given
+    or chosen with `--model`.
+    """
+    add_data_arguments(arg_prsr)
     arg_prsr.add_argument(
         '--concepts',
         type=argparse.FileType('rt'),
@@ -203,36 +1030,194 @@ def decision_tree(prog_name, *args):
         metavar='FILE',
         help=(
             'Filename for PDF rendering of decision tree.  If you want '
-            'a PDF, you must specify a filename with this option.'),
+            'a PDF, you must specify a filename with this option.  '
+            '(Decision trees only.)'),
+    )
+    add_output_arguments(arg_prsr, common.report_formats)
+    add_cv_arguments(arg_prsr)
+    add_evaluation_arguments(arg_prsr)
+    add_screening_arguments(arg_prsr)
+    add_sampling_arguments(arg_prsr)
+    arg_prsr.add_argument(
+        '--profile',
+        action='store_true',
+        help=(
+            'Time each stage of processing (loading, each CV fold, '
+            'rendering, etc.) and trace its peak memory.  Include the '
+            'timings in the report.'),
+    )
+    arg_prsr.add_argument(
+        '--profile-json',
+        type=pathlib.Path,
+        metavar='FILE',
+        help=(
+            'File in which to write the timings of each stage as JSON.  '
+            'Implies `--profile`.'),
+    )
+    arg_prsr.add_argument(
+        '--save-model',
+        type=pathlib.Path,
+        metavar='FILE',
+        help=(
+            'Filename for saving the final model (as NumPy `.npz`) for '
+            'scoring new data with `tsufvml_score`.  (Decision trees '
+            'only.)'),
+    )
+    arg_prsr.add_argument(
+        '--incremental',
+        action='store_true',
+        help=(
+            'Store the CV folds with the cached data (requires '
+            '`--cache-dir`) and, when rows have been appended to the '
+            'data file, only parse the new rows and assign them to '
+            'folds.  Reuse the previous report if nothing has changed.'),
+    )
+    arg_prsr.add_argument(
+        '--result-cache',
+        type=pathlib.Path,
+        metavar='DIR',
+        help=(
+            'Directory for caching the fitted models and reports of '
+            'runs, keyed by the contents of their inputs.  Repeating '
+            'a run reuses its report, and a run that only changes the '
+            'evaluation or reporting options reuses its models.'),
+    )
+    arg_prsr.add_argument(
+        '--result-cache-mb',
+        type=float,
+        default=1024,
+        metavar='MB',
+        help=(
+            'Limit on the size of the result cache, in megabytes.  The '
+            'least recently used results are deleted first.  '
+            '[default: %(default)s]'),
     )
     # Parse regular CLI arguments
     env, extra_args = arg_prsr.parse_known_args(args)
     env = vars(env) # Convert `argparse.Namespace` to dictionary
-    # Parse weights
-    weights_arg = env.get('weights')
-    if weights_arg is not None:
-        atom, err = parse.atom_err(weights_arg)
-        if err is None:
-            env['weights'] = atom
-    # Parse decision tree arguments
+    parse_weights_arg(env)
+    if env.get('incremental') and env.get('cache_dir') is None:
+        arg_prsr.error('`--incremental` requires `--cache-dir`')
+    screening_args = screening_args_from_env(arg_prsr, env)
+    if model_family is None:
+        model_family = env.get('model')
+    if model_family != 'dt':
+        for name in ('pdf', 'save_model'):
+            if env.get(name) is not None:
+                arg_prsr.error('`--{}` requires decision trees'.format(
+                    name.replace('_', '-')))
+    # Parse model arguments
     try:
-        dt_args = parse_args_as_dict(
+        model_args = parse_args_as_dict(
             *extra_args,
-            key_prefix='--dt.',
+            key_prefix='--{}.'.format(model_family),
             value_parser=parse.atom_err)
     except argparse.ArgumentError as e:
         arg_prsr.error(str(e))
     # Start!
+    from barnapy import logging
     logging.default_config()
-    run_decision_trees_api(
-        data_matrix_filename=env.get('data'),
-        feature_table_filename=env.get('features'),
-        concept_table_filename=env.get('concepts'),
-        tree_pdf_filename=env.get('pdf'),
-        weight_feature=env.get('weights'),
-        decision_tree_args=dt_args,
-    )
+    try:
+        run_models_api(
+            data_matrix_filename=env.get('data'),
+            feature_table_filename=env.get('features'),
+            concept_table_filename=env.get('concepts'),
+            tree_pdf_filename=env.get('pdf'),
+            weight_feature=env.get('weights'),
+            model_family=model_family,
+            model_args=model_args,
+            output=env.get('output'),
+            n_jobs=env.get('jobs'),
+            random_seed=env.get('seed'),
+            cache_dir=env.get('cache_dir'),
+            profile=(env.get('profile')
+                     or env.get('profile_json') is not None),
+            profile_filename=env.get('profile_json'),
+            incremental=env.get('incremental'),
+            model_filename=env.get('save_model'),
+            report_format=env.get('format'),
+            fold_strategy=env.get('fold_strategy'),
+            n_bootstraps=env.get('bootstraps'),
+            permutation_importance=env.get('permutation_importance'),
+            top_k=env.get('top_k'),
+            n_permutation_repeats=env.get('permutation_repeats'),
+            screening_args=screening_args,
+            controls_per_case=env.get('controls_per_case'),
+            result_cache_dir=env.get('result_cache'),
+            result_cache_nbytes=int(env.get('result_cache_mb') * 2**20),
+        )
+    finally:
+        close_output(env.get('output'))
 
 
 def decision_tree_main():
     decision_tree(os.path.basename(sys.argv[0]), *sys.argv[1:])
+
+
+def model_main():
+    model(os.path.basename(sys.argv[0]), *sys.argv[1:])
+
+
+def decision_tree_sweep(prog_name, *args):
+    arg_prsr = argparse.ArgumentParser(
+        prog=prog_name,
+        description=(
+            'Compare decision tree configurations by cross validating '
+            'each of them on the same folds of feature vector data.  '
+            'Specify the configurations as a JSON or YAML file '
+            '(`--sweep`) and/or as a grid of comma-separated values of '
+            'decision tree options (e.g. `--dt.max_depth=3,5,7`).  '
+            'Each configuration in the file is combined with each '
+            'point in the grid.'),
+        allow_abbrev=False,
+    )
+    add_data_arguments(arg_prsr)
+    arg_prsr.add_argument(
+        '--sweep',
+        type=argparse.FileType('rt'),
+        metavar='FILE',
+        help=(
+            'JSON or YAML file containing either a list of decision '
+            'tree argument dictionaries or a dictionary of lists of '
+            'argument values to expand into a grid.'),
+    )
+    add_output_arguments(arg_prsr)
+    add_cv_arguments(arg_prsr)
+    # Parse regular CLI arguments
+    env, extra_args = arg_prsr.parse_known_args(args)
+    env = vars(env) # Convert `argparse.Namespace` to dictionary
+    parse_weights_arg(env)
+    # Parse the grid of decision tree arguments
+    try:
+        dt_grid = parse_args_as_dict(
+            *extra_args,
+            key_prefix='--dt.',
+            value_parser=parse_list_err)
+        configs = ([{}] if env.get('sweep') is None
+                   else load_sweep_configurations(env.get('sweep')))
+    except (argparse.ArgumentError, ValueError) as e:
+        arg_prsr.error(str(e))
+    configs = [dict(config, **grid_point)
+               for config in configs
+               for grid_point in expand_grid(dt_grid)]
+    # Start!
+    from barnapy import logging
+    logging.default_config()
+    try:
+        run_decision_tree_sweep_api(
+            data_matrix_filename=env.get('data'),
+            feature_table_filename=env.get('features'),
+            weight_feature=env.get('weights'),
+            decision_tree_args_list=configs,
+            output=env.get('output'),
+            n_jobs=env.get('jobs'),
+            random_seed=env.get('seed'),
+            cache_dir=env.get('cache_dir'),
+            fold_strategy=env.get('fold_strategy'),
+        )
+    finally:
+        close_output(env.get('output'))
+
+
+def decision_tree_sweep_main():
+    decision_tree_sweep(os.path.basename(sys.argv[0]), *sys.argv[1:])
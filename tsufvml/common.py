@@ -4,14 +4,14 @@
 # under the MIT License.  See `LICENSE.txt` for details.
 
 
-import csv
 import io
 import pathlib
-import re
-import statistics
-import textwrap
+import sys
 
-from barnapy import logging
+# Postpone imports that are not needed for parsing command line
+# arguments so that starting up is fast.  The standard library modules
+# `csv`, `json`, `re`, and `statistics` and `barnapy.logging` are
+# imported where they are used.
 
 
 def open_file(filename, mode='rt'):
@@ -23,20 +23,269 @@ def open_file(filename, mode='rt'):
         return open(filename, mode)
 
 
-def load_svmlight_as_matrix(filename):
+def compact_dtype(values):
     """
-    Return (data, labels) as defined in the given svmlight file.
+    Return the smallest of `uint8`, `float32`, and `float64` that
+    represents all the given values exactly.
+    """
+    import numpy
+    values = numpy.asarray(values)
+    if values.size == 0 or values.dtype == numpy.uint8:
+        return numpy.dtype(numpy.uint8)
+    if (values.min() >= 0 and values.max() <= 255
+            and numpy.array_equal(
+                values.astype(numpy.uint8), values)):
+        return numpy.dtype(numpy.uint8)
+    if numpy.array_equal(values.astype(numpy.float32), values):
+        return numpy.dtype(numpy.float32)
+    return numpy.dtype(numpy.float64)
+
+
+def compact_matrix(data):
+    """
+    Return the given CSR matrix with its values stored in the smallest
+    exact dtype (see `compact_dtype`) and its indices stored as 32-bit
+    integers if possible.  Typical data of 0/1 indicators then takes 5
+    bytes per nonzero rather than 16.  The given matrix is not
+    modified, and arrays that are already compact are not copied.
+
+    Estimators convert the data to the dtype they need when they are
+    fit, so compacting does not change any results.  Objects other
+    than CSR matrices (e.g. `matrix.CsrView`) are returned as given.
+    """
+    import numpy
+    from scipy import sparse
+    if not sparse.isspmatrix_csr(data):
+        return data
+    values = data.data.astype(compact_dtype(data.data), copy=False)
+    idx_dtype = (numpy.int32
+                 if max(max(data.shape), data.nnz) < 2**31
+                 else numpy.int64)
+    return sparse.csr_matrix(
+        (values, data.indices.astype(idx_dtype, copy=False),
+         data.indptr.astype(idx_dtype, copy=False)),
+        shape=data.shape, copy=False)
+
+
+def load_svmlight_as_matrix(filename, cache_dir=None, incremental=False):
+    """
+    Return (data, labels) as defined in the given svmlight file.  The
+    data is compacted by `compact_matrix`.
 
     Note that 1-based indices in svmlight files are 0-based in the
     matrix.
+
+    If `cache_dir` is given, the parsed data is stored there in binary
+    form and later loads of the same, unchanged file are memory mapped
+    from there instead of being parsed again.  If `incremental`, rows
+    appended to the file are parsed and appended to the stored data
+    instead of parsing the whole file again.  (See
+    `matrix.load_svmlight_cached`.)
     """
+    if cache_dir is not None:
+        from tsufvml import matrix
+        return matrix.load_svmlight_cached(
+            filename, cache_dir, incremental=incremental)
     from sklearn import datasets
     with open_file(filename, 'rb') as file:
-        return datasets.load_svmlight_file(file)
+        data, labels = datasets.load_svmlight_file(file)
+    return compact_matrix(data), labels
+
+
+class _ArrayBuffer:
+    """
+    Growable 1-D array for appending arrays without reallocating on
+    every append.
+    """
+
+    def __init__(self, dtype, capacity=1024):
+        import numpy
+        self._array = numpy.empty(capacity, dtype=dtype)
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def append(self, values):
+        new_len = self._len + len(values)
+        if new_len > len(self._array):
+            capacity = max(new_len, 2 * len(self._array))
+            self._array.resize(capacity, refcheck=False)
+        self._array[self._len:new_len] = values
+        self._len = new_len
+
+    def array(self):
+        """Return the appended values, releasing any unused capacity."""
+        self._array.resize(self._len, refcheck=False)
+        return self._array
+
+
+def iter_svmlight_chunks(file, chunk_n_lines=10000, end=None):
+    """
+    Parse the given binary file of svmlight data in chunks of lines.
+
+    Reading starts at the current position of the file and stops at
+    its end or at the first line that starts at or after byte position
+    `end` (if given).  Blank lines, comments, and query IDs are
+    skipped.
+
+    Generate (labels, row lengths, feature IDs, values) as arrays for
+    each chunk, where the feature IDs and values of all the rows are
+    concatenated.  Feature IDs are as they appear in the file (i.e.
+    typically 1-based).
+    """
+    import numpy
+    done = False
+    while not done:
+        labels = []
+        row_lens = []
+        pairs = []
+        n_lines = 0
+        while n_lines < chunk_n_lines:
+            if end is not None and file.tell() >= end:
+                done = True
+                break
+            line = file.readline()
+            if not line:
+                done = True
+                break
+            n_lines += 1
+            comment_pos = line.find(b'#')
+            if comment_pos >= 0:
+                line = line[:comment_pos]
+            tokens = line.split()
+            if not tokens:
+                continue
+            labels.append(tokens[0])
+            tokens = tokens[1:]
+            if tokens and tokens[0].startswith(b'qid:'):
+                tokens = tokens[1:]
+            row_lens.append(len(tokens))
+            pairs.extend(tokens)
+        if not labels:
+            continue
+        # Parse all the "ID:value" pairs at once
+        try:
+            numbers = numpy.array(
+                b' '.join(pairs).replace(b':', b' ').split(),
+                dtype=numpy.float64)
+        except ValueError:
+            numbers = None
+        if numbers is None or len(numbers) != 2 * len(pairs):
+            raise ValueError('Malformed svmlight data near byte {}'
+                             .format(file.tell()))
+        yield (numpy.array(labels, dtype=numpy.float64),
+               numpy.array(row_lens, dtype=numpy.int64),
+               numbers[0::2].astype(numpy.int64),
+               numbers[1::2])
+
+
+def load_svmlight_filtered(
+        filename,
+        feature_ids=None,
+        weight_feature_id=None,
+        chunk_n_lines=10000,
+):
+    """
+    Return (data, labels, weights, rm2orig_idxs) as defined in the
+    given svmlight file, keeping only the columns of the given feature
+    IDs.
+
+    The file is parsed in chunks of lines and the kept features are
+    appended directly to the CSR arrays of the result, so the other
+    features never take up memory.  The values of the feature with ID
+    `weight_feature_id` (if given) are extracted as the weights, and
+    rows without it have a weight of zero.  It is an error if no rows
+    have it.
+    `rm2orig_idxs` maps the columns of the data to the 0-based column
+    indices of the full data as returned by `load_svmlight_as_matrix`.
+    If `feature_ids` is `None`, all the features are kept.  The data
+    is compacted by `compact_matrix`.
+
+    Feature IDs are assumed to be 1-based.
+    """
+    import numpy
+    from scipy import sparse
+    from barnapy import logging
+    logger = logging.getLogger(__name__)
+    logger.info('Loading svmlight data from: {}', filename)
+    # Map feature IDs to columns of the limited data
+    col_map = None
+    if feature_ids is not None:
+        if not isinstance(feature_ids, numpy.ndarray):
+            feature_ids = numpy.fromiter(feature_ids, dtype=numpy.int64)
+        feature_ids = numpy.unique(feature_ids[feature_ids > 0])
+        col_map = numpy.full(
+            (feature_ids[-1] + 1) if len(feature_ids) > 0 else 1,
+            -1, dtype=numpy.int64)
+        col_map[feature_ids] = numpy.arange(len(feature_ids))
+    # Allocate buffers for the CSR arrays
+    data = _ArrayBuffer(numpy.float64)
+    indices = _ArrayBuffer(numpy.int32)
+    row_lens = _ArrayBuffer(numpy.int64)
+    labels = _ArrayBuffer(numpy.float64)
+    weights = (_ArrayBuffer(numpy.float64)
+               if weight_feature_id is not None else None)
+    max_feat_id = 0
+    n_weighted_rows = 0
+    with open_file(filename, 'rb') as file:
+        for (chunk_labels, chunk_row_lens, chunk_ids, chunk_values
+             ) in iter_svmlight_chunks(file, chunk_n_lines):
+            n_rows = len(chunk_labels)
+            row_idxs = numpy.repeat(numpy.arange(n_rows), chunk_row_lens)
+            if len(chunk_ids) > 0:
+                max_feat_id = max(max_feat_id, int(chunk_ids.max()))
+                if (chunk_ids.min() < 1
+                        or max_feat_id > numpy.iinfo(numpy.int32).max):
+                    raise ValueError(
+                        'Feature IDs must be 1-based 32-bit integers: {}'
+                        .format(filename))
+            # Extract the weights
+            if weights is not None:
+                chunk_weights = numpy.zeros(n_rows)
+                is_wgt = chunk_ids == weight_feature_id
+                chunk_weights[row_idxs[is_wgt]] = chunk_values[is_wgt]
+                weights.append(chunk_weights)
+                n_weighted_rows += numpy.count_nonzero(is_wgt)
+            # Keep only the features of interest
+            if col_map is None:
+                cols = chunk_ids - 1
+            else:
+                cols = numpy.full(len(chunk_ids), -1, dtype=numpy.int64)
+                in_map = chunk_ids < len(col_map)
+                cols[in_map] = col_map[chunk_ids[in_map]]
+                keep = cols >= 0
+                cols = cols[keep]
+                chunk_values = chunk_values[keep]
+                chunk_row_lens = numpy.bincount(
+                    row_idxs[keep], minlength=n_rows)
+            data.append(chunk_values)
+            indices.append(cols)
+            row_lens.append(chunk_row_lens)
+            labels.append(chunk_labels)
+    if weights is not None and len(labels) > 0 and n_weighted_rows == 0:
+        raise ValueError('Weight feature not found in data: {}: {}'
+                         .format(weight_feature_id,
+                                 getattr(filename, 'name', filename)))
+    # Like `load_svmlight_as_matrix`, the full data has as many columns
+    # as the largest feature ID
+    if col_map is None:
+        rm2orig_idxs = numpy.arange(max_feat_id)
+    else:
+        rm2orig_idxs = feature_ids[feature_ids <= max_feat_id] - 1
+    indptr = numpy.zeros(len(row_lens) + 1, dtype=numpy.int64)
+    numpy.cumsum(row_lens.array(), out=indptr[1:])
+    data = compact_matrix(sparse.csr_matrix(
+        (data.array(), indices.array(), indptr),
+        shape=(len(labels), len(rm2orig_idxs))))
+    return (data, labels.array(),
+            weights.array() if weights is not None else None,
+            rm2orig_idxs)
 
 
 def read_csv(
         filename, num_header_lines=1, comment_char=None, **csv_opts):
+    import csv
     with open_file(filename, 'rt') as file:
         for row_idx, row in enumerate(csv.reader(file, **csv_opts)):
             # Skip headers and comments
@@ -64,62 +313,159 @@ def mk_rm2all_idxs(items, rm_items):
     return rm2all
 
 
+def select_cols(data_matrix, col_mask):
+    """
+    Return (data matrix limited to the columns selected by the given
+    Boolean mask, array mapping the limited column indices to the
+    original column indices).  The limited data is compacted by
+    `compact_matrix`, as removing columns may leave only values that
+    fit in a smaller dtype.
+    """
+    import numpy
+    incl_idxs = numpy.flatnonzero(col_mask)
+    if len(incl_idxs) < data_matrix.shape[1]:
+        data_matrix = compact_matrix(data_matrix[:, incl_idxs])
+    return data_matrix, incl_idxs
+
+
 def rm_cols(data_matrix, rm_col_idxs):
-    all_col_idxs = range(data_matrix.shape[1])
-    rm_col_idxs = set(rm_col_idxs)
-    rm2orig_idxs = mk_rm2all_idxs(all_col_idxs, rm_col_idxs)
-    if rm_col_idxs:
-        incl_idxs = sorted(set(all_col_idxs) - rm_col_idxs)
-        data_matrix = data_matrix[:, incl_idxs]
-    return data_matrix, rm2orig_idxs
+    import numpy
+    col_mask = numpy.ones(data_matrix.shape[1], dtype=bool)
+    if not isinstance(rm_col_idxs, numpy.ndarray):
+        rm_col_idxs = numpy.fromiter(rm_col_idxs, dtype=numpy.intp)
+    col_mask[rm_col_idxs] = False
+    return select_cols(data_matrix, col_mask)
+
+
+def feature_ids_to_col_mask(feature_ids, n_cols):
+    """
+    Return a Boolean mask of the columns (of a matrix with `n_cols`
+    columns) that correspond to the given feature IDs.  Feature IDs
+    outside the matrix are ignored.
+    """
+    import numpy
+    if not isinstance(feature_ids, numpy.ndarray):
+        feature_ids = numpy.fromiter(feature_ids, dtype=numpy.int64)
+    # Feature IDs are 1-based while column indices are 0-based
+    col_idxs = feature_ids - 1
+    col_mask = numpy.zeros(n_cols, dtype=bool)
+    col_mask[col_idxs[(col_idxs >= 0) & (col_idxs < n_cols)]] = True
+    return col_mask
 
 
 def limit_matrix_to_features(data_matrix, feature_table):
-    # Find out what columns to remove
-    remove_col_idxs = []
-    for col_idx in range(data_matrix.shape[1]):
-        # Feature indices are 1-based while column indices are 0-based
-        feat_idx = col_idx + 1
-        if feat_idx not in feature_table:
-            remove_col_idxs.append(col_idx)
-    # Remove the columns
-    return rm_cols(data_matrix, remove_col_idxs)
+    from tsufvml import tables
+    feature_ids = (feature_table.ids
+                   if isinstance(feature_table, tables.FeatureTable)
+                   else feature_table.keys())
+    col_mask = feature_ids_to_col_mask(feature_ids, data_matrix.shape[1])
+    return select_cols(data_matrix, col_mask)
+
+
+def orig_col_idxs(col_idxs, rm2orig_idxs=None):
+    """
+    Map the given column indices of a limited matrix to the column
+    indices of the original matrix according to `rm2orig_idxs`, which
+    is an array as returned by `select_cols`.  (A mapping as returned
+    by `mk_rm2all_idxs` also works.)
+    """
+    import numpy
+    col_idxs = numpy.asarray(col_idxs, dtype=numpy.intp)
+    if rm2orig_idxs is None:
+        return col_idxs
+    elif isinstance(rm2orig_idxs, dict):
+        return numpy.array([rm2orig_idxs.get(i, i) for i in col_idxs],
+                           dtype=numpy.intp)
+    return numpy.asarray(rm2orig_idxs)[col_idxs]
+
+
+def feature_ids_to_col_idxs(feature_ids, rm2orig_idxs=None):
+    """
+    Return the (sorted) column indices of the given (1-based) feature
+    IDs in a matrix limited by `rm2orig_idxs`, which is an array as
+    returned by `select_cols`.  Features not in the matrix are omitted.
+
+    Together with `FeatureTable.ids_with_name` and
+    `FeatureTable.ids_with_value` this selects columns by feature name
+    or by concept.
+    """
+    import numpy
+    orig_idxs = numpy.unique(
+        numpy.asarray(feature_ids, dtype=numpy.intp)) - 1
+    if rm2orig_idxs is None:
+        return orig_idxs[orig_idxs >= 0]
+    rm2orig_idxs = numpy.asarray(rm2orig_idxs)
+    col_idxs = numpy.searchsorted(rm2orig_idxs, orig_idxs)
+    found = col_idxs < len(rm2orig_idxs)
+    found[found] = rm2orig_idxs[col_idxs[found]] == orig_idxs[found]
+    return col_idxs[found]
 
 
 # Handling specific files
 
 
-def load_feature_table(filename):
+def load_feature_table(filename, cache_dir=None):
+    """
+    Return the feature table (as a `tables.FeatureTable`) in the given
+    file.
+
+    If `cache_dir` is given, the table is cached there in binary form,
+    and later loads of the unchanged file read the cache instead.
+    """
+    import csv
+    from barnapy import logging
+    from tsufvml import tables
     logging.getLogger(__name__).info(
         'Loading feature table from: {}', filename)
     id_idx = 0
     nm_idx = 1
     val_idx = 4
-    rows = read_csv(
-        filename,
-        comment_char='#',
-        delimiter='|',
-        num_header_lines=1,
-        quoting=csv.QUOTE_NONE,
-    )
-    return {int(r[id_idx]): (r[nm_idx] if r[nm_idx] else None,
-                             r[val_idx] if r[val_idx] else None)
-            for r in rows}
 
+    def load():
+        rows = read_csv(
+            filename,
+            comment_char='#',
+            delimiter='|',
+            num_header_lines=1,
+            quoting=csv.QUOTE_NONE,
+        )
+        return tables.FeatureTable.from_rows(
+            (int(r[id_idx]), r[nm_idx], r[val_idx]) for r in rows)
+    if cache_dir is not None:
+        return tables.load_cached(
+            filename, tables.FeatureTable, load, cache_dir)
+    return load()
+
+
+def load_concept_table(filename, cache_dir=None):
+    """
+    Return the concept table (as a `tables.ConceptTable`) in the given
+    file.
 
-def load_concept_table(filename):
+    If `cache_dir` is given, the table is cached there in binary form,
+    and later loads of the unchanged file read the cache instead.
+    """
+    import csv
+    from barnapy import logging
+    from tsufvml import tables
     logging.getLogger(__name__).info(
         'Loading concept table from: {}', filename)
     id_idx = 0
     desc_idx = 1
-    rows = read_csv(
-        filename,
-        delimiter='\t',
-        num_header_lines=1,
-        quoting=csv.QUOTE_NONE,
-    )
-    return {r[id_idx]: (r[desc_idx] if r[desc_idx] else None)
-            for r in rows}
+
+    def load():
+        rows = read_csv(
+            filename,
+            delimiter='\t',
+            num_header_lines=1,
+            quoting=csv.QUOTE_NONE,
+        )
+        return tables.ConceptTable.from_rows(
+            (r[id_idx], r[desc_idx]) for r in rows)
+    if cache_dir is not None:
+        return tables.load_cached(
+            filename, tables.ConceptTable, load, cache_dir)
+    return load()
 
 
 # Reporting
@@ -127,34 +473,51 @@ def load_concept_table(filename):
 
 def mk_feature_importance_table(
         feature_importances,
-        rm2orig_idxs={},
+        rm2orig_idxs=None,
         features={},
         concepts={},
+        permutation_importances=None,
 ):
+    """
+    Return (header, table) where each row of the table describes a
+    feature.  If permutation importances are given, they are the
+    second column, and those that are NaN (not computed) are `None`.
+    """
+    import math
     header = ('importance', 'col_idx', 'feat_id', 'feat_name',
               'concept_id', 'concept_desc')
+    if permutation_importances is not None:
+        header = header[:1] + ('permutation_importance',) + header[1:]
     table = []
-    for col_idx, importance in enumerate(feature_importances):
-        # Add 1 to convert 0-based column indices to 1-based feature IDs
-        feat_id = rm2orig_idxs.get(col_idx, col_idx) + 1
+    # Add 1 to convert 0-based column indices to 1-based feature IDs
+    feat_ids = orig_col_idxs(
+        range(len(feature_importances)), rm2orig_idxs) + 1
+    for col_idx, (importance, feat_id) in enumerate(
+            zip(feature_importances, feat_ids.tolist())):
         feat_nm, cncpt_id = features.get(feat_id, (None, None))
         cncpt_desc = concepts.get(cncpt_id)
         row = [importance, col_idx, feat_id, feat_nm,
                cncpt_id, cncpt_desc]
+        if permutation_importances is not None:
+            perm_importance = float(permutation_importances[col_idx])
+            row.insert(1, None if math.isnan(perm_importance)
+                       else perm_importance)
         table.append(row)
     return header, table
 
 
 def replace_variable_references_with_features(
         text,
-        rm2orig_idxs={},
+        rm2orig_idxs=None,
         features={},
         concepts={},
         max_description_length=30,
 ):
+    import re
     # Replace the variable references with features
     feature_legend = {}
-    var_pattern = re.compile(r'X\[(\d+)\]')
+    # Scikit-Learn 0.22 and later write "x[...]" rather than "X[...]"
+    var_pattern = re.compile(r'[Xx]\[(\d+)\]')
     new_text = io.StringIO()
     pos = 0
     match = var_pattern.search(text)
@@ -166,7 +529,7 @@ def replace_variable_references_with_features(
         # Write new variable name to output
         col_idx = int(match.group(1))
         # Add 1 to convert 0-based column indices to 1-based feature IDs
-        feat_id = rm2orig_idxs.get(col_idx, col_idx) + 1
+        feat_id = int(orig_col_idxs(col_idx, rm2orig_idxs)) + 1
         if feat_id in features:
             feat_nm, cncpt_id = features[feat_id]
             new_name = 'X[{}_{}]'.format(feat_id, feat_nm)
@@ -192,6 +555,60 @@ def replace_variable_references_with_features(
     return new_text.getvalue(), feature_legend
 
 
+class BufferedWriter:
+    """
+    Text stream that collects written text and writes it to the given
+    underlying stream (any object with a `write` method) in blocks of
+    about `buffer_size` characters.
+
+    This avoids the overhead of many small writes to the underlying
+    stream.  Use as a context manager or call `flush` when done.
+    """
+
+    def __init__(self, stream, buffer_size=2**16):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self._parts = []
+        self._size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def write(self, text):
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._parts:
+            self.stream.write(''.join(self._parts))
+            self._parts = []
+            self._size = 0
+        if hasattr(self.stream, 'flush'):
+            self.stream.flush()
+
+
+def iter_lines(text):
+    """
+    Generate the lines of the given text (including their line
+    endings) one at a time without splitting the whole text.
+    """
+    pos = 0
+    while pos < len(text):
+        end = text.find('\n', pos)
+        end = len(text) if end < 0 else end + 1
+        yield text[pos:end]
+        pos = end
+
+
+# Names of the supported report formats
+report_formats = ('yaml', 'jsonl')
+
+
 def print_report(
         cv_roc_areas=None,
         final_model_roc_area=None,
@@ -200,53 +617,295 @@ def print_report(
         limit_n_features=100,
         model_text=None,
         feature_legend=None,
+        timings=None,
+        cv_evaluation=None,
+        output=None,
+        report_format='yaml',
 ):
+    """
+    Write a report of the given results to `output` (a text stream,
+    by default `sys.stdout`) through a `BufferedWriter`.
+
+    The report format is either 'yaml' (a YAML document for people)
+    or 'jsonl' (JSON Lines, one record per line, for programs).  The
+    model text can be a string or an iterable of lines, and is written
+    line by line.  The CV evaluation is a dictionary of pooled and
+    per-fold ROC and PR areas as returned by
+    `evaluation.evaluate_predictions`.
+    """
+    from barnapy import logging
+    write_report = _report_writers.get(report_format)
+    if write_report is None:
+        raise ValueError('Unknown report format: {!r}'.format(
+            report_format))
     logging.getLogger(__name__).info('Printing report')
-    print('%YAML 1.2')
-    print('---')
-    print()
+    with BufferedWriter(sys.stdout if output is None else output) as out:
+        write_report(
+            out.write,
+            cv_roc_areas=cv_roc_areas,
+            final_model_roc_area=final_model_roc_area,
+            feature_table=feature_table,
+            feature_table_header=feature_table_header,
+            limit_n_features=limit_n_features,
+            model_text=model_text,
+            feature_legend=feature_legend,
+            timings=timings,
+            cv_evaluation=cv_evaluation,
+        )
+
+
+def mean_defined_area(areas):
+    """
+    Return (mean, number of undefined areas) of the given areas (e.g.
+    of CV folds).  Undefined (NaN) areas, as of folds that lack
+    (weighted) positive or negative examples, are left out of the mean
+    as by `numpy.nanmean`.  The mean is NaN if no area is defined.
+    """
+    import math
+    import statistics
+    defined = [area for area in areas if not math.isnan(area)]
+    return ((statistics.mean(defined) if defined else float('nan')),
+            len(areas) - len(defined))
+
+
+def _write_yaml_mean_area(write, name, areas):
+    mean, n_undefined = mean_defined_area(areas)
+    write('mean {} area: {!s}\n'.format(name, mean))
+    if n_undefined > 0:
+        write('folds with undefined {} area: {}\n'.format(
+            name, n_undefined))
+    write('\n')
+
+
+def _write_yaml_report(
+        write,
+        cv_roc_areas=None,
+        final_model_roc_area=None,
+        feature_table=None,
+        feature_table_header=None,
+        limit_n_features=100,
+        model_text=None,
+        feature_legend=None,
+        timings=None,
+        cv_evaluation=None,
+):
+    import math
+    write('%YAML 1.2\n---\n\n')
     # Report ROC areas
     if cv_roc_areas:
-        print('ROC areas by fold:')
+        write('ROC areas by fold:\n')
         for idx, score in enumerate(cv_roc_areas):
-            print(' ', idx + 1, ':', score)
-        print('sorted ROC areas:')
-        for score in sorted(cv_roc_areas):
-            print(' ', '-', score)
-        print('mean ROC area:', statistics.mean(cv_roc_areas))
-        print()
+            write('  {} : {!s}\n'.format(idx + 1, score))
+        write('sorted ROC areas:\n')
+        # Sort undefined (NaN) areas last
+        for score in sorted(cv_roc_areas,
+                            key=lambda area: (math.isnan(area), area)):
+            write('  - {!s}\n'.format(score))
+        _write_yaml_mean_area(write, 'ROC', cv_roc_areas)
+    if cv_evaluation:
+        if 'fold_pr_areas' in cv_evaluation:
+            write('PR areas by fold:\n')
+            for idx, score in enumerate(cv_evaluation['fold_pr_areas']):
+                write('  {} : {!s}\n'.format(idx + 1, score))
+            _write_yaml_mean_area(
+                write, 'PR', cv_evaluation['fold_pr_areas'])
+        for name in ('ROC', 'PR'):
+            key = name.lower() + '_area'
+            write('pooled CV {} area: {!s}\n'.format(
+                name, cv_evaluation[key]))
+            if cv_evaluation.get(key + '_interval'):
+                write('pooled CV {} area {:g}% interval: {!s}\n'.format(
+                    name, 100 * cv_evaluation['confidence'],
+                    cv_evaluation[key + '_interval']))
+        write('\n')
     if final_model_roc_area is not None:
-        print('final model ROC area:', final_model_roc_area)
-        print()
+        write('final model ROC area: {!s}\n\n'.format(
+            final_model_roc_area))
     # Report features
     if feature_table:
-        print('features ranked by importance:')
+        write('features ranked by importance:\n')
         if feature_table_header:
             header = ['rank']
             header.extend(feature_table_header)
-            print('  -', header)
+            write('  - {!s}\n'.format(header))
         for rank, feat_row in enumerate(
                 feature_table[:limit_n_features]):
-            print('  - [', end='')
-            print(rank + 1, *feat_row, sep=', ', end=']\n')
-        print()
-    # Include a textual description of the model
+            write('  - [{}, {}]\n'.format(
+                rank + 1, ', '.join(str(value) for value in feat_row)))
+        write('\n')
+    # Include a textual description of the model.  Indent its lines as
+    # a literal block scalar without copying the whole text.
     if model_text:
-        print('model: |')
-        print(textwrap.indent(model_text, '  '))
-        print()
+        write('model: |\n')
+        for line in (iter_lines(model_text)
+                     if isinstance(model_text, str) else model_text):
+            if not line.isspace():
+                write('  ')
+            write(line)
+        write('\n\n')
     # Include the feature legend
     if feature_legend:
-        print('feature legend:')
+        write('feature legend:\n')
         for feat_nm in sorted(feature_legend.keys()):
-            print('  ', feat_nm, ': ', repr(feature_legend[feat_nm]),
-                  sep='')
-        print()
+            write('  {}: {!r}\n'.format(feat_nm, feature_legend[feat_nm]))
+        write('\n')
+    # Include the timings of the processing stages
+    if timings:
+        write('timings:\n')
+        for record in timings:
+            write('  - {}\n'.format(format_yaml_flow_mapping(record)))
+        write('\n')
     # EOF
-    print('...')
+    write('...\n')
+
+
+def _json_default(obj):
+    # Convert NumPy scalars
+    if hasattr(obj, 'item'):
+        return obj.item()
+    return str(obj)
+
+
+def _write_jsonl_report(
+        write,
+        cv_roc_areas=None,
+        final_model_roc_area=None,
+        feature_table=None,
+        feature_table_header=None,
+        limit_n_features=100,
+        model_text=None,
+        feature_legend=None,
+        timings=None,
+        cv_evaluation=None,
+):
+    import json
+
+    def write_record(record):
+        write(json.dumps(record, default=_json_default))
+        write('\n')
+    # Every record has a 'record' field that says what it is
+    if cv_roc_areas:
+        for idx, score in enumerate(cv_roc_areas):
+            write_record(dict(record='cv_roc_area', fold=idx + 1,
+                              roc_area=score))
+        mean, n_undefined = mean_defined_area(cv_roc_areas)
+        write_record(dict(record='mean_cv_roc_area', roc_area=mean,
+                          n_undefined_folds=n_undefined))
+    if cv_evaluation:
+        for idx, score in enumerate(
+                cv_evaluation.get('fold_pr_areas', ())):
+            write_record(dict(record='cv_pr_area', fold=idx + 1,
+                              pr_area=score))
+        if 'fold_pr_areas' in cv_evaluation:
+            mean, n_undefined = mean_defined_area(
+                cv_evaluation['fold_pr_areas'])
+            write_record(dict(record='mean_cv_pr_area', pr_area=mean,
+                              n_undefined_folds=n_undefined))
+        for key in ('roc_area', 'pr_area'):
+            record = dict(record='pooled_cv_' + key)
+            record[key] = cv_evaluation[key]
+            if cv_evaluation.get(key + '_interval'):
+                record.update(
+                    confidence=cv_evaluation['confidence'],
+                    interval=cv_evaluation[key + '_interval'])
+            write_record(record)
+    if final_model_roc_area is not None:
+        write_record(dict(record='final_model_roc_area',
+                          roc_area=final_model_roc_area))
+    if feature_table:
+        for rank, feat_row in enumerate(
+                feature_table[:limit_n_features]):
+            record = dict(record='feature', rank=rank + 1)
+            if feature_table_header:
+                record.update(zip(feature_table_header, feat_row))
+            else:
+                record['values'] = feat_row
+            write_record(record)
+    # Write the model text as one JSON string, one line at a time
+    if model_text:
+        write('{"record": "model", "text": "')
+        for line in (iter_lines(model_text)
+                     if isinstance(model_text, str) else model_text):
+            write(json.dumps(line)[1:-1])
+        write('"}\n')
+    if feature_legend:
+        for feat_nm in sorted(feature_legend.keys()):
+            write_record(dict(record='feature_legend', feature=feat_nm,
+                              description=feature_legend[feat_nm]))
+    if timings:
+        for timing in timings:
+            record = dict(record='timing')
+            record.update(timing)
+            write_record(record)
+
+
+_report_writers = dict(
+    yaml=_write_yaml_report,
+    jsonl=_write_jsonl_report,
+)
+
+
+def format_yaml_flow_mapping(mapping):
+    """
+    Format the given mapping of names to scalars as a one-line YAML
+    flow mapping.
+    """
+    items = []
+    for key, value in mapping.items():
+        if value is None:
+            value = 'null'
+        elif isinstance(value, str):
+            value = repr(value)
+        items.append('{}: {}'.format(key, value))
+    return '{' + ', '.join(items) + '}'
+
+
+def print_sweep_report(
+        configurations,
+        cv_roc_areas,
+        output=None,
+):
+    """
+    Write a report of the given model configurations ranked by their
+    mean CV ROC areas (given as a list of lists of scores in the same
+    order as the configurations) to `output` (a text stream, by default
+    `sys.stdout`).  The means leave out undefined (NaN) areas (see
+    `mean_defined_area`), and configurations without any defined areas
+    are ranked last.
+    """
+    import math
+    import statistics
+    from barnapy import logging
+    logging.getLogger(__name__).info('Printing sweep report')
+    means = [mean_defined_area(scores) for scores in cv_roc_areas]
+    ranked = sorted(
+        zip(configurations, cv_roc_areas, means),
+        # By decreasing mean with NaN means last
+        key=lambda item: (math.isnan(item[2][0]), -item[2][0]),
+    )
+    with BufferedWriter(sys.stdout if output is None else output) as out:
+        out.write('%YAML 1.2\n---\n\n')
+        out.write('configurations ranked by mean ROC area:\n')
+        for rank, (config, scores, (mean, n_undefined)) in enumerate(
+                ranked):
+            out.write('  - rank: {}\n'.format(rank + 1))
+            out.write('    arguments: {!s}\n'.format(config))
+            out.write('    mean ROC area: {!s}\n'.format(mean))
+            defined = [score for score in scores if not math.isnan(score)]
+            if len(defined) > 1:
+                out.write('    stdev ROC area: {!s}\n'.format(
+                    statistics.stdev(defined)))
+            if n_undefined > 0:
+                out.write('    folds with undefined ROC area: {}\n'
+                          .format(n_undefined))
+            out.write('    ROC areas by fold: {!s}\n'.format(list(scores)))
+        out.write('\n')
+        # EOF
+        out.write('...\n')
 
 
 def render_dot_as_pdf(dot_text, pdf_filename):
+    from barnapy import logging
     logging.getLogger(__name__).info(
         'Rendering Dot text into PDF: {}', pdf_filename)
     pdf_path = pathlib.Path(pdf_filename)
@@ -0,0 +1,187 @@
+"""
+Evaluation of predicted scores by ROC and precision-recall areas
+
+All the areas of a set of predictions (pooled over all the examples,
+for each CV fold, and for each bootstrap sample) are computed from one
+sort of the examples by decreasing score.  The examples are then
+arranged into groups (folds or bootstrap samples) that keep that
+order, and the areas of all the groups are computed at once with
+cumulative sums and `numpy.bincount` rather than a Python loop.
+
+The precision-recall (PR) area is the average precision, as in
+`sklearn.metrics.average_precision_score`.  Areas that are undefined
+because a group lacks positive or negative examples are NaN.
+"""
+
+# Copyright (c) 2019 Aubrey Barnard.
+#
+# This is free software released under the MIT License.  See
+# `LICENSE.txt` for details.
+
+
+# Limit on the memory used for the arrays of one batch of bootstrap
+# samples
+_max_bootstrap_batch_nbytes = 2**27
+
+
+def _grouped_areas(scores, groups, pos_wgts, neg_wgts, n_groups):
+    """
+    Return (ROC areas, PR areas) of each of `n_groups` groups of
+    examples.  The examples must be in order of group and then of
+    decreasing score.  Each example has a weight as a positive
+    (`pos_wgts`) and a weight as a negative (`neg_wgts`), one of which
+    is zero.
+    """
+    import numpy
+    # Each run of tied scores within a group is one point on the curves
+    is_end = numpy.ones(len(scores), dtype=bool)
+    is_end[:-1] = ((scores[1:] != scores[:-1])
+                   | (groups[1:] != groups[:-1]))
+    ends = numpy.flatnonzero(is_end)
+    end_groups = groups[ends]
+    # Count the true and false positives of each point within its group
+    n_pos = numpy.bincount(groups, pos_wgts, minlength=n_groups)
+    n_neg = numpy.bincount(groups, neg_wgts, minlength=n_groups)
+    tps = (numpy.cumsum(pos_wgts)[ends]
+           - (numpy.cumsum(n_pos) - n_pos)[end_groups])
+    fps = (numpy.cumsum(neg_wgts)[ends]
+           - (numpy.cumsum(n_neg) - n_neg)[end_groups])
+    # Pair each point with the previous one, which is the origin for
+    # the first point of each group
+    is_first = numpy.ones(len(ends), dtype=bool)
+    is_first[1:] = end_groups[1:] != end_groups[:-1]
+    prev_tps = numpy.roll(tps, 1)
+    prev_tps[is_first] = 0
+    prev_fps = numpy.roll(fps, 1)
+    prev_fps[is_first] = 0
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        # Trapezoidal ROC area
+        roc_areas = numpy.bincount(
+            end_groups, (fps - prev_fps) * (tps + prev_tps),
+            minlength=n_groups) / (2 * n_pos * n_neg)
+        # Average precision: precision weighted by the change in recall
+        n_predicted = tps + fps
+        precisions = numpy.where(n_predicted > 0, tps / n_predicted, 1)
+        pr_areas = numpy.bincount(
+            end_groups, (tps - prev_tps) * precisions,
+            minlength=n_groups) / n_pos
+    # Rounding can leave a tiny nonzero numerator for a group without
+    # positives or negatives
+    roc_areas[(n_pos <= 0) | (n_neg <= 0)] = numpy.nan
+    pr_areas[n_pos <= 0] = numpy.nan
+    return roc_areas, pr_areas
+
+
+def _bootstrap_areas(ranks, pos_wgts, neg_wgts, n_bootstraps, rng):
+    """
+    Return (ROC areas, PR areas) of `n_bootstraps` bootstrap samples of
+    the given examples, which are in order of decreasing score and
+    whose ranks (with ties sharing a rank) are given in place of their
+    scores.
+
+    Resampling with replacement is done by weighting each example by
+    the number of times it is drawn, so every sample keeps the order of
+    the examples, and samples are processed in batches of arrays.
+    """
+    import numpy
+    n_examples = len(ranks)
+    roc_areas = []
+    pr_areas = []
+    # Each example of each sample uses about 64 bytes over all arrays
+    batch_size = max(
+        _max_bootstrap_batch_nbytes // (64 * max(n_examples, 1)), 1)
+    for batch_sta in range(0, n_bootstraps, batch_size):
+        n_samples = min(batch_size, n_bootstraps - batch_sta)
+        # Count how many times each example is drawn in each sample
+        draws = rng.randint(n_examples, size=(n_samples, n_examples))
+        draws += (numpy.arange(n_samples) * n_examples)[:, numpy.newaxis]
+        counts = numpy.bincount(
+            draws.ravel(), minlength=n_samples * n_examples)
+        del draws
+        rocs, prs = _grouped_areas(
+            numpy.tile(ranks, n_samples),
+            numpy.repeat(numpy.arange(n_samples), n_examples),
+            counts * numpy.tile(pos_wgts, n_samples),
+            counts * numpy.tile(neg_wgts, n_samples),
+            n_samples)
+        roc_areas.append(rocs)
+        pr_areas.append(prs)
+    return numpy.concatenate(roc_areas), numpy.concatenate(pr_areas)
+
+
+def _interval(values, confidence):
+    """Return the central percentile interval of the non-NaN values."""
+    import numpy
+    values = values[~numpy.isnan(values)]
+    if len(values) == 0:
+        return None
+    tail = 50 * (1 - confidence)
+    low, high = numpy.percentile(values, [tail, 100 - tail])
+    return [float(low), float(high)]
+
+
+def evaluate_predictions(
+        labels, scores, weights=None, folds=None, n_folds=None,
+        n_bootstraps=0, confidence=0.95, random_seed=None):
+    """
+    Evaluate the given scores (e.g. predicted probabilities of the
+    positive class) of examples with the given binary labels.  The
+    greater label is the positive class.
+
+    Return a dictionary of the ROC and PR areas of all the examples
+    (`roc_area`, `pr_area`).  If the fold of each example is given
+    (`folds`, an array of integers in `range(n_folds)`), also include
+    the areas of each fold (`fold_roc_areas`, `fold_pr_areas`).  If
+    `n_bootstraps` is positive, also include `confidence` intervals of
+    the areas of all the examples (`roc_area_interval`,
+    `pr_area_interval`) computed from that many bootstrap samples.
+    """
+    import numpy
+    labels = numpy.asarray(labels)
+    scores = numpy.asarray(scores, dtype=numpy.float64)
+    weights = (numpy.ones(len(labels)) if weights is None
+               else numpy.asarray(weights, dtype=numpy.float64))
+    # Sort by decreasing score
+    order = numpy.argsort(-scores, kind='mergesort')
+    sorted_scores = scores[order]
+    is_pos = labels[order] == labels.max()
+    sorted_wgts = weights[order]
+    pos_wgts = numpy.where(is_pos, sorted_wgts, 0)
+    neg_wgts = numpy.where(is_pos, 0, sorted_wgts)
+    # Pooled areas
+    roc_areas, pr_areas = _grouped_areas(
+        sorted_scores, numpy.zeros(len(order), dtype=numpy.intp),
+        pos_wgts, neg_wgts, 1)
+    evaluation = dict(
+        roc_area=float(roc_areas[0]),
+        pr_area=float(pr_areas[0]),
+    )
+    # Areas by fold.  Partitioning the sorted examples by fold with a
+    # stable sort of the fold numbers keeps them in order of score.
+    if folds is not None:
+        if n_folds is None:
+            n_folds = int(numpy.max(folds)) + 1
+        sorted_folds = numpy.asarray(folds)[order]
+        by_fold = numpy.argsort(sorted_folds, kind='mergesort')
+        roc_areas, pr_areas = _grouped_areas(
+            sorted_scores[by_fold], sorted_folds[by_fold].astype(
+                numpy.intp), pos_wgts[by_fold], neg_wgts[by_fold],
+            n_folds)
+        evaluation.update(
+            fold_roc_areas=roc_areas.tolist(),
+            fold_pr_areas=pr_areas.tolist(),
+        )
+    # Bootstrap confidence intervals
+    if n_bootstraps > 0:
+        ranks = numpy.zeros(len(order), dtype=numpy.int64)
+        numpy.cumsum(sorted_scores[1:] != sorted_scores[:-1],
+                     out=ranks[1:])
+        roc_areas, pr_areas = _bootstrap_areas(
+            ranks, pos_wgts, neg_wgts, n_bootstraps,
+            numpy.random.RandomState(random_seed))
+        evaluation.update(
+            confidence=confidence,
+            roc_area_interval=_interval(roc_areas, confidence),
+            pr_area_interval=_interval(pr_areas, confidence),
+        )
+    return evaluation
@@ -0,0 +1,106 @@
+"""Timing and memory instrumentation of processing stages"""
+
+# Copyright (c) 2019 Aubrey Barnard.
+#
+# This is free software released under the MIT License.  See
+# `LICENSE.txt` for details.
+
+
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError: # Not available on Windows
+    resource = None
+
+
+def max_rss_bytes():
+    """Return the peak resident set size of this process, if known."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes but macOS reports bytes
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class StageTimer:
+    """
+    Records the wall clock time and peak memory of named stages.
+
+    Use as `with timer.stage(name): ...`.  Each stage produces a record
+    (dictionary) of its name, any given extra information, its
+    duration in seconds, the peak memory allocated during the stage as
+    traced by `tracemalloc` (if `trace_memory`), and the peak resident
+    set size of the process so far.  A disabled timer records nothing
+    and costs next to nothing.
+
+    Stages must not be nested because tracing the peak memory of a
+    stage resets the peak of any enclosing stage.  Records from other
+    processes can be added with `extend`.
+    """
+
+    def __init__(self, enabled=True, trace_memory=True):
+        self.enabled = enabled
+        self.trace_memory = trace_memory
+        self.records = []
+        self._started_tracing = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """Start tracing memory allocations if needed."""
+        if (self.enabled and self.trace_memory
+                and not tracemalloc.is_tracing()):
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def stop(self):
+        """Stop tracing memory allocations if this timer started it."""
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @contextlib.contextmanager
+    def stage(self, name, **info):
+        if not self.enabled:
+            yield
+            return
+        trace_memory = self.trace_memory and tracemalloc.is_tracing()
+        if trace_memory:
+            # Clearing the traces resets the peak
+            tracemalloc.clear_traces()
+        start = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - start
+        record = dict(stage=name)
+        record.update(info)
+        record.update(
+            seconds=seconds,
+            peak_traced_bytes=(tracemalloc.get_traced_memory()[1]
+                               if trace_memory else None),
+            max_rss_bytes=max_rss_bytes(),
+            pid=os.getpid(),
+        )
+        self.records.append(record)
+
+    def extend(self, records):
+        if self.enabled:
+            self.records.extend(records)
+
+    def total_seconds(self):
+        return sum(record['seconds'] for record in self.records)
+
+    def write_json(self, filename):
+        with open(str(filename), 'wt') as file:
+            json.dump(self.records, file, indent=2)
+            file.write('\n')
@@ -0,0 +1,483 @@
+"""Storage and caching of sparse data matrices"""
+
+# Copyright (c) 2019 Aubrey Barnard.
+#
+# This is free software released under the MIT License.  See
+# `LICENSE.txt` for details.
+
+
+import hashlib
+import io
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+
+from barnapy import logging
+
+
+# Names of the files comprising a stored matrix
+_csr_array_names = ('data', 'indices', 'indptr', 'labels')
+_meta_filename = 'meta.json'
+_folds_filename = 'folds.npy'
+# Directory for results derived from a stored matrix, which are
+# discarded whenever the matrix changes
+_derived_dirname = 'derived'
+
+# Number of bytes at each end of the cached part of a file that are
+# compared to check that the file has only been appended to
+_fingerprint_nbytes = 2**16
+
+
+def file_path(file):
+    """
+    Return the absolute path of the given filename, path, or file
+    object, or `None` if it does not correspond to a regular file.
+    """
+    if isinstance(file, io.IOBase):
+        file = getattr(file, 'name', None)
+        if not isinstance(file, (str, bytes, pathlib.Path)):
+            return None
+    path = os.path.abspath(str(file))
+    return path if os.path.isfile(path) else None
+
+
+def file_signature(path):
+    """Return (size, mtime in ns) of the file at the given path."""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def save_csr(dirname, data, labels, **meta):
+    """
+    Store the given CSR matrix and labels as `.npy` files in the given
+    directory, along with the given metadata as JSON.
+    """
+    import numpy
+    os.makedirs(dirname, exist_ok=True)
+    arrays = dict(
+        data=data.data,
+        indices=data.indices,
+        indptr=data.indptr,
+        labels=numpy.asarray(labels),
+    )
+    for name in _csr_array_names:
+        numpy.save(os.path.join(dirname, name + '.npy'), arrays[name])
+    meta['shape'] = list(data.shape)
+    with open(os.path.join(dirname, _meta_filename), 'wt') as file:
+        json.dump(meta, file)
+
+
+def load_csr_meta(dirname):
+    """Return the metadata of the matrix stored in the given directory."""
+    with open(os.path.join(dirname, _meta_filename), 'rt') as file:
+        return json.load(file)
+
+
+def _save_meta(dirname, meta):
+    # Write to a temporary file and then rename it so that readers never
+    # see a partial file
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=dirname)
+    with os.fdopen(fd, 'wt') as file:
+        json.dump(meta, file)
+    os.replace(tmp_path, os.path.join(dirname, _meta_filename))
+
+
+def derived_dir(dirname):
+    """
+    Return the directory for results derived from the matrix stored in
+    the given directory.  Its contents are deleted when rows are
+    appended to the matrix.
+    """
+    return os.path.join(dirname, _derived_dirname)
+
+
+def _fits_dtype(values, dtype):
+    """Whether the given values can be converted to `dtype` exactly."""
+    import numpy
+    if values.size == 0 or numpy.can_cast(values.dtype, dtype):
+        return True
+    if (numpy.issubdtype(values.dtype, numpy.integer)
+            and numpy.issubdtype(dtype, numpy.integer)):
+        int_info = numpy.iinfo(dtype)
+        return (int_info.min <= values.min()
+                and values.max() <= int_info.max)
+    return False
+
+
+def append_npy(filename, values):
+    """
+    Append the given values to the 1-D array stored in the given `.npy`
+    file.
+
+    The values are appended in place if the header of the file has room
+    for the new length and the values fit in the array's dtype.
+    (Existing memory maps of the file remain valid.)  Otherwise, the
+    file is replaced by one containing the concatenated arrays.
+    """
+    import numpy
+    from numpy.lib import format as npy_format
+    values = numpy.asarray(values)
+    with open(filename, 'r+b') as file:
+        version = npy_format.read_magic(file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = (
+                npy_format.read_array_header_1_0(file))
+        else:
+            shape, fortran_order, dtype = (
+                npy_format.read_array_header_2_0(file))
+        header_len = file.tell()
+        if len(shape) != 1 or fortran_order:
+            raise ValueError('Not a 1-D array: {}'.format(filename))
+        header = io.BytesIO()
+        header_info = dict(
+            descr=npy_format.dtype_to_descr(dtype),
+            fortran_order=False,
+            shape=(shape[0] + len(values),),
+        )
+        if version == (1, 0):
+            npy_format.write_array_header_1_0(header, header_info)
+        else:
+            npy_format.write_array_header_2_0(header, header_info)
+        if (_fits_dtype(values, dtype)
+                and len(header.getvalue()) == header_len):
+            file.seek(0, os.SEEK_END)
+            file.write(values.astype(dtype, copy=False).tobytes())
+            file.seek(0)
+            file.write(header.getvalue())
+            return
+    # Rewrite the file
+    old_values = numpy.load(filename, mmap_mode='r')
+    tmp_filename = filename + '.tmp.npy'
+    numpy.save(tmp_filename, numpy.concatenate((old_values, values)))
+    del old_values
+    os.replace(tmp_filename, filename)
+
+
+def load_folds(dirname, random_seed, n_folds):
+    """
+    Return the array of the cross validation fold of each row stored
+    with the matrix in the given directory, or `None` if there are no
+    stored folds for the given random seed and number of folds.  The
+    array may cover only a prefix of the rows if rows have been
+    appended since it was stored.
+    """
+    import numpy
+    meta = load_csr_meta(dirname).get('folds')
+    filename = os.path.join(dirname, _folds_filename)
+    if (meta != dict(random_seed=random_seed, n_folds=n_folds)
+            or not os.path.exists(filename)):
+        return None
+    return numpy.load(filename)
+
+
+def save_folds(dirname, folds, random_seed, n_folds):
+    """
+    Store the given array of the cross validation fold of each row with
+    the matrix in the given directory.  Only appends if the stored
+    folds (for the same random seed and number of folds) are a prefix
+    of the given ones.
+    """
+    import numpy
+    filename = os.path.join(dirname, _folds_filename)
+    old_folds = load_folds(dirname, random_seed, n_folds)
+    if old_folds is not None and len(old_folds) <= len(folds):
+        append_npy(filename, folds[len(old_folds):])
+        return
+    numpy.save(filename, folds)
+    meta = load_csr_meta(dirname)
+    meta['folds'] = dict(random_seed=random_seed, n_folds=n_folds)
+    _save_meta(dirname, meta)
+
+
+def load_csr(dirname, mmap_mode='r'):
+    """
+    Return (data, labels) from the matrix stored in the given directory.
+
+    The arrays are memory mapped according to `mmap_mode` (see
+    `numpy.load`) rather than read into memory, and the data is
+    returned as a `CsrView` so that selecting rows and columns does
+    not copy it.
+    """
+    import numpy
+    meta = load_csr_meta(dirname)
+    arrays = {
+        name: numpy.load(
+            os.path.join(dirname, name + '.npy'), mmap_mode=mmap_mode)
+        for name in _csr_array_names
+    }
+    data = CsrView(
+        arrays['data'], arrays['indices'], arrays['indptr'],
+        tuple(meta['shape']))
+    return data, arrays['labels']
+
+
+def cache_dir_for(path, cache_dir):
+    """Return the cache directory for the source file at `path`."""
+    key = hashlib.sha1(path.encode()).hexdigest()
+    return os.path.join(str(cache_dir), key)
+
+
+def prefix_fingerprint(path, size):
+    """
+    Return a fingerprint of the first `size` bytes of the file at the
+    given path.  The fingerprint is a hash of the first and last blocks
+    of those bytes, which is enough to detect a file that has been
+    replaced rather than appended to, without reading all of it.
+    """
+    with open(path, 'rb') as file:
+        head = file.read(min(size, _fingerprint_nbytes))
+        file.seek(max(size - _fingerprint_nbytes, 0))
+        tail = file.read(size - file.tell())
+    return dict(
+        sha1=hashlib.sha1(head + b'|' + tail).hexdigest(),
+        ends_line=(size == 0 or tail.endswith(b'\n')),
+    )
+
+
+def _append_svmlight(entry_dir, path, size, mtime_ns):
+    """
+    Parse the rows appended to the source file since it was stored in
+    the given cache entry and append them to the stored matrix.
+    """
+    import numpy
+    from tsufvml import common
+    meta = load_csr_meta(entry_dir)
+    old_size = meta['size']
+    with open(path, 'rb') as file:
+        file.seek(old_size)
+        new_data, new_labels, _, _ = common.load_svmlight_filtered(file)
+    n_old_rows, n_old_cols = meta['shape']
+    n_nonzeros = int(numpy.load(
+        os.path.join(entry_dir, 'indptr.npy'), mmap_mode='r')[-1])
+    arrays = dict(
+        data=new_data.data,
+        indices=new_data.indices,
+        # Convert first because the indices may be 32-bit
+        indptr=new_data.indptr[1:].astype(numpy.int64) + n_nonzeros,
+        labels=new_labels,
+    )
+    # Invalidate the entry while it is being modified
+    os.unlink(os.path.join(entry_dir, _meta_filename))
+    shutil.rmtree(derived_dir(entry_dir), ignore_errors=True)
+    for name in _csr_array_names:
+        append_npy(os.path.join(entry_dir, name + '.npy'), arrays[name])
+    meta.update(
+        shape=[n_old_rows + new_data.shape[0],
+               max(n_old_cols, new_data.shape[1])],
+        size=size,
+        mtime_ns=mtime_ns,
+        fingerprint=prefix_fingerprint(path, size),
+    )
+    _save_meta(entry_dir, meta)
+    return new_data.shape[0]
+
+
+def load_svmlight_cached(filename, cache_dir, incremental=False):
+    """
+    Return (data, labels) as defined in the given svmlight file, using
+    a binary copy stored in `cache_dir` if it is up to date.
+
+    The cache entry for a file is keyed by its path and is valid as
+    long as the file's size and modification time are unchanged.
+    Otherwise, the file is parsed and the cache entry is replaced.
+    Data loaded from the cache is memory mapped.
+
+    If `incremental` and the file has only grown since it was cached
+    (its previously cached part is unchanged and ended with a complete
+    line), only the new rows are parsed and they are appended to the
+    cache entry, along with any new columns.
+    """
+    from tsufvml import common
+    logger = logging.getLogger(__name__)
+    path = file_path(filename)
+    if path is None:
+        logger.info('Not caching data from non-file: {}', filename)
+        return common.load_svmlight_as_matrix(filename)
+    size, mtime_ns = file_signature(path)
+    entry_dir = cache_dir_for(path, cache_dir)
+    # Use the cache entry if it matches the current file
+    if os.path.exists(os.path.join(entry_dir, _meta_filename)):
+        meta = load_csr_meta(entry_dir)
+        if (meta.get('source') == path
+                and meta.get('size') == size
+                and meta.get('mtime_ns') == mtime_ns):
+            logger.info('Loading cached data from: {}', entry_dir)
+            return load_csr(entry_dir)
+        logger.info('Cached data is out of date: {}', entry_dir)
+        if (incremental
+                and meta.get('source') == path
+                and meta.get('size', size) < size
+                and meta.get('fingerprint') is not None
+                and meta['fingerprint']['ends_line']
+                and meta['fingerprint'] == prefix_fingerprint(
+                    path, meta['size'])):
+            n_new_rows = _append_svmlight(entry_dir, path, size, mtime_ns)
+            logger.info('Appended {} new rows to cached data: {}',
+                        n_new_rows, entry_dir)
+            return load_csr(entry_dir)
+    # Parse the file and store it.  Write to a temporary directory and
+    # then rename it so that readers never see a partial entry.
+    data, labels = common.load_svmlight_as_matrix(filename)
+    logger.info('Caching data in: {}', entry_dir)
+    os.makedirs(str(cache_dir), exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=str(cache_dir))
+    save_csr(tmp_dir, data, labels,
+             source=path, size=size, mtime_ns=mtime_ns,
+             fingerprint=prefix_fingerprint(path, size))
+    replace_dir(tmp_dir, entry_dir)
+    return load_csr(entry_dir)
+
+
+def replace_dir(src_dir, dst_dir):
+    """Move `src_dir` to `dst_dir`, replacing any existing `dst_dir`."""
+    if os.path.exists(dst_dir):
+        old_dir = tempfile.mkdtemp(
+            prefix='.old-', dir=os.path.dirname(dst_dir))
+        os.rename(dst_dir, os.path.join(old_dir, 'entry'))
+        os.rename(src_dir, dst_dir)
+        # Any open memory maps of the old files remain valid
+        shutil.rmtree(old_dir, ignore_errors=True)
+    else:
+        os.rename(src_dir, dst_dir)
+
+
+def _as_idxs(key, length):
+    """
+    Convert the given slice, integer, sequence of integers, or Boolean
+    mask to an array of indices into a sequence of the given length.
+    """
+    import numpy
+    if isinstance(key, slice):
+        return numpy.arange(length)[key]
+    idxs = numpy.asarray(key)
+    if idxs.dtype == bool:
+        if idxs.shape != (length,):
+            raise IndexError('Boolean mask has wrong shape: {} != {}'
+                             .format(idxs.shape, (length,)))
+        return numpy.flatnonzero(idxs)
+    idxs = numpy.atleast_1d(idxs)
+    if idxs.size > 0 and not numpy.issubdtype(idxs.dtype, numpy.integer):
+        raise IndexError('Indices must be integers: {}'.format(key))
+    idxs = idxs.astype(numpy.intp, copy=False)
+    if idxs.size > 0 and (idxs.min() < -length or idxs.max() >= length):
+        raise IndexError('Index out of range for length {}: {}'
+                         .format(length, key))
+    return numpy.where(idxs < 0, idxs + length, idxs)
+
+
+class CsrView:
+    """
+    Lazy view of a selection of the rows and columns of a CSR matrix.
+
+    The view shares the arrays of the underlying matrix, which may be
+    memory mapped.  Indexing a view with `[rows, cols]` (slices,
+    integers, index arrays, or Boolean masks) makes another view
+    without copying any data.  The selected data is only copied (into
+    a new `scipy.sparse.csr_matrix`) by `tocsr` or `toarray`.
+
+    Selected columns must be distinct.  Scalar indices select a single
+    row or column but do not reduce the dimensionality.
+    """
+
+    def __init__(
+            self, data, indices, indptr, shape,
+            row_idxs=None, col_idxs=None):
+        self.data = data
+        self.indices = indices
+        self.indptr = indptr
+        self.base_shape = tuple(shape)
+        self.row_idxs = row_idxs
+        self.col_idxs = col_idxs
+
+    @property
+    def shape(self):
+        return (len(self.row_idxs) if self.row_idxs is not None
+                else self.base_shape[0],
+                len(self.col_idxs) if self.col_idxs is not None
+                else self.base_shape[1])
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def ndim(self):
+        return 2
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return '<{} of shape {} over {} CSR matrix of shape {}>'.format(
+            type(self).__name__, self.shape, self.dtype, self.base_shape)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, slice(None))
+        if len(key) != 2:
+            raise IndexError('Too many indices: {}'.format(key))
+        rows, cols = key
+        n_rows, n_cols = self.shape
+        row_idxs = self.row_idxs
+        if not (isinstance(rows, slice) and rows == slice(None)):
+            row_idxs = _as_idxs(rows, n_rows)
+            if self.row_idxs is not None:
+                row_idxs = self.row_idxs[row_idxs]
+        col_idxs = self.col_idxs
+        if not (isinstance(cols, slice) and cols == slice(None)):
+            col_idxs = _as_idxs(cols, n_cols)
+            if self.col_idxs is not None:
+                col_idxs = self.col_idxs[col_idxs]
+        return type(self)(
+            self.data, self.indices, self.indptr, self.base_shape,
+            row_idxs, col_idxs)
+
+    def tocsr(self, copy=False):
+        """Return the selected data as a new CSR matrix."""
+        import numpy
+        from scipy import sparse
+        if self.row_idxs is None and self.col_idxs is None:
+            return sparse.csr_matrix(
+                (self.data, self.indices, self.indptr),
+                shape=self.base_shape, copy=copy)
+        n_rows, n_cols = self.shape
+        # Gather the positions of the nonzeros of the selected rows
+        if self.row_idxs is None:
+            row_lens = numpy.diff(self.indptr)
+            positions = None
+        else:
+            starts = self.indptr[self.row_idxs]
+            row_lens = self.indptr[self.row_idxs + 1] - starts
+            # Each position is its row's start plus its offset in the row
+            offsets = numpy.cumsum(row_lens) - row_lens
+            positions = (numpy.repeat(starts - offsets, row_lens)
+                         + numpy.arange(row_lens.sum()))
+        indices = (self.indices if positions is None
+                   else self.indices[positions])
+        # Keep only the nonzeros of the selected columns, renumbering
+        # the columns
+        if self.col_idxs is not None:
+            col_map = numpy.full(self.base_shape[1], -1, dtype=numpy.intp)
+            col_map[self.col_idxs] = numpy.arange(n_cols)
+            new_cols = col_map[indices]
+            keep = numpy.flatnonzero(new_cols >= 0)
+            indices = new_cols[keep]
+            if positions is None:
+                positions = keep
+            else:
+                positions = positions[keep]
+            # Recount the nonzeros per row
+            row_bounds = numpy.cumsum(row_lens)
+            row_lens = numpy.bincount(
+                numpy.searchsorted(row_bounds, keep, side='right'),
+                minlength=n_rows)
+        data = self.data if positions is None else self.data[positions]
+        indptr = numpy.zeros(n_rows + 1, dtype=numpy.int64)
+        numpy.cumsum(row_lens, out=indptr[1:])
+        return sparse.csr_matrix(
+            (data, indices, indptr), shape=(n_rows, n_cols), copy=copy)
+
+    def toarray(self):
+        return self.tocsr().toarray()
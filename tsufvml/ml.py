@@ -7,66 +7,1015 @@
 
 
 import io
+import re
+import threading
 
+from sklearn import base
+from sklearn import ensemble
+from sklearn import linear_model
 from sklearn import model_selection
-from sklearn import metrics
 from sklearn import tree
 
+try:
+    import joblib
+except ImportError: # Scikit-Learn < 0.21 bundles its own copy
+    from sklearn.externals import joblib
+
 from barnapy import logging
 
+from tsufvml import evaluation
+from tsufvml import instrument
+
+
+# Ways of selecting the data of each CV fold.  'copy' copies the
+# training and testing rows of each fold out of the data.  'contiguous'
+# sorts the rows by fold once so that the testing rows of each fold are
+# a slice of the sorted data and the training rows are the rest, which
+# are gathered into buffers that are reused from fold to fold.
+fold_strategies = ('copy', 'contiguous')
+
+# Buffers for training data by thread: thread ID -> (run ID, buffers by
+# name).  They are reused by the folds of one run and freed when the
+# thread starts another run or the run ends (see `_free_fold_buffers`).
+_fold_buffers = {}
+
+
+def _sklearn_version():
+    import sklearn
+    return tuple(int(part) for part in
+                 re.findall(r'\d+', sklearn.__version__)[:2])
+
+
+class DenseInputClassifier(base.BaseEstimator, base.ClassifierMixin):
+    """
+    Classifier that converts sparse data to dense (single precision)
+    arrays for the given classifier, which does not accept sparse data.
+    """
+
+    def __init__(self, estimator=None):
+        self.estimator = estimator
+
+    @staticmethod
+    def _dense(data):
+        import numpy
+        if hasattr(data, 'toarray'):
+            return data.astype(numpy.float32).toarray()
+        return numpy.asarray(data, dtype=numpy.float32)
+
+    def fit(self, data, labels, sample_weight=None):
+        self.estimator_ = base.clone(self.estimator).fit(
+            self._dense(data), labels, sample_weight=sample_weight)
+        self.classes_ = self.estimator_.classes_
+        self.n_features_in_ = data.shape[1]
+        return self
+
+    def predict_proba(self, data):
+        return self.estimator_.predict_proba(self._dense(data))
+
+    def predict(self, data):
+        return self.estimator_.predict(self._dense(data))
+
+
+# Scores for screening features (see `screening_scores`)
+screening_score_names = ('chi2', 'mi')
+
+
+def screening_scores(data, labels, weights=None, score='chi2'):
+    """
+    Return (score of each column, weighted count of nonzeros of each
+    column) for screening the columns of the given CSR matrix by their
+    association with the given binary labels.  The greater label is
+    the positive class.
+
+    Each column is treated as an indicator of its nonzero entries, and
+    the score is either the chi-square statistic ('chi2') or the mutual
+    information ('mi', in nats) of the 2x2 table of indicator by label.
+    The counts of all the columns are computed at once from the arrays
+    of the matrix.
+    """
+    import numpy
+    if score not in screening_score_names:
+        raise ValueError('Unknown screening score: {!r}'.format(score))
+    n_rows, n_cols = data.shape
+    labels = numpy.asarray(labels)
+    is_pos = labels == labels.max()
+    weights = (numpy.ones(n_rows) if weights is None
+               else numpy.asarray(weights, dtype=numpy.float64))
+    # Weight each nonzero by the weight of its row
+    nz_wgts = numpy.repeat(weights, numpy.diff(data.indptr))
+    nz_wgts[data.data == 0] = 0
+    nz_pos_wgts = numpy.where(
+        numpy.repeat(is_pos, numpy.diff(data.indptr)), nz_wgts, 0)
+    counts = numpy.bincount(data.indices, nz_wgts, minlength=n_cols)
+    # Cells of the table: present and positive, present and negative,
+    # absent and positive, absent and negative
+    n_all = weights.sum()
+    n_pos = weights[is_pos].sum()
+    pres_pos = numpy.bincount(data.indices, nz_pos_wgts, minlength=n_cols)
+    pres_neg = counts - pres_pos
+    abs_pos = n_pos - pres_pos
+    abs_neg = (n_all - n_pos) - pres_neg
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        if score == 'chi2':
+            scores = (n_all * (pres_pos * abs_neg
+                               - pres_neg * abs_pos) ** 2
+                      / (counts * (n_all - counts)
+                         * n_pos * (n_all - n_pos)))
+        else:
+            scores = numpy.zeros(n_cols)
+            for (cell, row_total, col_total) in (
+                    (pres_pos, counts, n_pos),
+                    (pres_neg, counts, n_all - n_pos),
+                    (abs_pos, n_all - counts, n_pos),
+                    (abs_neg, n_all - counts, n_all - n_pos)):
+                scores += numpy.where(
+                    cell > 0,
+                    cell / n_all * numpy.log(
+                        cell * n_all / (row_total * col_total)),
+                    0)
+    # Constant columns (or labels) have no association
+    scores[~numpy.isfinite(scores)] = 0
+    return scores, counts
+
+
+class ScreenedClassifier(base.BaseEstimator, base.ClassifierMixin):
+    """
+    Classifier that fits the given classifier to only the columns of
+    the training data that pass a univariate screening (see
+    `screening_scores`): those with at least `min_count` (weighted)
+    nonzeros and a score of at least `min_score`, limited to the
+    `n_keep` with the greatest scores.  At least the best column is
+    always kept.
+
+    Because the screening is part of fitting, each CV fold screens
+    only its own training rows.  The kept columns are `col_idxs_`, and
+    new data is limited to them before predicting.
+    """
+
+    def __init__(self, estimator=None, score='chi2', n_keep=None,
+                 min_score=None, min_count=0):
+        self.estimator = estimator
+        self.score = score
+        self.n_keep = n_keep
+        self.min_score = min_score
+        self.min_count = min_count
+
+    def fit(self, data, labels, sample_weight=None):
+        import numpy
+        data = data.tocsr()
+        scores, counts = screening_scores(
+            data, labels, sample_weight, self.score)
+        is_kept = counts >= self.min_count
+        if self.min_score is not None:
+            is_kept &= scores >= self.min_score
+        col_idxs = numpy.flatnonzero(is_kept)
+        if len(col_idxs) == 0:
+            col_idxs = numpy.argsort(-scores, kind='mergesort')[:1]
+        # Keep the best columns but in their original order
+        col_idxs = numpy.sort(col_idxs[numpy.argsort(
+            -scores[col_idxs], kind='mergesort')][:self.n_keep])
+        logging.getLogger(__name__).info(
+            'Screening kept {} of {} columns', len(col_idxs),
+            data.shape[1])
+        self.col_idxs_ = col_idxs
+        self.estimator_ = base.clone(self.estimator).fit(
+            data[:, col_idxs], labels, sample_weight=sample_weight)
+        self.classes_ = self.estimator_.classes_
+        self.n_features_in_ = data.shape[1]
+        return self
+
+    def predict_proba(self, data):
+        return self.estimator_.predict_proba(
+            data.tocsr()[:, self.col_idxs_])
+
+    def predict(self, data):
+        return self.estimator_.predict(data.tocsr()[:, self.col_idxs_])
+
+
+class DownsampledClassifier(base.BaseEstimator, base.ClassifierMixin):
+    """
+    Classifier that fits the given classifier to all the positive
+    examples (cases) but only a random sample of the negative examples
+    (controls) of at most `controls_per_case` controls per case.  The
+    greater label is the positive class.
+
+    The sampled controls are weighted by the inverse of the fraction
+    of controls sampled (times their given sample weights), so the
+    weighted totals of cases and controls are as in the full data and
+    the fitted classifier is an unbiased estimate of one fit to all
+    the examples.
+
+    Because the sampling is part of fitting, only training rows are
+    sampled, and predictions are made for all the given rows.
+    """
+
+    def __init__(self, estimator=None, controls_per_case=10,
+                 random_state=None):
+        self.estimator = estimator
+        self.controls_per_case = controls_per_case
+        self.random_state = random_state
+
+    def fit(self, data, labels, sample_weight=None):
+        import numpy
+        from sklearn import utils
+        labels = numpy.asarray(labels)
+        is_pos = labels == labels.max()
+        neg_idxs = numpy.flatnonzero(~is_pos)
+        n_cases = len(labels) - len(neg_idxs)
+        n_controls = min(int(round(self.controls_per_case * n_cases)),
+                         len(neg_idxs))
+        # Sample the controls but keep the rows in their original order
+        rng = utils.check_random_state(self.random_state)
+        is_kept = is_pos.copy()
+        is_kept[rng.choice(neg_idxs, n_controls, replace=False)] = True
+        row_idxs = numpy.flatnonzero(is_kept)
+        self.sampling_rate_ = (n_controls / len(neg_idxs)
+                               if len(neg_idxs) > 0 else 1.0)
+        weights = (numpy.ones(len(row_idxs))
+                   if sample_weight is None
+                   else numpy.asarray(
+                       sample_weight, dtype=numpy.float64)[row_idxs])
+        if self.sampling_rate_ > 0:
+            weights[~is_pos[row_idxs]] /= self.sampling_rate_
+        logging.getLogger(__name__).info(
+            'Sampled {} of {} controls', n_controls, len(neg_idxs))
+        self.estimator_ = base.clone(self.estimator).fit(
+            data.tocsr()[row_idxs, :], labels[row_idxs],
+            sample_weight=weights)
+        self.classes_ = self.estimator_.classes_
+        self.n_features_in_ = data.shape[1]
+        return self
+
+    def predict_proba(self, data):
+        return self.estimator_.predict_proba(data)
+
+    def predict(self, data):
+        return self.estimator_.predict(data)
+
+
+def unwrap_model(model, rm2orig_idxs=None):
+    """
+    Return (model, `rm2orig_idxs`) for the given fitted model, where
+    any `DownsampledClassifier` or `ScreenedClassifier` is replaced by
+    its fitted classifier and, for the latter, the mapping of columns
+    to original columns by one from the kept columns.  Other models
+    are returned as given.
+    """
+    if isinstance(model, DownsampledClassifier):
+        return unwrap_model(model.estimator_, rm2orig_idxs)
+    elif isinstance(model, ScreenedClassifier):
+        from tsufvml import common
+        return unwrap_model(
+            model.estimator_,
+            common.orig_col_idxs(model.col_idxs_, rm2orig_idxs))
+    return model, rm2orig_idxs
+
+
+def _mk_hist_gradient_boosting(**args):
+    try:
+        from sklearn.ensemble import HistGradientBoostingClassifier
+    except ImportError: # Scikit-Learn < 1.0 requires enabling it
+        from sklearn.experimental import ( # noqa: F401
+            enable_hist_gradient_boosting)
+        from sklearn.ensemble import HistGradientBoostingClassifier
+    # Histogram gradient boosting does not accept sparse data
+    return DenseInputClassifier(HistGradientBoostingClassifier(**args))
+
+
+def _mk_l1_logistic_regression(**args):
+    # Liblinear handles sparse data well.  Scikit-Learn 1.8 deprecates
+    # `penalty` in favor of `l1_ratio`.
+    l1_args = (dict(l1_ratio=1) if _sklearn_version() >= (1, 8)
+               else dict(penalty='l1'))
+    l1_args.update(solver='liblinear')
+    l1_args.update(args)
+    return linear_model.LogisticRegression(**l1_args)
+
+
+# Families of models by name: (description, constructor).  Each
+# constructor takes the arguments of the model as keyword arguments.
+model_families = {
+    'dt': ('decision tree', tree.DecisionTreeClassifier),
+    'rf': ('random forest', ensemble.RandomForestClassifier),
+    'et': ('extremely randomized trees', ensemble.ExtraTreesClassifier),
+    'hgb': ('histogram gradient boosting', _mk_hist_gradient_boosting),
+    'l1': ('L1-regularized logistic regression',
+           _mk_l1_logistic_regression),
+}
+
+
+# Models that convert their data to single precision when fitting, so
+# compact data (see `common.compact_matrix`) is given to them as is
+_single_precision_models = (
+    tree.DecisionTreeClassifier,
+    ensemble.RandomForestClassifier,
+    ensemble.ExtraTreesClassifier,
+    DenseInputClassifier,
+)
+
+
+def as_model_data(model, data):
+    """
+    Return the given data, which may be compact (see
+    `common.compact_matrix`), as the data for fitting or applying the
+    given model.
+
+    Tree models convert the data to single precision themselves.  For
+    other models, the data is converted to double precision, because
+    some (e.g. liblinear) would otherwise compute in single precision
+    and their results would depend on how compact the data is.
+    """
+    import numpy
+    while isinstance(model, (DownsampledClassifier, ScreenedClassifier)):
+        model = model.estimator
+    if (isinstance(model, _single_precision_models)
+            or data.dtype == numpy.float64):
+        return data
+    return data.astype(numpy.float64)
+
+
+def mk_model(model_family, model_args={}):
+    """
+    Return an (unfitted) classifier of the given family (see
+    `model_families`) with the given arguments.
+    """
+    if model_family not in model_families:
+        raise ValueError('Unknown model family: {!r}'.format(model_family))
+    _, constructor = model_families[model_family]
+    return constructor(**model_args)
+
+
+def feature_importances(model):
+    """
+    Return a new array of the importance of each feature according to
+    the given fitted model.
+
+    Tree models have feature importances.  For linear models, the
+    importances are the absolute values of the coefficients normalized
+    to sum to 1.  Other models (e.g. histogram gradient boosting) get
+    importances of zero.  Columns dropped by screening (see
+    `ScreenedClassifier`) also get importances of zero.
+    """
+    import numpy
+    if isinstance(model, DownsampledClassifier):
+        return feature_importances(model.estimator_)
+    elif isinstance(model, ScreenedClassifier):
+        # Kept columns have the importances of the fitted classifier
+        importances = numpy.zeros(model.n_features_in_)
+        importances[model.col_idxs_] = feature_importances(
+            model.estimator_)
+        return importances
+    elif isinstance(model, DenseInputClassifier):
+        model = model.estimator_
+    if hasattr(model, 'feature_importances_'):
+        # Copy because we aren't guaranteed to get our own array.  (I
+        # don't know what is returned because it's a property whose
+        # return value depends on rather impenetrable C code.)
+        return numpy.array(model.feature_importances_)
+    elif hasattr(model, 'coef_'):
+        importances = numpy.abs(model.coef_).sum(axis=0)
+        total = importances.sum()
+        return importances / total if total > 0 else importances
+    return numpy.zeros(model.n_features_in_)
+
+
+def _reusable_buffer(run_id, name, size, dtype):
+    """
+    Return an uninitialized array of the given size and dtype that
+    reuses the memory of the previous buffer with the same name (in the
+    same thread and run) if it is big enough.  The buffers of any other
+    run are freed.
+    """
+    import numpy
+    thread_id = threading.get_ident()
+    buffers_run_id, buffers = _fold_buffers.get(thread_id, (None, None))
+    if buffers is None or buffers_run_id != run_id:
+        buffers = {}
+        _fold_buffers[thread_id] = (run_id, buffers)
+    buffer = buffers.get(name)
+    if buffer is None or buffer.dtype != dtype or len(buffer) < size:
+        # Drop the old buffer before allocating its replacement
+        buffers.pop(name, None)
+        buffer = numpy.empty(size, dtype=dtype)
+        buffers[name] = buffer
+    return buffer[:size]
+
+
+def _free_fold_buffers():
+    """Free the buffers of `_reusable_buffer` of the current thread."""
+    _fold_buffers.pop(threading.get_ident(), None)
+
+
+def _new_run_id():
+    """Return an ID that distinguishes a run from all others."""
+    import uuid
+    return uuid.uuid4().hex
+
+
+def sort_rows_by_fold(data, labels, weights, folds):
+    """
+    Return (data, labels, weights, fold bounds) where the rows are
+    sorted so that the testing rows of fold `k` of the given folds
+    are the rows in `range(bounds[k], bounds[k + 1])`.
+    """
+    import numpy
+    order = numpy.concatenate([test_idxs for (_, test_idxs) in folds])
+    bounds = numpy.zeros(len(folds) + 1, dtype=numpy.intp)
+    numpy.cumsum([len(test_idxs) for (_, test_idxs) in folds],
+                 out=bounds[1:])
+    return (data[order, :].tocsr(),
+            labels[order],
+            weights[order] if weights is not None else None,
+            bounds)
+
+
+def _select_contiguous_fold_data(
+        data, labels, weights, sta, end, run_id=None):
+    """
+    Return (train data, train labels, train weights, test data) for
+    testing on rows `sta` through `end - 1` of the given CSR matrix and
+    training on the other rows.
+
+    The testing data shares the arrays of the given data and the
+    training data uses the reusable buffers of the given run, so no
+    matrices are allocated after the first fold.
+    """
+    import numpy
+    from scipy import sparse
+    n_rows, n_cols = data.shape
+    nz_sta = data.indptr[sta]
+    nz_end = data.indptr[end]
+    test_data = sparse.csr_matrix(
+        (data.data[nz_sta:nz_end], data.indices[nz_sta:nz_end],
+         data.indptr[sta:end + 1] - nz_sta),
+        shape=(end - sta, n_cols), copy=False)
+    # Gather the rows before and after the testing rows
+    n_train_nzs = len(data.data) - (nz_end - nz_sta)
+    train_values = _reusable_buffer(
+        run_id, 'data', n_train_nzs, data.data.dtype)
+    numpy.concatenate(
+        (data.data[:nz_sta], data.data[nz_end:]), out=train_values)
+    train_indices = _reusable_buffer(
+        run_id, 'indices', n_train_nzs, data.indices.dtype)
+    numpy.concatenate(
+        (data.indices[:nz_sta], data.indices[nz_end:]), out=train_indices)
+    n_train_rows = n_rows - (end - sta)
+    train_indptr = _reusable_buffer(
+        run_id, 'indptr', n_train_rows + 1, data.indptr.dtype)
+    train_indptr[:sta + 1] = data.indptr[:sta + 1]
+    train_indptr[sta + 1:] = data.indptr[end + 1:] - (nz_end - nz_sta)
+    train_data = sparse.csr_matrix(
+        (train_values, train_indices, train_indptr),
+        shape=(n_train_rows, n_cols), copy=False)
+    return (
+        train_data,
+        numpy.concatenate((labels[:sta], labels[end:])),
+        (numpy.concatenate((weights[:sta], weights[end:]))
+         if weights is not None else None),
+        test_data,
+    )
+
+
+def predict_scores(model, data):
+    """
+    Return the predicted probability of the positive (last) class of
+    each example according to the given fitted classifier.
+    """
+    return model.predict_proba(as_model_data(model, data))[:, -1]
 
-def run_cv_and_final_model(model, data, labels, weights=None):
+
+def _fit_and_predict_fold(
+        fold_idx, model, data, labels, weights, train_idxs, test_idxs,
+        profile=False, return_model=False, run_id=None):
+    """
+    Fit the given model on the training rows and predict the scores
+    (see `predict_scores`) of the testing rows.  Return (scores,
+    feature importances, timing records, fitted model if
+    `return_model` else `None`).
+
+    If `test_idxs` is a slice, the data must be a CSR matrix sorted by
+    fold (see `sort_rows_by_fold`), and the training rows are all the
+    other rows (`train_idxs` is ignored).  They are gathered into
+    buffers that are reused by the folds with the same `run_id`.
+    """
+    logging.getLogger(__name__).info('CV fold {}', fold_idx + 1)
+    fold = fold_idx + 1
+    with instrument.StageTimer(profile) as timer:
+        with timer.stage('select fold data', fold=fold):
+            if isinstance(test_idxs, slice):
+                (train_data, train_labels, train_wgts, test_data) = (
+                    _select_contiguous_fold_data(
+                        data, labels, weights,
+                        test_idxs.start, test_idxs.stop, run_id))
+            else:
+                # Select the training data.  Converting to CSR
+                # materializes lazy views (e.g. of memory mapped data)
+                # and is a no-op otherwise.
+                train_data = data[train_idxs, :].tocsr()
+                train_labels = labels[train_idxs]
+                train_wgts = (weights[train_idxs]
+                              if weights is not None else None)
+                # Select the testing data
+                test_data = data[test_idxs, :].tocsr()
+        # Fit the model
+        with timer.stage('fit', fold=fold):
+            model.fit(as_model_data(model, train_data), train_labels,
+                      sample_weight=train_wgts)
+        # Test
+        with timer.stage('predict', fold=fold):
+            scores = predict_scores(model, test_data)
+    # Return the feature importances as well
+    return (scores, feature_importances(model), timer.records,
+            model if return_model else None)
+
+
+def _fit_and_score_final(model, data, labels, weights, profile=False):
+    logging.getLogger(__name__).info('Fitting final model')
+    with instrument.StageTimer(profile) as timer:
+        with timer.stage('fit final model'):
+            data = data.tocsr()
+            model.fit(as_model_data(model, data), labels,
+                      sample_weight=weights)
+        with timer.stage('score final model'):
+            roc_area = evaluation.evaluate_predictions(
+                labels, predict_scores(model, data), weights)['roc_area']
+    return model, roc_area, timer.records
+
+
+def fit_and_predict_fold(
+        model, data, labels, train_idxs, test_idxs, weights=None):
+    """
+    Fit the given model on the training rows and predict the scores of
+    the testing rows, as for each fold of `run_cv_and_final_model`.
+    Return (scores, feature importances).
+    """
+    scores, importances, _, _ = _fit_and_predict_fold(
+        0, model, data, labels, weights, train_idxs, test_idxs)
+    return scores, importances
+
+
+def fit_and_score_final(model, data, labels, weights=None):
+    """
+    Fit the given model on all the data, as for the final model of
+    `run_cv_and_final_model`.  Return (fitted model, ROC area of its
+    predictions on the data).
+    """
+    model, roc_area, _ = _fit_and_score_final(
+        model, data, labels, weights)
+    return model, roc_area
+
+
+def mk_cv_folds(labels, random_seed=None, n_folds=10):
+    """
+    Return a list of (training indices, testing indices) for stratified
+    cross validation.
+    """
+    cv = model_selection.StratifiedKFold(
+        n_folds, shuffle=True, random_state=random_seed)
+    # Only the labels matter for stratification
+    return list(cv.split(labels, labels))
+
+
+def fold_assignments(labels, random_seed=None, n_folds=10):
+    """
+    Return an array of the fold of each example as assigned by
+    `mk_cv_folds`.
+    """
+    import numpy
+    folds = numpy.empty(len(labels), dtype=numpy.int8)
+    for (fold_idx, (_, test_idxs)) in enumerate(
+            mk_cv_folds(labels, random_seed, n_folds)):
+        folds[test_idxs] = fold_idx
+    return folds
+
+
+def extend_fold_assignments(folds, labels, random_seed=None, n_folds=10):
+    """
+    Return an array of the fold of each example given the folds of the
+    first `len(folds)` examples.
+
+    Each new example is assigned to a fold with the fewest examples of
+    its class (breaking ties at random), so the folds stay stratified
+    as examples are added.  The assignments of the existing examples
+    are unchanged.
+    """
+    import heapq
+    import numpy
+    n_old = len(folds)
+    if n_old == len(labels):
+        return folds
+    # Vary the random choices with the number of existing examples so
+    # that each batch of new examples is shuffled differently
+    rng = numpy.random.RandomState(
+        [random_seed, n_old] if random_seed is not None else None)
+    old_labels = labels[:n_old]
+    new_labels = labels[n_old:]
+    new_folds = numpy.empty(len(new_labels), dtype=folds.dtype)
+    for label in numpy.unique(new_labels):
+        counts = numpy.bincount(
+            folds[old_labels == label], minlength=n_folds)
+        tiebreaks = rng.permutation(n_folds)
+        heap = [(count, tiebreak, fold_idx) for (fold_idx, (
+            count, tiebreak)) in enumerate(zip(counts, tiebreaks))]
+        heapq.heapify(heap)
+        for idx in rng.permutation(numpy.flatnonzero(new_labels == label)):
+            count, tiebreak, fold_idx = heap[0]
+            new_folds[idx] = fold_idx
+            heapq.heapreplace(heap, (count + 1, tiebreak, fold_idx))
+    return numpy.concatenate((folds, new_folds))
+
+
+def folds_from_assignments(folds, n_folds=10):
+    """
+    Return a list of (training indices, testing indices) for the given
+    array of the fold of each example.
+    """
+    import numpy
+    return [(numpy.flatnonzero(folds != fold_idx),
+             numpy.flatnonzero(folds == fold_idx))
+            for fold_idx in range(n_folds)]
+
+
+def _collect_cv_scores(fold_scores, folds, n_examples):
+    """
+    Return (out-of-fold scores, fold of each example) given the scores
+    of the testing rows of each of the given folds.
+    """
+    import numpy
+    cv_scores = numpy.empty(n_examples)
+    fold_idxs = numpy.empty(n_examples, dtype=numpy.intp)
+    for (fold_idx, ((_, test_idxs), scores)) in enumerate(
+            zip(folds, fold_scores)):
+        cv_scores[test_idxs] = scores
+        fold_idxs[test_idxs] = fold_idx
+    return cv_scores, fold_idxs
+
+
+def _permute_columns(data, col_idxs, rng):
+    """
+    Return a CSR matrix that stacks a copy of the given data for each
+    of the given columns.  In each copy, the values of its column are
+    randomly permuted among the rows.
+    """
+    import numpy
+    from scipy import sparse
+    data = data.tocoo()
+    n_rows, n_cols = data.shape
+    n_copies = len(col_idxs)
+    copy_idxs = numpy.repeat(numpy.arange(n_copies), data.nnz)
+    row_idxs = numpy.tile(data.row.astype(numpy.int64), n_copies)
+    cols = numpy.tile(data.col, n_copies)
+    # Move the entries of the permuted column of each copy to random
+    # rows.  Each row of `perms` is a random permutation of the rows.
+    perms = rng.rand(n_copies, n_rows).argsort(axis=1)
+    is_permuted = cols == numpy.asarray(col_idxs)[copy_idxs]
+    row_idxs[is_permuted] = perms[
+        copy_idxs[is_permuted], row_idxs[is_permuted]]
+    row_idxs += copy_idxs * n_rows
+    return sparse.csr_matrix(
+        (numpy.tile(data.data, n_copies), (row_idxs, cols)),
+        shape=(n_copies * n_rows, n_cols))
+
+
+def _permutation_importance_batch(
+        model, data, labels, weights, baseline, col_idxs, n_repeats,
+        random_seed):
+    """
+    Return an array of the decrease in ROC area of the given fitted
+    model on the given (held-out) data from its baseline ROC area when
+    the values of each of the given columns are permuted, averaged
+    over `n_repeats` permutations.
+
+    All the permuted copies of the data are scored at once, and their
+    ROC areas are computed together by treating each copy as a fold.
+    """
+    import numpy
+    rng = numpy.random.RandomState(random_seed)
+    copy_col_idxs = numpy.repeat(col_idxs, n_repeats)
+    n_copies = len(copy_col_idxs)
+    scores = predict_scores(
+        model, _permute_columns(data, copy_col_idxs, rng))
+    roc_areas = evaluation.evaluate_predictions(
+        numpy.tile(labels, n_copies), scores,
+        numpy.tile(weights, n_copies) if weights is not None else None,
+        numpy.repeat(numpy.arange(n_copies), len(labels)),
+        n_copies)['fold_roc_areas']
+    return baseline - numpy.array(roc_areas).reshape(
+        len(col_idxs), n_repeats).mean(axis=1)
+
+
+def _dense_row_nbytes(model):
+    """
+    Return the number of bytes of each row of the dense copy of its
+    input that the given fitted model makes to predict, or 0 if it
+    predicts from sparse data.
+    """
+    import numpy
+    model, _ = unwrap_model(model)
+    if isinstance(model, DenseInputClassifier):
+        # Single precision (see `DenseInputClassifier._dense`)
+        return model.n_features_in_ * numpy.dtype(numpy.float32).itemsize
+    return 0
+
+
+def permutation_importances(
+        fold_models, fold_data, fold_labels, fold_weights, baselines,
+        col_idxs, n_features, n_repeats=5, n_jobs=1, random_seed=None,
+        max_batch_nbytes=2**27):
+    """
+    Return an array of the permutation importance of each of
+    `n_features` features: the decrease in the ROC area of the model
+    of each fold on its held-out data (from its baseline ROC area)
+    when the values of the feature are permuted, averaged over
+    `n_repeats` permutations and over the folds.  Only the given
+    columns are evaluated, and the others are NaN.
+
+    The columns are permuted and evaluated in batches that fit in
+    about `max_batch_nbytes` of memory, including the dense copies of
+    models that do not predict from sparse data.  The (fold, batch) tasks are
+    run in a pool of `n_jobs` worker processes.
+    """
+    import numpy
+    logger = logging.getLogger(__name__)
+    col_idxs = numpy.asarray(col_idxs, dtype=numpy.intp)
+    importances = numpy.full(n_features, numpy.nan)
+    if len(col_idxs) == 0:
+        return importances
+    # Each nonzero of each permuted copy takes about 64 bytes, and
+    # models that densify their input copy each row in full
+    copy_nbytes = max(
+        64 * data.nnz + data.shape[0] * _dense_row_nbytes(model)
+        for (model, data) in zip(fold_models, fold_data))
+    batch_size = max(
+        max_batch_nbytes // (max(copy_nbytes, 1) * n_repeats), 1)
+    batches = [col_idxs[sta:sta + batch_size]
+               for sta in range(0, len(col_idxs), batch_size)]
+    logger.info('Permutation importance: {} features in {} batches '
+                'for each of {} folds', len(col_idxs), len(batches),
+                len(fold_models))
+    tasks = [
+        joblib.delayed(_permutation_importance_batch)(
+            fold_models[fold_idx], fold_data[fold_idx],
+            fold_labels[fold_idx], fold_weights[fold_idx],
+            baselines[fold_idx], batch, n_repeats,
+            ([random_seed, fold_idx, batch_idx]
+             if random_seed is not None else None))
+        for fold_idx in range(len(fold_models))
+        for (batch_idx, batch) in enumerate(batches)
+    ]
+    results = joblib.Parallel(n_jobs=n_jobs)(tasks)
+    # Average over the folds
+    importances[col_idxs] = numpy.mean(
+        [numpy.concatenate(results[fold_idx * len(batches):
+                                   (fold_idx + 1) * len(batches)])
+         for fold_idx in range(len(fold_models))], axis=0)
+    return importances
+
+
+def _prepare_folds(data, labels, weights, folds, fold_strategy):
+    """
+    Return (data, labels, weights, folds) for fitting and scoring the
+    given folds according to the given fold strategy.
+    """
+    if fold_strategy == 'copy':
+        return data, labels, weights, folds
+    elif fold_strategy == 'contiguous':
+        data, labels, weights, bounds = sort_rows_by_fold(
+            data, labels, weights, folds)
+        folds = [(None, slice(int(sta), int(end)))
+                 for (sta, end) in zip(bounds[:-1], bounds[1:])]
+        return data, labels, weights, folds
+    raise ValueError('Unknown fold strategy: {!r}'.format(fold_strategy))
+
+
+def _model_description(model):
+    """
+    Return a description of the given (unfitted) model that identifies
+    its class and all its parameters, including those of any nested
+    models.
+    """
+    return [type(model).__name__, sorted(
+        (name, repr(value))
+        for (name, value) in model.get_params(deep=True).items())]
+
+
+def run_cv_and_final_model(
+        model, data, labels, weights=None, n_jobs=1, random_seed=None,
+        timer=None, folds=None, fold_strategy='copy', n_bootstraps=0,
+        permutation_importance=False, top_k=None,
+        n_permutation_repeats=5, fit_memo=None):
+    """
+    Run 10-fold cross validation of the given model and fit a final
+    model on all the data.
+
+    Each fold and the final model are fit on their own clone of the
+    given model.  If `n_jobs` is other than 1, the folds and the final
+    model are fit concurrently in a pool of `n_jobs` worker processes
+    (-1 means one per CPU).  Given a `random_seed` (and a model with a
+    fixed `random_state`), the results are the same regardless of
+    `n_jobs`.
+
+    The folds are made by `mk_cv_folds` unless a list of (training
+    indices, testing indices) is given as `folds`.  The data of each
+    fold is selected according to `fold_strategy` (see
+    `fold_strategies`).  'contiguous' uses less memory and time for
+    large data, but the models may differ slightly from 'copy' because
+    the training rows are in a different order.
+
+    The predicted probabilities of the testing rows of all the folds
+    are collected into one array of out-of-fold scores, which is
+    evaluated as a whole and by fold with
+    `evaluation.evaluate_predictions`, including bootstrap confidence
+    intervals if `n_bootstraps` is positive.
+
+    If `permutation_importance`, the permutation importances of the
+    features (see `permutation_importances`) are computed with the
+    models of the folds on their testing rows.  Only the features with
+    nonzero mean (impurity) feature importance are evaluated, or all
+    the features if the model has no feature importances, limited to
+    the `top_k` most important if `top_k` is given.  The features with
+    zero importance have zero permutation importance, and the others
+    that are not evaluated have NaN.
+
+    If given, `fit_memo` is called as `fit_memo(key, fit)` to get the
+    fitted models, scores, and importances of the folds and the final
+    model, where `key` is a content hash (see `cache.content_hash`) of
+    the data, labels, weights, folds, fold strategy, and model, and
+    `fit()` does the fitting.  The models of the folds are only kept
+    (and memoized) if they are needed for permutation importance.
+    This allows reusing the fits of an identical run (see
+    `cache.ResultCache.memo`), in which case only the evaluation is
+    done.
+
+    If a `timer` (`instrument.StageTimer`) is given, the selection of
+    data, fitting, and predicting for each fold, the scoring of the
+    folds, the final model, and the permutation importances are timed
+    and recorded in it.
+
+    Return (final model, CV ROC areas, CV feature importances, final
+    ROC area, CV evaluation).  The CV ROC areas are those of the
+    folds, and the CV evaluation is the dictionary of all the areas
+    (see `evaluation.evaluate_predictions`) and of the permutation
+    importances (`permutation_importances`) if computed.
+    """
     logger = logging.getLogger(__name__)
     logger.info(
         'run_cv_and_final_model:\n'
         '  model:   {}\n'
         '  data:    {} {}\n'
         '  labels:  {} {}\n'
-        '  weights: {} {}',
+        '  weights: {} {}\n'
+        '  n_jobs:  {}',
         model,
         data.shape, data.dtype,
         labels.shape, labels.dtype,
         weights.shape if weights is not None else None,
         weights.dtype if weights is not None else None,
+        n_jobs,
     )
-    # Run 10-fold cross validation and evaluate it with ROC area
-    cv = model_selection.StratifiedKFold(10, shuffle=True)
-    cv_folds = cv.split(data, labels)
-    scores = []
-    importances = []
-    for fold_idx, fold in enumerate(cv_folds):
-        logger.info('CV fold {}', fold_idx + 1)
-        train_idxs, test_idxs = fold
-        # Select the training data
-        train_data = data[train_idxs, :]
-        train_labels = labels[train_idxs]
-        train_wgts = (weights[train_idxs]
-                      if weights is not None else None)
-        # Select the testing data
-        test_data = data[test_idxs, :]
-        test_labels = labels[test_idxs]
-        test_wgts = weights[test_idxs] if weights is not None else None
-        # Fit the model
-        model.fit(train_data, train_labels, sample_weight=train_wgts)
-        # Test
-        predictions = model.predict(test_data)
-        # Score
-        roc_area = metrics.roc_auc_score(
-            test_labels, predictions, sample_weight=test_wgts)
-        scores.append(roc_area)
-        # Save feature importances.  Copy because we aren't guaranteed
-        # to get our own array.  (I don't know what is returned because
-        # it's a property whose return value depends on rather
-        # impenetrable C code.)
-        importances.append(model.feature_importances_.copy())
-    # Fit a final model on all the data
-    logger.info('Fitting final model')
-    model.fit(data, labels, sample_weight=weights)
-    predictions = model.predict(data)
-    final_score = metrics.roc_auc_score(
-        labels, predictions, sample_weight=weights)
+    if timer is None:
+        timer = instrument.StageTimer(enabled=False)
+    profile = timer.enabled
+    if folds is None:
+        folds = mk_cv_folds(labels, random_seed)
+    fold_data, fold_labels, fold_weights, fold_tasks = _prepare_folds(
+        data, labels, weights, folds, fold_strategy)
+    is_fit = []
+
+    def fit():
+        # Run 10-fold cross validation.  Keep the models of the folds
+        # only if they are needed for permutation importance.
+        run_id = _new_run_id()
+        tasks = [
+            joblib.delayed(_fit_and_predict_fold)(
+                fold_idx, base.clone(model), fold_data, fold_labels,
+                fold_weights, train_idxs, test_idxs, profile,
+                permutation_importance, run_id)
+            for (fold_idx, (train_idxs, test_idxs))
+            in enumerate(fold_tasks)
+        ]
+        # Fit a final model on all the data alongside the folds
+        tasks.append(joblib.delayed(_fit_and_score_final)(
+            base.clone(model), data, labels, weights, profile))
+        is_fit.append(True)
+        try:
+            return joblib.Parallel(n_jobs=n_jobs)(tasks)
+        finally:
+            # Workers free their buffers when they start another run
+            _free_fold_buffers()
+    if fit_memo is None:
+        results = fit()
+    else:
+        from tsufvml import cache
+        key = cache.content_hash(
+            'CV and final fits', data, labels, weights,
+            [test_idxs for (_, test_idxs) in folds], fold_strategy,
+            _model_description(model), _sklearn_version(),
+            # Whether the models of the folds are included
+            bool(permutation_importance))
+        results = list(fit_memo(key, fit))
+    final_model, final_score, final_records = results.pop()
+    importances = [imps for (_, imps, _, _) in results]
+    # Collect the timings from the worker processes (unless the fits
+    # were reused)
+    if profile and is_fit:
+        for (_, _, records, _) in results:
+            timer.extend(records)
+        timer.extend(final_records)
+    # Evaluate the out-of-fold scores with ROC and PR areas
+    with timer.stage('score CV folds'):
+        cv_scores, fold_idxs = _collect_cv_scores(
+            [scores for (scores, _, _, _) in results], folds,
+            len(labels))
+        cv_evaluation = evaluation.evaluate_predictions(
+            labels, cv_scores, weights, fold_idxs, len(folds),
+            n_bootstraps=n_bootstraps, random_seed=random_seed)
+    # Evaluate the features by permuting them in the testing rows
+    if permutation_importance:
+        import numpy
+        with timer.stage('permutation importance'):
+            mean_importances = numpy.mean(importances, axis=0)
+            has_importances = mean_importances.any()
+            if has_importances:
+                col_idxs = numpy.flatnonzero(mean_importances)
+            else:
+                col_idxs = numpy.arange(len(mean_importances))
+            # Keep the most important features
+            col_idxs = col_idxs[numpy.argsort(
+                -mean_importances[col_idxs], kind='mergesort')][:top_k]
+            perm_importances = permutation_importances(
+                [model for (_, _, _, model) in results],
+                [fold_data[test_idxs, :].tocsr()
+                 for (_, test_idxs) in fold_tasks],
+                [fold_labels[test_idxs] for (_, test_idxs) in fold_tasks],
+                [fold_weights[test_idxs] if fold_weights is not None
+                 else None for (_, test_idxs) in fold_tasks],
+                cv_evaluation['fold_roc_areas'], col_idxs,
+                len(mean_importances), n_permutation_repeats, n_jobs,
+                random_seed)
+            if has_importances:
+                perm_importances[mean_importances == 0] = 0
+            cv_evaluation['permutation_importances'] = perm_importances
     logger.info('Done run_cv_and_final_model')
-    return model, scores, importances, final_score
+    return (final_model, cv_evaluation['fold_roc_areas'], importances,
+            final_score, cv_evaluation)
+
+
+def run_cv_sweep(models, data, labels, weights=None, n_jobs=1,
+                 random_seed=None, fold_strategy='copy'):
+    """
+    Run 10-fold cross validation of each of the given models using the
+    same folds.
+
+    All the (model, fold) combinations are fit in one pool of `n_jobs`
+    worker processes.  The data of each fold is selected according to
+    `fold_strategy` (as in `run_cv_and_final_model`).  The ROC areas
+    of the folds of each model are computed from its out-of-fold
+    scores as in `run_cv_and_final_model`.
+
+    Return a list containing (CV ROC areas, CV feature importances) for
+    each model.
+    """
+    logger = logging.getLogger(__name__)
+    logger.info(
+        'run_cv_sweep:\n'
+        '  models:  {}\n'
+        '  data:    {} {}\n'
+        '  n_jobs:  {}',
+        len(models), data.shape, data.dtype, n_jobs)
+    folds = mk_cv_folds(labels, random_seed)
+    fold_data, fold_labels, fold_weights, fold_tasks = _prepare_folds(
+        data, labels, weights, folds, fold_strategy)
+    run_id = _new_run_id()
+    tasks = [
+        joblib.delayed(_fit_and_predict_fold)(
+            fold_idx, base.clone(model), fold_data, fold_labels,
+            fold_weights, train_idxs, test_idxs, run_id=run_id)
+        for model in models
+        for (fold_idx, (train_idxs, test_idxs)) in enumerate(fold_tasks)
+    ]
+    try:
+        results = joblib.Parallel(n_jobs=n_jobs)(tasks)
+    finally:
+        # Workers free their buffers when they start another run
+        _free_fold_buffers()
+    # Regroup the results by model
+    n_folds = len(folds)
+    model_results = []
+    for model_idx in range(len(models)):
+        fold_results = results[
+            model_idx * n_folds:(model_idx + 1) * n_folds]
+        cv_scores, fold_idxs = _collect_cv_scores(
+            [scores for (scores, _, _, _) in fold_results], folds,
+            len(labels))
+        cv_evaluation = evaluation.evaluate_predictions(
+            labels, cv_scores, weights, fold_idxs, n_folds)
+        model_results.append((
+            cv_evaluation['fold_roc_areas'],
+            [imps for (_, imps, _, _) in fold_results],
+        ))
+    logger.info('Done run_cv_sweep')
+    return model_results
 
 
 def render_decision_tree_as_graphviz(dt_model):
@@ -74,3 +1023,135 @@ def render_decision_tree_as_graphviz(dt_model):
     dot_text = io.StringIO()
     tree.export_graphviz(dt_model, out_file=dot_text)
     return dot_text.getvalue()
+
+
+def _node_values(tree_):
+    """
+    Return (class counts of each node, whether they are all integral)
+    for the given fitted tree.
+    """
+    import numpy
+    # Depending on the version of Scikit-Learn, the values are either
+    # class counts or class fractions, so normalize them and scale them
+    # by the (weighted) number of examples.  The scaling is inexact,
+    # so check for integral counts with a tolerance.
+    values = tree_.value[:, 0, :]
+    totals = values.sum(axis=1, keepdims=True)
+    values = (values / numpy.where(totals > 0, totals, 1)
+              * tree_.weighted_n_node_samples[:, None])
+    rounded = numpy.around(values)
+    is_integral = bool(numpy.allclose(values, rounded, rtol=0, atol=1e-6))
+    return (rounded if is_integral else values), is_integral
+
+
+def _format_node_value(value, is_integral):
+    # Format class counts like `tree.export_graphviz`: as integers if
+    # those of the whole tree are integral (i.e. unweighted) and
+    # rounded otherwise
+    import numpy
+    if is_integral:
+        return '[' + ', '.join(str(int(v)) for v in value) + ']'
+    return '[' + ', '.join(
+        repr(float(v)) for v in numpy.around(value, 3)) + ']'
+
+
+def render_decision_tree_as_dot(
+        dt_model,
+        rm2orig_idxs=None,
+        features={},
+        concepts={},
+        max_description_length=30,
+):
+    """
+    Render the given decision tree classifier as Graphviz Dot text
+    with its features translated to feature IDs, names, and concept
+    descriptions as by
+    `common.replace_variable_references_with_features`.
+
+    The text is produced in one pass over the arrays of the tree
+    (rather than by rendering with `tree.export_graphviz` and then
+    rewriting the text), and the label of each feature is made only
+    once.  The nodes are labeled like `tree.export_graphviz` labels
+    them by default.
+
+    Return (Dot text, feature legend).
+    """
+    from tsufvml import common
+    tree_ = dt_model.tree_
+    children_left = tree_.children_left.tolist()
+    children_right = tree_.children_right.tolist()
+    feature = tree_.feature.tolist()
+    threshold = tree_.threshold.tolist()
+    impurity = tree_.impurity.tolist()
+    n_node_samples = tree_.n_node_samples.tolist()
+    # Class counts (weighted) of each node
+    values, values_are_integral = _node_values(tree_)
+    criterion = (dt_model.criterion
+                 if isinstance(dt_model.criterion, str) else 'impurity')
+    feature_legend = {}
+    feature_labels = {}
+
+    def feature_label(col_idx):
+        # Make the label of each feature once
+        label = feature_labels.get(col_idx)
+        if label is not None:
+            return label
+        # Add 1 to convert 0-based column indices to 1-based feature IDs
+        feat_id = int(common.orig_col_idxs(col_idx, rm2orig_idxs)) + 1
+        if feat_id in features:
+            feat_nm, cncpt_id = features[feat_id]
+            label = 'X[{}_{}]'.format(feat_id, feat_nm)
+            if cncpt_id in concepts:
+                cncpt_desc = concepts[cncpt_id]
+                feature_legend[label] = cncpt_desc
+                # If the description is too long to fit entirely in the
+                # short description, include an ellipsis
+                if len(cncpt_desc) > max_description_length:
+                    short_desc = cncpt_desc[
+                        :(max_description_length - 1)] + '\u2026'
+                else:
+                    short_desc = cncpt_desc
+                label = label.rstrip(']') + ': {!r}]'.format(short_desc)
+        else:
+            label = 'X[{}]'.format(feat_id)
+        label = label.replace('"', '\\"')
+        feature_labels[col_idx] = label
+        return label
+
+    lines = [
+        'digraph Tree {\n',
+        'node [shape=box, fontname="helvetica"] ;\n',
+        'edge [fontname="helvetica"] ;\n',
+    ]
+    # Visit the nodes in depth-first order, left child first
+    stack = [(0, None)]
+    while stack:
+        node_id, parent = stack.pop()
+        label = []
+        if children_left[node_id] >= 0:
+            label.append('{} <= {}'.format(
+                feature_label(feature[node_id]),
+                round(threshold[node_id], 3)))
+        label.append('{} = {}'.format(
+            criterion, round(impurity[node_id], 3)))
+        label.append('samples = {}'.format(n_node_samples[node_id]))
+        label.append('value = {}'.format(
+            _format_node_value(values[node_id], values_are_integral)))
+        lines.append('{} [label="{}"] ;\n'.format(
+            node_id, '\\n'.join(label)))
+        if parent is not None:
+            if parent == 0:
+                # Label the edges of the root
+                lines.append(
+                    '{} -> {} [labeldistance=2.5, labelangle={}, '
+                    'headlabel="{}"] ;\n'.format(
+                        parent, node_id,
+                        *((45, 'True') if node_id == children_left[0]
+                          else (-45, 'False'))))
+            else:
+                lines.append('{} -> {} ;\n'.format(parent, node_id))
+        if children_left[node_id] >= 0:
+            stack.append((children_right[node_id], node_id))
+            stack.append((children_left[node_id], node_id))
+    lines.append('}')
+    return ''.join(lines), feature_legend
@@ -0,0 +1,346 @@
+"""
+Saved decision tree models and batch scoring of svmlight data
+
+A model is saved as a NumPy `.npz` file of the flat arrays that define
+the tree (children, features, thresholds, and class probabilities of
+each node) rather than as a pickle of the Scikit-Learn estimator, so
+it is compact, does not depend on the version of Scikit-Learn, and can
+be loaded and applied without importing Scikit-Learn at all.
+"""
+
+# Copyright (c) 2019 Aubrey Barnard.
+#
+# This is free software released under the MIT License.  See
+# `LICENSE.txt` for details.
+
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import tsufvml
+
+
+# Version of the format of saved models.  Increment when the format
+# changes.
+_model_format_version = 1
+
+
+class TreeModel:
+    """
+    Decision tree as flat arrays indexed by node.
+
+    Leaves have a left child of -1.  The features of the internal
+    nodes are the 0-based column indices of the original (unlimited)
+    data, i.e. they are already mapped through `rm2orig_idxs`, so new
+    data can be scored without limiting it to features first.  An
+    example goes left at a node if the value of the node's feature is
+    less than or equal to the node's threshold.
+    """
+
+    def __init__(
+            self, children_left, children_right, feature, threshold,
+            probabilities, classes, rm2orig_idxs):
+        self.children_left = children_left
+        self.children_right = children_right
+        self.feature = feature
+        self.threshold = threshold
+        self.probabilities = probabilities
+        self.classes = classes
+        self.rm2orig_idxs = rm2orig_idxs
+
+    @classmethod
+    def from_decision_tree(cls, dt_model, rm2orig_idxs=None):
+        """
+        Make a model from the given fitted Scikit-Learn decision tree
+        classifier that was fit to data limited by `rm2orig_idxs`.
+        """
+        import numpy
+        from tsufvml import common
+        tree = dt_model.tree_
+        children_left = tree.children_left.astype(numpy.int32)
+        is_internal = children_left >= 0
+        feature = numpy.full(len(children_left), -1, dtype=numpy.int64)
+        feature[is_internal] = common.orig_col_idxs(
+            tree.feature[is_internal], rm2orig_idxs)
+        # Normalize the (possibly weighted) class counts of each node
+        value = tree.value[:, 0, :]
+        totals = value.sum(axis=1, keepdims=True)
+        probabilities = value / numpy.where(totals > 0, totals, 1)
+        if rm2orig_idxs is None:
+            rm2orig_idxs = numpy.arange(dt_model.n_features_in_)
+        return cls(
+            children_left,
+            tree.children_right.astype(numpy.int32),
+            feature,
+            tree.threshold.copy(),
+            probabilities,
+            numpy.asarray(dt_model.classes_),
+            numpy.asarray(rm2orig_idxs, dtype=numpy.int64),
+        )
+
+    def save(self, filename):
+        import numpy
+        with open(str(filename), 'wb') as file:
+            numpy.savez_compressed(
+                file,
+                format_version=numpy.array(_model_format_version),
+                children_left=self.children_left,
+                children_right=self.children_right,
+                feature=self.feature,
+                threshold=self.threshold,
+                probabilities=self.probabilities,
+                classes=self.classes,
+                rm2orig_idxs=self.rm2orig_idxs,
+            )
+
+    @classmethod
+    def load(cls, filename):
+        import numpy
+        with numpy.load(str(filename)) as arrays:
+            version = int(arrays['format_version'])
+            if version != _model_format_version:
+                raise ValueError(
+                    'Unsupported model format version: {}: {}'
+                    .format(version, filename))
+            return cls(
+                arrays['children_left'],
+                arrays['children_right'],
+                arrays['feature'],
+                arrays['threshold'],
+                arrays['probabilities'],
+                arrays['classes'],
+                arrays['rm2orig_idxs'],
+            )
+
+    @property
+    def n_nodes(self):
+        return len(self.children_left)
+
+    def used_col_idxs(self):
+        """Return the sorted original column indices used by the tree."""
+        import numpy
+        return numpy.unique(self.feature[self.children_left >= 0])
+
+    def apply_sparse(self, n_rows, row_idxs, col_idxs, values):
+        """
+        Return the index of the leaf of each of `n_rows` examples given
+        as sparse (row index, original column index, value) triples.
+        Triples of unused columns are ignored.
+        """
+        import numpy
+        used_cols = self.used_col_idxs()
+        n_used = len(used_cols)
+        # Look up values by (row, used column) keys in sorted order
+        used_idxs = numpy.searchsorted(used_cols, col_idxs)
+        is_used = used_idxs < n_used
+        is_used[is_used] = used_cols[used_idxs[is_used]] == col_idxs[is_used]
+        keys = row_idxs[is_used] * n_used + used_idxs[is_used]
+        order = numpy.argsort(keys, kind='mergesort')
+        # End with a sentinel so that every search finds a position.
+        # Compare in single precision like Scikit-Learn.
+        keys = numpy.append(keys[order], numpy.iinfo(numpy.int64).max)
+        key_values = numpy.append(
+            values[is_used][order], 0).astype(numpy.float32)
+        node_used_idxs = numpy.searchsorted(used_cols, self.feature)
+        # Move all the examples down the tree one level at a time
+        nodes = numpy.zeros(n_rows, dtype=numpy.int64)
+        active = numpy.arange(n_rows)
+        while len(active) > 0:
+            active = active[self.children_left[nodes[active]] >= 0]
+            active_nodes = nodes[active]
+            queries = active * n_used + node_used_idxs[active_nodes]
+            positions = numpy.searchsorted(keys, queries)
+            x = numpy.where(
+                keys[positions] == queries, key_values[positions], 0)
+            go_left = x <= self.threshold[active_nodes]
+            nodes[active] = numpy.where(
+                go_left,
+                self.children_left[active_nodes],
+                self.children_right[active_nodes])
+        return nodes
+
+    def predict_proba_sparse(self, n_rows, row_idxs, col_idxs, values):
+        """
+        Return the class probabilities (one column per class) of the
+        examples given as in `apply_sparse`.
+        """
+        return self.probabilities[
+            self.apply_sparse(n_rows, row_idxs, col_idxs, values)]
+
+    def predict_proba(self, data):
+        """
+        Return the class probabilities of the examples in the given
+        sparse matrix of original (unlimited) data.
+        """
+        import numpy
+        data = data.tocoo()
+        return self.predict_proba_sparse(
+            data.shape[0], data.row.astype(numpy.int64),
+            data.col.astype(numpy.int64), data.data)
+
+
+def save_model(filename, dt_model, rm2orig_idxs=None):
+    """Save the given decision tree classifier as a `TreeModel`."""
+    TreeModel.from_decision_tree(dt_model, rm2orig_idxs).save(filename)
+
+
+def load_model(filename):
+    return TreeModel.load(filename)
+
+
+def byte_ranges(filename, n_ranges):
+    """
+    Return a list of (start, end) byte positions that divide the given
+    file into approximately equal parts.
+    """
+    size = os.path.getsize(str(filename))
+    n_ranges = max(min(n_ranges, size), 1)
+    bounds = [size * idx // n_ranges for idx in range(n_ranges + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def score_byte_range(
+        model_filename, data_filename, start, end, output_filename,
+        chunk_n_lines=10000):
+    """
+    Score the svmlight lines that start in the byte range [start, end)
+    of the given file and write (label, probability) lines to the
+    given output file.  Return the number of lines scored.
+
+    The data is processed in chunks of lines so that only one chunk is
+    in memory at a time.
+    """
+    import numpy
+    from tsufvml import common
+    model = load_model(model_filename)
+    n_rows = 0
+    with open(str(data_filename), 'rb') as data_file, \
+            open(str(output_filename), 'wt') as out_file:
+        # Start at the first line that starts at or after `start`
+        if start > 0:
+            data_file.seek(start - 1)
+            data_file.readline()
+        for (labels, row_lens, feat_ids, values
+             ) in common.iter_svmlight_chunks(
+                 data_file, chunk_n_lines, end):
+            row_idxs = numpy.repeat(numpy.arange(len(labels)), row_lens)
+            # Feature IDs are 1-based
+            probs = model.predict_proba_sparse(
+                len(labels), row_idxs, feat_ids - 1, values)
+            numpy.savetxt(
+                out_file, numpy.column_stack((labels, probs[:, -1])),
+                fmt=('%g', '%.6g'), delimiter='\t')
+            n_rows += len(labels)
+    return n_rows
+
+
+def score_svmlight(
+        model_filename, data_filename, output, n_jobs=1,
+        chunk_n_lines=10000, n_ranges_per_job=4):
+    """
+    Score the given svmlight file with the given saved model and write
+    a tab-separated table of the label and the predicted probability of
+    the positive (last) class of each example to the given output
+    (binary file object), in the order of the examples in the file.
+
+    The file is divided into byte ranges that are scored concurrently
+    in `n_jobs` worker processes (-1 means one per CPU), each of which
+    streams through its range in chunks of `chunk_n_lines` lines.
+    Return the number of examples scored.
+    """
+    try:
+        import joblib
+    except ImportError: # Scikit-Learn < 0.21 bundles its own copy
+        from sklearn.externals import joblib
+    from barnapy import logging
+    logger = logging.getLogger(__name__)
+    n_workers = (joblib.cpu_count() if n_jobs < 0 else max(n_jobs, 1))
+    ranges = byte_ranges(data_filename, n_workers * n_ranges_per_job)
+    logger.info('Scoring {} in {} parts with {} processes',
+                data_filename, len(ranges), n_workers)
+    with tempfile.TemporaryDirectory(prefix='tsufvml-score-') as tmp_dir:
+        part_filenames = [os.path.join(tmp_dir, 'part{}.tsv'.format(idx))
+                          for idx in range(len(ranges))]
+        n_rows = joblib.Parallel(n_jobs=n_jobs)(
+            joblib.delayed(score_byte_range)(
+                model_filename, data_filename, start, end,
+                part_filename, chunk_n_lines)
+            for ((start, end), part_filename) in zip(
+                ranges, part_filenames))
+        # Concatenate the parts in order
+        output.write(b'label\tprobability\n')
+        for part_filename in part_filenames:
+            with open(part_filename, 'rb') as part_file:
+                shutil.copyfileobj(part_file, output)
+    logger.info('Scored {} examples', sum(n_rows))
+    return sum(n_rows)
+
+
+def score_main(prog_name, *args):
+    arg_prsr = argparse.ArgumentParser(
+        prog=prog_name,
+        description=(
+            'Score feature vector data in SVMLight format with a model '
+            'saved by `tsufvml_decision_tree --save-model`.  Write a '
+            'tab-separated table of the label and the predicted '
+            'probability of the positive class of each example.  '
+            'Large files are streamed in chunks and scored by multiple '
+            'processes.'),
+        allow_abbrev=False,
+    )
+    arg_prsr.add_argument(
+        '--version',
+        action='version',
+        version='tsufvml {}'.format(tsufvml.__version__),
+    )
+    arg_prsr.add_argument(
+        'model',
+        metavar='MODEL',
+        help='Saved model.',
+    )
+    arg_prsr.add_argument(
+        'data',
+        metavar='DATA',
+        help='Feature vector data in SVMLight format.',
+    )
+    arg_prsr.add_argument(
+        '--output',
+        type=argparse.FileType('wb'),
+        default=sys.stdout.buffer,
+        metavar='FILE',
+        help='File for the scores.  [default: stdout]',
+    )
+    arg_prsr.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        metavar='N',
+        help=(
+            'Number of worker processes.  Use -1 for one process per '
+            'CPU.  [default: %(default)s]'),
+    )
+    arg_prsr.add_argument(
+        '--chunk-lines',
+        type=int,
+        default=10000,
+        metavar='N',
+        help=(
+            'Number of lines each process scores at a time.  '
+            '[default: %(default)s]'),
+    )
+    env = arg_prsr.parse_args(args)
+    from barnapy import logging
+    from tsufvml import cli
+    logging.default_config()
+    try:
+        score_svmlight(env.model, env.data, env.output, n_jobs=env.jobs,
+                       chunk_n_lines=env.chunk_lines)
+    finally:
+        cli.close_output(env.output)
+
+
+def main():
+    score_main(os.path.basename(sys.argv[0]), *sys.argv[1:])
@@ -0,0 +1,387 @@
+"""
+Server that runs modeling jobs without per-job startup and loading
+
+The server listens on a Unix socket.  A client sends a job as one line
+of JSON and receives a one-line JSON status followed by the report.
+The server keeps Scikit-Learn imported and keeps recently used data,
+feature tables, and concept tables in memory (up to a limit), so jobs
+only pay for modeling.
+
+A job is a JSON object whose keys are the names of the arguments of
+`cli.run_models_api` (e.g. `data_matrix_filename`,
+`feature_table_filename`, `model_family`, `model_args`) or
+`decision_tree_args` as a synonym of `model_args` for decision trees
+(the default family).  Filenames must be
+absolute because the server does not share the client's working
+directory.  The job `{"command": "shutdown"}` stops the server.
+
+The socket is only accessible to the user running the server (mode
+0600), because jobs read and write files with that user's permissions.
+"""
+
+# Copyright (c) 2019 Aubrey Barnard.
+#
+# This is free software released under the MIT License.  See
+# `LICENSE.txt` for details.
+
+
+import argparse
+import collections
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+
+import tsufvml
+from tsufvml import cli
+
+
+# Arguments of `cli.run_models_api` that jobs may specify
+job_arg_names = (
+    'data_matrix_filename',
+    'feature_table_filename',
+    'concept_table_filename',
+    'tree_pdf_filename',
+    'weight_feature',
+    'model_family',
+    'model_args',
+    'decision_tree_args',
+    'n_jobs',
+    'random_seed',
+    'cache_dir',
+    'profile',
+    'profile_filename',
+    'incremental',
+    'model_filename',
+    'report_format',
+    'fold_strategy',
+    'n_bootstraps',
+    'permutation_importance',
+    'top_k',
+    'n_permutation_repeats',
+    'screening_args',
+    'controls_per_case',
+    'result_cache_dir',
+    'result_cache_nbytes',
+)
+
+# Job arguments that are filenames
+job_filename_arg_names = (
+    'data_matrix_filename',
+    'feature_table_filename',
+    'concept_table_filename',
+    'tree_pdf_filename',
+    'cache_dir',
+    'profile_filename',
+    'model_filename',
+    'result_cache_dir',
+)
+
+
+def estimate_nbytes(obj):
+    """
+    Estimate the memory used by the given loaded object (arrays,
+    sparse matrices, and containers thereof).  Memory mapped arrays do
+    not count because their memory belongs to the OS page cache.
+    """
+    import numpy
+    if isinstance(obj, numpy.memmap):
+        return 0
+    elif isinstance(obj, numpy.ndarray):
+        # Views of memory maps do not own their memory either
+        return 0 if isinstance(obj.base, numpy.memmap) else obj.nbytes
+    elif isinstance(obj, (list, tuple)):
+        return sys.getsizeof(obj) + sum(estimate_nbytes(o) for o in obj)
+    elif isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(
+            estimate_nbytes(k) + estimate_nbytes(v)
+            for (k, v) in obj.items())
+    elif hasattr(obj, 'indptr'): # CSR matrix or view
+        return sum(estimate_nbytes(getattr(obj, name, None))
+                   for name in ('data', 'indices', 'indptr',
+                                'row_idxs', 'col_idxs'))
+    elif hasattr(obj, 'nbytes'): # Feature or concept table
+        return obj.nbytes
+    elif obj is None:
+        return 0
+    return sys.getsizeof(obj)
+
+
+class LruCache:
+    """
+    Cache of loaded objects that evicts the least recently used ones
+    to keep the estimated total size within `max_nbytes`.
+    """
+
+    def __init__(self, max_nbytes):
+        self.max_nbytes = max_nbytes
+        self.nbytes = 0
+        self._entries = collections.OrderedDict()
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_load(self, key, load):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.n_hits += 1
+            return self._entries[key][0]
+        self.n_misses += 1
+        value = load()
+        nbytes = estimate_nbytes(value)
+        if nbytes <= self.max_nbytes:
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_nbytes:
+                _, (_, old_nbytes) = self._entries.popitem(last=False)
+                self.nbytes -= old_nbytes
+        return value
+
+    def memo(self, kind, filename, load):
+        """
+        Load the given file with `load` unless it is cached.  Use as
+        the `memo` argument of `cli.run_decision_trees_api`.
+
+        Files are keyed by path, size, and modification time, so a
+        changed file is loaded again.
+        """
+        from tsufvml import matrix
+        path = matrix.file_path(filename)
+        if path is None:
+            return load()
+        key = (kind, path) + matrix.file_signature(path)
+        return self.get_or_load(key, load)
+
+    def stats(self):
+        return dict(
+            n_entries=len(self._entries),
+            nbytes=self.nbytes,
+            max_nbytes=self.max_nbytes,
+            n_hits=self.n_hits,
+            n_misses=self.n_misses,
+        )
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        from barnapy import logging
+        logger = logging.getLogger(__name__)
+        try:
+            job = json.loads(self.rfile.readline().decode())
+            if not isinstance(job, dict):
+                raise ValueError('Job is not a JSON object')
+            command = job.pop('command', 'run')
+            if command == 'run':
+                logger.info('Running job: {}', job)
+                report = self.server.run_job(job)
+                status = dict(status='ok')
+            elif command == 'stats':
+                report = ''
+                status = dict(status='ok', **self.server.cache.stats())
+            elif command == 'shutdown':
+                report = ''
+                status = dict(status='ok')
+                self.server.shutdown_requested = True
+            else:
+                raise ValueError('Unknown command: {!r}'.format(command))
+        except Exception as e:
+            logger.exception('Job failed')
+            report = ''
+            status = dict(status='error', message='{}: {}'.format(
+                type(e).__name__, e))
+        self.wfile.write((json.dumps(status) + '\n').encode())
+        self.wfile.write(report.encode())
+
+
+class JobServer(socketserver.UnixStreamServer):
+    """
+    Server that runs one job at a time.  (Jobs themselves can use
+    multiple processes via `n_jobs`.)
+    """
+
+    def __init__(self, socket_path, max_cache_nbytes):
+        super().__init__(str(socket_path), JobHandler)
+        self.cache = LruCache(max_cache_nbytes)
+        self.shutdown_requested = False
+
+    def server_bind(self):
+        # Create the socket with mode 0600 so that there is no moment
+        # at which other users can connect
+        old_umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(old_umask)
+        os.chmod(self.server_address, 0o600)
+
+    def run_job(self, job):
+        unknown_args = set(job) - set(job_arg_names)
+        if unknown_args:
+            raise ValueError('Unknown job arguments: {}'.format(
+                ', '.join(sorted(unknown_args))))
+        for name in job_filename_arg_names:
+            if job.get(name) is not None and not os.path.isabs(job[name]):
+                raise ValueError('Filename not absolute: {}: {}'
+                                 .format(name, job[name]))
+        if 'decision_tree_args' in job:
+            if 'model_args' in job:
+                raise ValueError('Both `decision_tree_args` and '
+                                 '`model_args` given')
+            job['model_args'] = job.pop('decision_tree_args')
+        report = io.StringIO()
+        cli.run_models_api(output=report, memo=self.cache.memo, **job)
+        return report.getvalue()
+
+
+def serve(socket_path, max_cache_nbytes):
+    from barnapy import logging
+    logger = logging.getLogger(__name__)
+    # Do expensive imports now so that jobs don't wait for them
+    from tsufvml import ml # noqa: F401 (sklearn)
+    # Remove a stale socket
+    if os.path.exists(str(socket_path)):
+        os.unlink(str(socket_path))
+    server = JobServer(socket_path, max_cache_nbytes)
+
+    # Exit cleanly (removing the socket) on termination
+    def terminate(signum, frame):
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        logger.info('Serving on: {}', socket_path)
+        while not server.shutdown_requested:
+            server.handle_request()
+    finally:
+        server.server_close()
+        if os.path.exists(str(socket_path)):
+            os.unlink(str(socket_path))
+        logger.info('Stopped serving on: {}', socket_path)
+
+
+def submit_job(socket_path, job):
+    """
+    Send the given job (dictionary) to the server listening on the
+    given socket and return (status dictionary, report text).
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(socket_path))
+        sock.sendall((json.dumps(job) + '\n').encode())
+        with sock.makefile('rb') as file:
+            status = json.loads(file.readline().decode())
+            report = file.read().decode()
+    return status, report
+
+
+def absolutize_job_filenames(job):
+    """
+    Return a copy of the given job with relative filenames made
+    absolute with respect to the current working directory.
+    """
+    job = dict(job)
+    for name in job_filename_arg_names:
+        if job.get(name) is not None:
+            job[name] = os.path.abspath(job[name])
+    return job
+
+
+def serve_main(prog_name, *args):
+    arg_prsr = argparse.ArgumentParser(
+        prog=prog_name,
+        description=(
+            'Serve modeling jobs on a Unix socket, keeping recently '
+            'used data and tables in memory.  Submit jobs with '
+            '`tsufvml_submit`.'),
+        allow_abbrev=False,
+    )
+    arg_prsr.add_argument(
+        '--version',
+        action='version',
+        version='tsufvml {}'.format(tsufvml.__version__),
+    )
+    arg_prsr.add_argument(
+        'socket',
+        metavar='SOCKET',
+        help='Filename of the Unix socket on which to listen.',
+    )
+    arg_prsr.add_argument(
+        '--max-cache-mb',
+        type=float,
+        default=1024,
+        metavar='MB',
+        help=(
+            'Limit on the memory used for caching loaded data and '
+            'tables, in megabytes.  [default: %(default)s]'),
+    )
+    env = arg_prsr.parse_args(args)
+    from barnapy import logging
+    logging.default_config()
+    serve(env.socket, int(env.max_cache_mb * 2**20))
+
+
+def serve_cli_main():
+    serve_main(os.path.basename(sys.argv[0]), *sys.argv[1:])
+
+
+def submit_main(prog_name, *args):
+    arg_prsr = argparse.ArgumentParser(
+        prog=prog_name,
+        description=(
+            'Submit a modeling job to a server started with '
+            '`tsufvml_serve` and write the report to stdout.  The job '
+            'is a JSON object whose keys are the names of the '
+            'arguments of `tsufvml.cli.run_models_api`, e.g. '
+            '{"data_matrix_filename": "data.svmlight", '
+            '"model_family": "rf", "model_args": {"max_depth": 5}}.  '
+            'Relative '
+            'filenames are interpreted with respect to the current '
+            'directory.'),
+        allow_abbrev=False,
+    )
+    arg_prsr.add_argument(
+        '--version',
+        action='version',
+        version='tsufvml {}'.format(tsufvml.__version__),
+    )
+    arg_prsr.add_argument(
+        'socket',
+        metavar='SOCKET',
+        help='Filename of the Unix socket on which the server listens.',
+    )
+    arg_prsr.add_argument(
+        'job',
+        type=argparse.FileType('rt'),
+        nargs='?',
+        default=sys.stdin,
+        metavar='JOB',
+        help='File containing the job as JSON.  [default: stdin]',
+    )
+    arg_prsr.add_argument(
+        '--command',
+        choices=('run', 'stats', 'shutdown'),
+        default='run',
+        help=(
+            'Run the job, report cache statistics, or shut down the '
+            'server.  [default: %(default)s]'),
+    )
+    env = arg_prsr.parse_args(args)
+    if env.command == 'run':
+        job = absolutize_job_filenames(json.load(env.job))
+    else:
+        job = {}
+    job['command'] = env.command
+    status, report = submit_job(env.socket, job)
+    sys.stdout.write(report)
+    if status.get('status') != 'ok':
+        arg_prsr.exit(1, 'Error: {}\n'.format(status.get('message')))
+    elif env.command == 'stats':
+        print(json.dumps(status))
+
+
+def submit_cli_main():
+    submit_main(os.path.basename(sys.argv[0]), *sys.argv[1:])
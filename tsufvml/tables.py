@@ -0,0 +1,440 @@
+"""Compact, array-backed feature and concept tables"""
+
+# Copyright (c) 2019 Aubrey Barnard.
+#
+# This is free software released under the MIT License.  See
+# `LICENSE.txt` for details.
+
+
+import collections.abc
+import os
+import tempfile
+
+
+# Version of the format of cached tables.  Increment when the format
+# changes to invalidate existing caches.
+_cache_format_version = 2
+_cache_suffix = '.npz'
+# Subdirectory of the cache directory for cached tables
+_cache_dirname = 'tables'
+
+
+class StringPool:
+    """
+    Sequence of strings stored as one UTF-8 byte string plus an array
+    of offsets.  Empty strings are returned as `None`.
+    """
+
+    def __init__(self, text, offsets):
+        self.text = text
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings):
+        import numpy
+        encoded = [(s or '').encode('utf-8') for s in strings]
+        offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return cls(b''.join(encoded), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        sta = self.offsets[idx]
+        end = self.offsets[idx + 1]
+        return self.text[sta:end].decode('utf-8') if end > sta else None
+
+    @property
+    def nbytes(self):
+        return len(self.text) + self.offsets.nbytes
+
+
+class StringIndex:
+    """
+    Index of the positions of the strings in a sequence that supports
+    finding all the positions of a given string by binary search.
+    Missing (and empty) strings are not indexed.
+    """
+
+    def __init__(self, keys, positions):
+        # `keys` is a sorted array of UTF-8 encoded strings and
+        # `positions` gives the position of each key in the sequence
+        self.keys = keys
+        self.positions = positions
+
+    @classmethod
+    def from_strings(cls, strings):
+        import numpy
+        keys = []
+        positions = []
+        for (position, string) in enumerate(strings):
+            if string:
+                keys.append(string.encode('utf-8'))
+                positions.append(position)
+        keys = numpy.array(keys, dtype=bytes)
+        positions = numpy.array(positions, dtype=numpy.int64)
+        # A stable sort keeps the positions of equal keys in order
+        order = numpy.argsort(keys, kind='mergesort')
+        return cls(keys[order], positions[order])
+
+    def find(self, string):
+        """Return the (sorted) positions of the given string."""
+        import numpy
+        key = string.encode('utf-8') if isinstance(string, str) else b''
+        # Longer keys cannot be in the array and would be truncated
+        if not key or len(key) > self.keys.dtype.itemsize:
+            return self.positions[:0]
+        sta = numpy.searchsorted(self.keys, key, side='left')
+        end = numpy.searchsorted(self.keys, key, side='right')
+        return self.positions[sta:end]
+
+    def select(self, keep):
+        """
+        Return the index of the subsequence of the positions where the
+        given Boolean array is true.
+        """
+        import numpy
+        new_positions = numpy.cumsum(keep) - 1
+        mask = keep[self.positions]
+        return type(self)(
+            self.keys[mask], new_positions[self.positions[mask]])
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.positions.nbytes
+
+
+class FeatureTable(collections.abc.Mapping):
+    """
+    Mapping of feature IDs (ints) to (feature name, feature value)
+    tuples, where the value is typically a concept ID.
+
+    The IDs are stored in a sorted array and the names and values in
+    string pools, which is much more compact than a dictionary of
+    tuples.  Lookup by ID is by binary search.  Missing names and
+    values are `None`.
+
+    Features can also be looked up by name or by value (concept) with
+    `ids_with_name` and `ids_with_value`, which use indices that are
+    built on first use and cached along with the table.
+    """
+
+    def __init__(self, ids, names, values, pool_idxs=None,
+                 name_index=None, value_index=None):
+        # `ids` is sorted and `pool_idxs` gives the index in the string
+        # pools of the entry for each ID
+        self.ids = ids
+        self.names = names
+        self.values = values
+        self.pool_idxs = pool_idxs
+        self._name_index = name_index
+        self._value_index = value_index
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Make a table from an iterable of (ID, name, value) tuples.
+        Later rows replace earlier rows with the same ID.
+        """
+        import numpy
+        ids = []
+        names = []
+        values = []
+        for (feat_id, name, value) in rows:
+            ids.append(feat_id)
+            names.append(name)
+            values.append(value)
+        ids = numpy.array(ids, dtype=numpy.int64)
+        # Sort by ID, keeping the last of any duplicates
+        order = numpy.argsort(ids, kind='mergesort')
+        is_last = numpy.ones(len(order), dtype=bool)
+        is_last[:-1] = ids[order[1:]] != ids[order[:-1]]
+        order = order[is_last]
+        return cls(ids[order],
+                   StringPool.from_strings(names),
+                   StringPool.from_strings(values),
+                   order)
+
+    @classmethod
+    def from_ids(cls, ids):
+        """Make a table of the given IDs with no names or values."""
+        import numpy
+        ids = numpy.unique(numpy.asarray(ids, dtype=numpy.int64))
+        empty = StringPool.from_strings([None] * len(ids))
+        return cls(ids, empty, empty)
+
+    def _find(self, feat_id):
+        """Return the index of the given ID in `ids` or -1."""
+        import numpy
+        if not isinstance(feat_id, (int, numpy.integer)):
+            return -1
+        idx = int(numpy.searchsorted(self.ids, feat_id))
+        if idx < len(self.ids) and self.ids[idx] == feat_id:
+            return idx
+        return -1
+
+    def _entry(self, idx):
+        pool_idx = (self.pool_idxs[idx]
+                    if self.pool_idxs is not None else idx)
+        return (self.names[pool_idx], self.values[pool_idx])
+
+    def _pool_strings(self, pool):
+        """Return a list of the strings of each entry in the pool."""
+        pool_idxs = (self.pool_idxs.tolist() if self.pool_idxs is not None
+                     else range(len(self.ids)))
+        return [pool[pool_idx] for pool_idx in pool_idxs]
+
+    @property
+    def name_index(self):
+        """`StringIndex` of the positions of the feature names"""
+        if self._name_index is None:
+            self._name_index = StringIndex.from_strings(
+                self._pool_strings(self.names))
+        return self._name_index
+
+    @property
+    def value_index(self):
+        """`StringIndex` of the positions of the feature values"""
+        if self._value_index is None:
+            self._value_index = StringIndex.from_strings(
+                self._pool_strings(self.values))
+        return self._value_index
+
+    def __getitem__(self, feat_id):
+        idx = self._find(feat_id)
+        if idx < 0:
+            raise KeyError(feat_id)
+        return self._entry(idx)
+
+    def __contains__(self, feat_id):
+        return self._find(feat_id) >= 0
+
+    def ids_with_name(self, name):
+        """Return the (sorted) array of IDs of features with the name."""
+        return self.ids[self.name_index.find(name)]
+
+    def ids_with_value(self, value):
+        """
+        Return the (sorted) array of IDs of features with the value,
+        e.g. all the features of a concept.
+        """
+        return self.ids[self.value_index.find(value)]
+
+    def ids_with_names(self, names):
+        """
+        Return a dictionary mapping each of the given names to the
+        (sorted) array of IDs of features with that name.
+        """
+        return {name: self.ids_with_name(name) for name in names}
+
+    def ids_with_values(self, values):
+        """
+        Return a dictionary mapping each of the given values to the
+        (sorted) array of IDs of features with that value.
+        """
+        return {value: self.ids_with_value(value) for value in values}
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def __len__(self):
+        return len(self.ids)
+
+    def items(self):
+        for idx, feat_id in enumerate(self.ids.tolist()):
+            yield feat_id, self._entry(idx)
+
+    def without(self, feat_ids):
+        """Return a table without the given feature IDs."""
+        import numpy
+        keep = ~numpy.isin(self.ids, numpy.asarray(feat_ids))
+        pool_idxs = (self.pool_idxs if self.pool_idxs is not None
+                     else numpy.arange(len(self.ids)))
+        return type(self)(
+            self.ids[keep], self.names, self.values, pool_idxs[keep],
+            (self._name_index.select(keep)
+             if self._name_index is not None else None),
+            (self._value_index.select(keep)
+             if self._value_index is not None else None),
+        )
+
+    @property
+    def nbytes(self):
+        return sum(obj.nbytes for obj in (
+            self.ids, self.names, self.values, self.pool_idxs,
+            self._name_index, self._value_index)
+            if obj is not None)
+
+    def to_arrays(self):
+        import numpy
+        return dict(
+            ids=self.ids,
+            name_text=numpy.frombuffer(self.names.text, dtype=numpy.uint8),
+            name_offsets=self.names.offsets,
+            value_text=numpy.frombuffer(
+                self.values.text, dtype=numpy.uint8),
+            value_offsets=self.values.offsets,
+            pool_idxs=(self.pool_idxs if self.pool_idxs is not None
+                       else numpy.arange(len(self.ids))),
+            name_index_keys=self.name_index.keys,
+            name_index_positions=self.name_index.positions,
+            value_index_keys=self.value_index.keys,
+            value_index_positions=self.value_index.positions,
+        )
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(
+            arrays['ids'],
+            StringPool(arrays['name_text'].tobytes(),
+                       arrays['name_offsets']),
+            StringPool(arrays['value_text'].tobytes(),
+                       arrays['value_offsets']),
+            arrays['pool_idxs'],
+            StringIndex(arrays['name_index_keys'],
+                        arrays['name_index_positions']),
+            StringIndex(arrays['value_index_keys'],
+                        arrays['value_index_positions']),
+        )
+
+
+class ConceptTable(collections.abc.Mapping):
+    """
+    Mapping of concept IDs (strings) to descriptions.
+
+    The IDs are stored (UTF-8 encoded) in a sorted array and the
+    descriptions in a string pool.  Lookup is by binary search.
+    Missing descriptions are `None`.
+    """
+
+    def __init__(self, ids, descriptions):
+        self.ids = ids
+        self.descriptions = descriptions
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Make a table from an iterable of (ID, description) tuples.
+        Later rows replace earlier rows with the same ID.
+        """
+        import numpy
+        entries = {}
+        for (cncpt_id, desc) in rows:
+            entries[cncpt_id.encode('utf-8')] = desc
+        ids = sorted(entries)
+        return cls(numpy.array(ids, dtype=bytes),
+                   StringPool.from_strings(entries[i] for i in ids))
+
+    def _find(self, cncpt_id):
+        import numpy
+        if not isinstance(cncpt_id, str) or len(self.ids) == 0:
+            return -1
+        key = cncpt_id.encode('utf-8')
+        # Longer keys cannot be in the array and would be truncated
+        if len(key) > self.ids.dtype.itemsize:
+            return -1
+        idx = int(numpy.searchsorted(self.ids, key))
+        if idx < len(self.ids) and self.ids[idx] == key:
+            return idx
+        return -1
+
+    def __getitem__(self, cncpt_id):
+        idx = self._find(cncpt_id)
+        if idx < 0:
+            raise KeyError(cncpt_id)
+        return self.descriptions[idx]
+
+    def __contains__(self, cncpt_id):
+        return self._find(cncpt_id) >= 0
+
+    def __iter__(self):
+        return (cncpt_id.decode('utf-8') for cncpt_id in self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        return self.ids.nbytes + self.descriptions.nbytes
+
+    def to_arrays(self):
+        import numpy
+        return dict(
+            ids=self.ids,
+            description_text=numpy.frombuffer(
+                self.descriptions.text, dtype=numpy.uint8),
+            description_offsets=self.descriptions.offsets,
+        )
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(
+            arrays['ids'],
+            StringPool(arrays['description_text'].tobytes(),
+                       arrays['description_offsets']),
+        )
+
+
+def cache_filename(path, cache_dir):
+    """
+    Return the filename of the binary cache in the given cache
+    directory of the table at the given path.
+    """
+    from tsufvml import matrix
+    return os.path.join(
+        str(cache_dir), _cache_dirname,
+        os.path.basename(matrix.cache_dir_for(path, cache_dir))
+        + _cache_suffix)
+
+
+def load_cached(filename, table_class, load, cache_dir):
+    """
+    Return the table loaded from the binary cache of the given source
+    file in `cache_dir`, or load it with `load()` and write the cache.
+
+    The cache is valid as long as the size and modification time of
+    the source file are unchanged.  Failing to write the cache (e.g.
+    due to permissions) is not an error.
+    """
+    import numpy
+    from barnapy import logging
+    from tsufvml import matrix
+    logger = logging.getLogger(__name__)
+    path = matrix.file_path(filename)
+    if path is None:
+        return load()
+    size, mtime_ns = matrix.file_signature(path)
+    cache_path = cache_filename(path, cache_dir)
+    signature = numpy.array(
+        [_cache_format_version, size, mtime_ns], dtype=numpy.int64)
+    # Use the cache if it matches the current file
+    if os.path.exists(cache_path):
+        try:
+            with numpy.load(cache_path) as arrays:
+                if numpy.array_equal(arrays['signature'], signature):
+                    logger.info('Loading cached table from: {}',
+                                cache_path)
+                    return table_class.from_arrays(
+                        {name: arrays[name] for name in arrays.files})
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning('Ignoring unreadable cached table: {}: {}',
+                           cache_path, e)
+    # Load the table and store it.  Write to a temporary file and then
+    # rename it so that readers never see a partial file.
+    table = load()
+    tmp_path = None
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            prefix='.tmp-', suffix=_cache_suffix,
+            dir=os.path.dirname(cache_path))
+        with os.fdopen(fd, 'wb') as file:
+            numpy.savez(file, signature=signature, **table.to_arrays())
+        os.replace(tmp_path, cache_path)
+        logger.info('Cached table in: {}', cache_path)
+    except OSError as e:
+        logger.info('Not caching table: {}: {}', cache_path, e)
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    return table